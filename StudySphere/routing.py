@@ -1,7 +1,21 @@
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'StudySphere.settings')
+
+# Django is set up before the websocket routes are imported as they depend on the models
+django_asgi_app = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import chat.routing
+from chat.persistence import lifespan
+import courses.routing
 
 application = ProtocolTypeRouter({
-    'websocket': AuthMiddlewareStack(URLRouter(chat.routing.websocket_urlpatterns))
-})
\ No newline at end of file
+    'http': django_asgi_app,
+    # Saves buffered chat messages when the worker shuts down
+    'lifespan': lifespan,
+    'websocket': AuthMiddlewareStack(URLRouter(chat.routing.websocket_urlpatterns + courses.routing.websocket_urlpatterns))
+})
@@ -34,6 +34,9 @@ DEVELOPMENT_MODE = os.getenv("DEVELOPMENT_MODE", "False") == "True"
 # DEBUG = True
 # DEVELOPMENT_MODE = True
 
+# Set when the test suite is being run
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
 ALLOWED_HOSTS = os.getenv("DJANGO_ALLOWED_HOSTS", "127.0.0.1,localhost").split(",")
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -43,6 +46,14 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = 'studysphereauth@gmail.com'  
 EMAIL_HOST_PASSWORD = 'orfu yluf rpkn xjkb'    
 
+# Emails are sent one per recipient over a single connection, EMAIL_BATCH_SIZE messages at a time,
+# throttled to EMAIL_RATE_LIMIT messages per second (0 disables throttling). Transient SMTP errors
+# are retried up to EMAIL_MAX_RETRIES times, waiting EMAIL_RETRY_BACKOFF seconds doubled on each retry.
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", 100))
+EMAIL_RATE_LIMIT = float(os.getenv("EMAIL_RATE_LIMIT", 0))
+EMAIL_MAX_RETRIES = int(os.getenv("EMAIL_MAX_RETRIES", 5))
+EMAIL_RETRY_BACKOFF = int(os.getenv("EMAIL_RETRY_BACKOFF", 30))
+
 
 # Comment for prod
 # CELERY_BROKER_URL = 'redis://localhost:6379'
@@ -52,6 +63,16 @@ EMAIL_HOST_PASSWORD = 'orfu yluf rpkn xjkb'
 CELERY_BROKER_URL = os.getenv("REDIS_URL")
 CELERY_RESULT_BACKEND = os.getenv("REDIS_URL")
 
+# Old notifications are pruned daily, read ones after NOTIFICATION_READ_RETENTION_DAYS and unread ones after NOTIFICATION_UNREAD_RETENTION_DAYS
+CELERY_BEAT_SCHEDULE = {
+    'prune-notifications': {
+        'task': 'courses.tasks.prune_notifications',
+        'schedule': 60 * 60 * 24,
+    },
+}
+NOTIFICATION_READ_RETENTION_DAYS = int(os.getenv("NOTIFICATION_READ_RETENTION_DAYS", 30))
+NOTIFICATION_UNREAD_RETENTION_DAYS = int(os.getenv("NOTIFICATION_UNREAD_RETENTION_DAYS", 180))
+
 INSTALLED_APPS = [
     'core_study',
     'users',
@@ -69,6 +90,8 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'users.StudySphereUser'
 
 MIDDLEWARE = [
+    # Only loaded when REQUEST_INSTRUMENTATION is enabled, first so that it times the other middleware too
+    'core_study.instrumentation.RequestInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -104,6 +127,15 @@ ASGI_APPLICATION = 'StudySphere.routing.application'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'images')
 MEDIA_URL =  '/images/'
 
+# Widths in pixels that uploaded images are resized to, the templates pick between them with srcset
+IMAGE_DERIVATIVE_WIDTHS = [int(width) for width in os.getenv("IMAGE_DERIVATIVE_WIDTHS", "160,320,640,1280").split(",")]
+
+# Downloads of uploaded PDFs can be handed to the web server by setting FILE_DOWNLOAD_OFFLOAD to
+# "sendfile" (X-Sendfile, Apache / lighttpd) or "accel" (X-Accel-Redirect, nginx), in which case
+# FILE_DOWNLOAD_ACCEL_PREFIX is the internal location that MEDIA_ROOT is exposed under
+FILE_DOWNLOAD_OFFLOAD = os.getenv("FILE_DOWNLOAD_OFFLOAD") or None
+FILE_DOWNLOAD_ACCEL_PREFIX = os.getenv("FILE_DOWNLOAD_ACCEL_PREFIX", "/protected/")
+
 STATIC_URL = "/static/"
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 
@@ -173,7 +205,17 @@ USE_I18N = True
 
 USE_TZ = True
 
-if DEBUG == True:
+# The channel layer is either "redis" or "memory", the in-memory layer only works within a single
+# process and is used for tests and benchmarks so that chat can be run without Redis
+CHANNEL_LAYER = os.getenv("CHANNEL_LAYER", "memory" if TESTING else "redis")
+
+if CHANNEL_LAYER == "memory":
+    CHANNEL_LAYERS = {
+        'default' : {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+elif DEBUG == True:
     CHANNEL_LAYERS = {
         'default' : {
             'BACKEND': 'channels_redis.core.RedisChannelLayer',
@@ -187,9 +229,59 @@ else:
             'default' : {
             'BACKEND': 'channels_redis.core.RedisChannelLayer',
             'CONFIG': {
-                'hosts' : [(os.getenv("REDIS_URL"), 6379)]
+                'hosts' : [os.getenv("REDIS_URL")]
             },
         },
     }
 
+# Caching is done in memory when running tests or when no Redis instance is configured
+if TESTING or os.getenv("REDIS_URL") is None:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv("REDIS_URL"),
+        },
+    }
+
+# Amount of seconds each section of the homepage is cached for
+HOMEPAGE_CACHE_TIMEOUT = int(os.getenv("HOMEPAGE_CACHE_TIMEOUT", 300))
+# Each worker counts its homepage cache hits and misses and adds them to the shared counters every this many seconds
+HOMEPAGE_CACHE_STATS_FLUSH_INTERVAL = int(os.getenv("HOMEPAGE_CACHE_STATS_FLUSH_INTERVAL", 10))
+
+# Amount of seconds each page of the catalog shown to visitors is cached for, pages are also dropped when a course changes
+CATALOG_CACHE_TIMEOUT = int(os.getenv("CATALOG_CACHE_TIMEOUT", 3600))
+
+# When enabled every request's query count, database time, template time and wall time are recorded by
+# core_study.instrumentation, sent in a Server-Timing header and aggregated per route (see `manage.py request_timings`)
+# Requests taking REQUEST_SLOW_MS milliseconds or more are logged with their repeated queries, and each worker
+# merges its timings into the cache every REQUEST_TIMINGS_FLUSH_INTERVAL seconds
+REQUEST_INSTRUMENTATION = os.getenv("REQUEST_INSTRUMENTATION", "False") == "True"
+REQUEST_SLOW_MS = int(os.getenv("REQUEST_SLOW_MS", 500))
+REQUEST_TIMINGS_FLUSH_INTERVAL = int(os.getenv("REQUEST_TIMINGS_FLUSH_INTERVAL", 10))
+# Templates are rendered by a backend that times them, but only while instrumentation is enabled
+if REQUEST_INSTRUMENTATION:
+    TEMPLATES[0]['BACKEND'] = 'core_study.instrumentation.InstrumentedTemplates'
+
+# When enabled chat messages are broadcast immediately and saved in batches by chat.persistence
+# A batch is written every CHAT_WRITE_BEHIND_BATCH_SIZE messages or CHAT_WRITE_BEHIND_FLUSH_INTERVAL milliseconds
+# and at most CHAT_WRITE_BEHIND_MAX_QUEUE messages are held in memory per worker
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "False") == "True"
+CHAT_WRITE_BEHIND_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BEHIND_BATCH_SIZE", 100))
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL = int(os.getenv("CHAT_WRITE_BEHIND_FLUSH_INTERVAL", 200))
+CHAT_WRITE_BEHIND_MAX_QUEUE = int(os.getenv("CHAT_WRITE_BEHIND_MAX_QUEUE", 10000))
+
+# Presence and typing updates are sent to a room at most once every CHAT_PRESENCE_INTERVAL seconds
+# and a user is shown as typing for CHAT_TYPING_TIMEOUT seconds after their last typing event
+CHAT_PRESENCE_INTERVAL = float(os.getenv("CHAT_PRESENCE_INTERVAL", 1))
+CHAT_TYPING_TIMEOUT = float(os.getenv("CHAT_TYPING_TIMEOUT", 5))
+
+# Clients using a batched chat protocol receive the messages sent within each CHAT_BATCH_WINDOW seconds in one frame
+CHAT_BATCH_WINDOW = float(os.getenv("CHAT_BATCH_WINDOW", 0.05))
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
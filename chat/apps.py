@@ -1,6 +1,15 @@
+import atexit
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        # Buffered chat messages are saved when the worker exits
+        if settings.CHAT_WRITE_BEHIND:
+            from .persistence import save_remaining
+            atexit.register(save_remaining)
@@ -1,13 +1,52 @@
+import asyncio
 import json
+import logging
+import msgpack
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.utils import timezone
 from .models import ChatMessage, ChatRoom
-from asgiref.sync import sync_to_async  # Import sync_to_async
-from django.contrib.auth import get_user_model
+from .persistence import get_writer
+from . import presence
+
+logger = logging.getLogger(__name__)
+
+# Looks up the id of a chat room by its name, None if the room doesn't exist
+@database_sync_to_async
+def get_room_id(room_name):
+    return ChatRoom.objects.filter(name=room_name).values_list('id', flat=True).first()
+
+# Saves a chat message in a single insert
+@database_sync_to_async
+def save_message(room_id, user_id, message):
+    return ChatMessage.objects.create(room_id=room_id, user_id=user_id, message=message)
+
+# Clients can opt in to a batched protocol by requesting one of these websocket subprotocols.
+# Messages sent to the room within CHAT_BATCH_WINDOW seconds are then delivered together in one
+# frame as structured fields, encoded as JSON text or msgpack binary frames.
+# Clients that don't request a subprotocol get one "username: message" text frame per message and no presence.
+SUBPROTOCOL_JSON = 'studysphere.batch.json'
+SUBPROTOCOL_MSGPACK = 'studysphere.batch.msgpack'
+SUBPROTOCOLS = [SUBPROTOCOL_JSON, SUBPROTOCOL_MSGPACK]
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
         self.room_group_name = 'chat_%s' % self.room_name
+        self.user = self.scope['user']
+        self.joined = False
+        # The first supported subprotocol the client asked for, None for the plain protocol
+        self.protocol = next((protocol for protocol in self.scope.get('subprotocols', []) if protocol in SUBPROTOCOLS), None)
+        self.outbox = []
+        self.flush_task = None
+
+        # The room is resolved once here rather than on every message
+        self.room_id = await get_room_id(self.room_name)
+        if self.room_id is None or not self.user.is_authenticated:
+            await self.close()
+            return
 
         # Join room group
         await self.channel_layer.group_add(
@@ -15,32 +54,71 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        await self.accept()
+        await self.accept(subprotocol=self.protocol)
+
+        # Lets the room know that the user has joined
+        await presence.run_update(presence.join, self.room_name, self.user.id, self.user.username)
+        self.joined = True
+        await self.schedule_presence_update()
 
     async def disconnect(self, close_code):
+        # A batch still waiting for its window can't be sent on the closed socket, so it is dropped
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        self.outbox = []
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        if self.joined:
+            await presence.run_update(presence.leave, self.room_name, self.user.id)
+            await self.schedule_presence_update()
+        # Makes sure buffered messages are saved before the connection goes away
+        # A failed flush is retried by the writer, so it doesn't fail the disconnect
+        if settings.CHAT_WRITE_BEHIND:
+            try:
+                await get_writer().flush()
+            except Exception:
+                logger.exception('Failed to save buffered chat messages on disconnect')
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # Clients using the msgpack protocol send binary frames
+        if bytes_data is not None:
+            data = msgpack.unpackb(bytes_data)
+        else:
+            data = json.loads(text_data)
+
+        # Typing indicators are sent as {"typing": true} or {"typing": false}
+        if 'typing' in data:
+            await presence.run_update(presence.set_typing, self.room_name, self.user.id, bool(data['typing']))
+            await self.schedule_presence_update()
+            return
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
         message = data['message']
-        user_id = self.scope['user'].id
 
-        # Save message to database using sync_to_async
-        room = await sync_to_async(ChatRoom.objects.get)(name=self.room_name)
-        user = await sync_to_async(get_user_model().objects.get)(id=user_id)
-        await sync_to_async(ChatMessage.objects.create)(room=room, user=user, message=message)
+        # With write-behind the message is broadcast straight away and saved in a later batch,
+        # so it doesn't have an id yet
+        if settings.CHAT_WRITE_BEHIND:
+            await self.broadcast(message, None, timezone.now())
+            await get_writer().add(self.room_id, self.user.id, message)
+        else:
+            # Save message to database, the room and user are already known
+            saved = await save_message(self.room_id, self.user.id, message)
+            await self.broadcast(message, saved.id, saved.timestamp)
 
-        # Broadcast message to room group
+    # Broadcast message to room group
+    async def broadcast(self, message, message_id, timestamp):
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message',
                 'message': message,
-                'username': user.username
+                'message_id': message_id,
+                'user_id': self.user.id,
+                'username': self.user.username,
+                'timestamp': timestamp.isoformat(),
             }
         )
 
@@ -49,7 +127,59 @@ class ChatConsumer(AsyncWebsocketConsumer):
         message = event['message']
         username = event['username']
 
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'message': f'{username}: {message}'
-        }))
\ No newline at end of file
+        if self.protocol is None:
+            # Send message to WebSocket
+            await self.send(text_data=json.dumps({
+                'message': f'{username}: {message}'
+            }))
+            return
+
+        # Batched clients get the message in the next frame, sent once the batch window closes
+        self.outbox.append({
+            'id': event['message_id'],
+            'user_id': event['user_id'],
+            'username': username,
+            'message': message,
+            'timestamp': event['timestamp'],
+        })
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_outbox())
+
+    # Sends every message collected during the batch window in a single frame
+    async def flush_outbox(self):
+        await asyncio.sleep(settings.CHAT_BATCH_WINDOW)
+        messages, self.outbox = self.outbox, []
+        self.flush_task = None
+        await self.send_frame({'type': 'messages', 'messages': messages})
+
+    # Sends structured data to a batched client in the encoding it negotiated
+    async def send_frame(self, data):
+        if self.protocol == SUBPROTOCOL_MSGPACK:
+            await self.send(bytes_data=msgpack.packb(data))
+        else:
+            await self.send(text_data=json.dumps(data))
+
+    # Presence changes are coalesced so that a room gets at most one update per CHAT_PRESENCE_INTERVAL
+    # The first change after an update claims the next one, which is sent once the interval has passed
+    # and carries the state at that point, including any changes made in the meantime by any worker
+    async def schedule_presence_update(self):
+        if await sync_to_async(presence.claim_broadcast)(self.room_name):
+            asyncio.ensure_future(self.send_presence_update())
+
+    async def send_presence_update(self):
+        await asyncio.sleep(settings.CHAT_PRESENCE_INTERVAL)
+        await sync_to_async(presence.release_broadcast)(self.room_name)
+        state = await sync_to_async(presence.get_presence)(self.room_name)
+        await self.channel_layer.group_send(self.room_group_name, {'type': 'presence_update', **state})
+
+    # Receive a presence update from room group
+    # Only batched clients are sent presence, plain clients expect nothing but "username: message" text frames
+    async def presence_update(self, event):
+        if self.protocol is None:
+            return
+        await self.send_frame({
+            'type': 'presence',
+            'online': event['online'],
+            'users': event['users'],
+            'typing': event['typing'],
+        })
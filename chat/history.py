@@ -0,0 +1,17 @@
+from core_study import keyset
+from .models import ChatMessage
+
+# Amount of messages shown when a room is opened and fetched per scroll-back
+CHAT_HISTORY_PAGE_SIZE = 50
+
+# History is paginated backwards with a keyset (cursor) on (timestamp, id), see core_study.keyset, so that each
+# page is an indexed range scan on (room, timestamp) however long the room has existed. The cursor points at
+# the oldest message already shown.
+
+# Returns the page of messages sent in a room before the cursor (the latest messages without one)
+# in chronological order, along with the cursor of the next older page (None when there is none)
+def get_history_page(room_name, cursor=None, page_size=CHAT_HISTORY_PAGE_SIZE):
+    messages = ChatMessage.objects.filter(room__name=room_name).select_related('user')
+    messages, next_cursor = keyset.get_page(messages, 'timestamp', cursor, page_size)
+    messages.reverse()
+    return messages, next_cursor
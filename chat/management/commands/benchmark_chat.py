@@ -0,0 +1,155 @@
+import asyncio
+import json
+import statistics
+import time
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+import msgpack
+
+import chat.routing
+from chat.consumers import SUBPROTOCOL_JSON, SUBPROTOCOL_MSGPACK
+from chat.models import ChatMessage, ChatRoom
+
+PROTOCOLS = {'plain': None, 'json': SUBPROTOCOL_JSON, 'msgpack': SUBPROTOCOL_MSGPACK}
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        # Large enough that no broadcast is dropped while clients are still sending
+        'CONFIG': {'capacity': 100000},
+    },
+}
+
+# Returns the value below which the given percentage of the sorted values fall
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+# Measures chat throughput and delivery latency through the ChatConsumer with N rooms of M clients
+# Every client in a room sends messages concurrently and receives every message sent to its room.
+# Clients are driven through channels' WebsocketCommunicator against a throwaway test database,
+# on the in-memory channel layer by default or the configured one (such as Redis) with --layer configured.
+class Command(BaseCommand):
+    help = 'Benchmarks chat message throughput and latency through the ChatConsumer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=1, help='Amount of chat rooms')
+        parser.add_argument('--clients', type=int, default=5, help='Amount of clients connected to each room')
+        parser.add_argument('--messages', type=int, default=200, help='Messages sent by each client')
+        parser.add_argument('--protocol', choices=list(PROTOCOLS), default='plain', help='Protocol the clients negotiate')
+        parser.add_argument('--layer', choices=['memory', 'configured'], default='memory', help='Channel layer to run against')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        layers = IN_MEMORY_CHANNEL_LAYERS if options['layer'] == 'memory' else settings.CHANNEL_LAYERS
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(CHANNEL_LAYERS=layers):
+                results = asyncio.run(self.run_benchmark(options['rooms'], options['clients'], options['messages'], PROTOCOLS[options['protocol']]))
+            results['persisted'] = ChatMessage.objects.count()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.stdout.write(
+                f"{results['sent']} messages ({results['delivered']} deliveries in {results['frames']} frames) across {options['rooms']} rooms x {options['clients']} clients "
+                f"in {results['elapsed']:.2f}s: {results['messages_per_second']:.0f} messages/sec, "
+                f"latency p50 {results['latency_ms']['p50']:.1f}ms p95 {results['latency_ms']['p95']:.1f}ms p99 {results['latency_ms']['p99']:.1f}ms, "
+                f"{results['persisted']} persisted"
+            )
+
+    async def run_benchmark(self, rooms, clients, messages, protocol):
+        users = await asyncio.to_thread(self.create_data, rooms, clients)
+        application = URLRouter(chat.routing.websocket_urlpatterns)
+        room_clients = []
+        for room in range(rooms):
+            communicators = []
+            for user in users:
+                communicator = WebsocketCommunicator(application, f'/ws/chat/chat_room/benchmark_{room}/', subprotocols=[protocol] if protocol else None)
+                communicator.scope['user'] = user
+                connected, _ = await communicator.connect()
+                if not connected:
+                    raise RuntimeError('Client could not connect to the benchmark room')
+                communicators.append(communicator)
+            room_clients.append(communicators)
+
+        # Send times are keyed by the message text so that each delivery can be matched to its send
+        sent_at = {}
+        latencies = []
+        frames = []
+        started = time.perf_counter()
+        tasks = []
+        for room, communicators in enumerate(room_clients):
+            for client, communicator in enumerate(communicators):
+                tasks.append(self.send(communicator, f'{room}-{client}', messages, sent_at))
+                tasks.append(self.receive(communicator, protocol, clients * messages, sent_at, latencies, frames))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+        for communicators in room_clients:
+            for communicator in communicators:
+                await communicator.disconnect()
+
+        latencies.sort()
+        sent = rooms * clients * messages
+        return {
+            'rooms': rooms,
+            'clients': clients,
+            'messages': messages,
+            'sent': sent,
+            'delivered': len(latencies),
+            'frames': len(frames),
+            'elapsed': elapsed,
+            'messages_per_second': sent / elapsed,
+            'latency_ms': {
+                'mean': statistics.fmean(latencies) if latencies else 0.0,
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+            },
+        }
+
+    async def send(self, communicator, prefix, messages, sent_at):
+        for i in range(messages):
+            text = f'{prefix}-{i}'
+            sent_at[text] = time.perf_counter()
+            await communicator.send_json_to({'message': text})
+            # Yields so that clients interleave like they would over a network
+            await asyncio.sleep(0)
+
+    async def receive(self, communicator, protocol, expected, sent_at, latencies, frames):
+        received = 0
+        while received < expected:
+            output = await communicator.receive_output(timeout=60)
+            if protocol == SUBPROTOCOL_MSGPACK:
+                frame = msgpack.unpackb(output['bytes'])
+            else:
+                frame = json.loads(output['text'])
+            # Presence updates are not counted as deliveries
+            if frame.get('type') == 'presence':
+                continue
+            frames.append(1)
+            if protocol is None:
+                # Plain frames are formatted as "username: message"
+                texts = [frame['message'].split(': ', 1)[1]]
+            else:
+                texts = [message['message'] for message in frame['messages']]
+            now = time.perf_counter()
+            for text in texts:
+                latencies.append((now - sent_at[text]) * 1000)
+            received += len(texts)
+
+    def create_data(self, rooms, clients):
+        ChatRoom.objects.bulk_create([ChatRoom(name=f'benchmark_{room}') for room in range(rooms)])
+        return [get_user_model().objects.create(username=f'bench{i}', email=f'bench{i}@example.com') for i in range(clients)]
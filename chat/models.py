@@ -15,3 +15,6 @@ class ChatMessage(models.Model):
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['room', 'timestamp']), # History is paged per room by timestamp
+        ]
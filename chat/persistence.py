@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import weakref
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# A batch that fails to save this many flushes in a row is saved one message at a time instead,
+# and the messages that still fail (EG. of a room or user deleted since) are logged and dropped
+FLUSH_ATTEMPTS = 3
+
+# Write-behind persistence for chat messages. Rather than inserting every message before it is
+# broadcast, messages are buffered in memory and written with bulk_create once CHAT_WRITE_BEHIND_BATCH_SIZE
+# messages are waiting or every CHAT_WRITE_BEHIND_FLUSH_INTERVAL milliseconds, whichever comes first.
+# The buffer holds at most CHAT_WRITE_BEHIND_MAX_QUEUE messages, after which adding waits for a flush.
+class ChatMessageWriter:
+    def __init__(self, batch_size, flush_interval, max_queue):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.space = asyncio.Semaphore(max_queue)
+        self.batch_ready = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.failures = 0
+
+    # Buffers a message to be saved, waiting for room in the buffer when it is full
+    async def add(self, room_id, user_id, message):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        if self.space.locked():
+            # Flushes straight away rather than after the interval, as a writer is waiting for it
+            self.batch_ready.set()
+        await self.space.acquire()
+        self.buffer.append(ChatMessage(room_id=room_id, user_id=user_id, message=message))
+        if len(self.buffer) >= self.batch_size:
+            self.batch_ready.set()
+
+    # Flushes whenever a full batch is waiting or the flush interval passes
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.batch_ready.wait(), self.flush_interval / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_ready.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Failed to save buffered chat messages, retrying on the next flush')
+
+    # Saves every buffered message, returning once they are all in the database or dropped
+    # A failed batch is put back to be retried by the next flush, up to FLUSH_ATTEMPTS times
+    async def flush(self):
+        async with self.lock:
+            batch, self.buffer = self.buffer, []
+            if not batch:
+                return 0
+            try:
+                await save_messages(batch, self.batch_size)
+            except Exception:
+                self.failures += 1
+                if self.failures < FLUSH_ATTEMPTS:
+                    # Puts the messages back in front so that they are saved in order by the next flush
+                    self.buffer[:0] = batch
+                    raise
+                logger.exception('Failed to save %d buffered chat messages %d times, saving them one at a time', len(batch), self.failures)
+                await save_each_message(batch)
+            self.failures = 0
+            for _ in batch:
+                self.space.release()
+            return len(batch)
+
+    # Stops the periodic flushing and saves anything that is still buffered
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        while self.buffer:
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Failed to save buffered chat messages while closing, retrying')
+
+@database_sync_to_async
+def save_messages(messages, batch_size):
+    ChatMessage.objects.bulk_create(messages, batch_size=batch_size)
+
+# Saves messages one by one, logging and dropping the ones that can't be saved
+@database_sync_to_async
+def save_each_message(messages):
+    for message in messages:
+        try:
+            message.save()
+        except Exception:
+            logger.exception('Dropped chat message of user %s in room %s: %r', message.user_id, message.room_id, message.message)
+
+# Each event loop (and so each worker process) has its own writer
+_writers = weakref.WeakKeyDictionary()
+
+# Returns the writer of the running event loop, creating it from the settings on first use
+def get_writer():
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        writer = ChatMessageWriter(
+            settings.CHAT_WRITE_BEHIND_BATCH_SIZE,
+            settings.CHAT_WRITE_BEHIND_FLUSH_INTERVAL,
+            settings.CHAT_WRITE_BEHIND_MAX_QUEUE,
+        )
+        _writers[loop] = writer
+    return writer
+
+# Closes the writer of the running event loop when the worker shuts down, for servers sending ASGI lifespan events
+# See https://asgi.readthedocs.io/en/latest/specs/lifespan.html
+async def lifespan(scope, receive, send):
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            writer = _writers.get(asyncio.get_running_loop())
+            if writer is not None:
+                await writer.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+# Saves whatever the writers still hold when the process exits, for servers without lifespan events (such as daphne)
+# Their event loops have stopped by then, so the messages are saved synchronously
+def save_remaining():
+    for writer in list(_writers.values()):
+        batch, writer.buffer = writer.buffer, []
+        if not batch:
+            continue
+        try:
+            ChatMessage.objects.bulk_create(batch, batch_size=writer.batch_size)
+        except Exception:
+            logger.exception('Failed to save %d buffered chat messages on exit', len(batch))
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+# Presence (who is in a room) and typing state is kept in the cache so that it is shared by every
+# daphne worker. Each room has one entry holding the users in it, how many connections each of them
+# has open, and until when each typing user is considered to be typing.
+PRESENCE_TIMEOUT = 60 * 60 * 24 # Rooms nobody has joined or left for a day are forgotten
+
+logger = logging.getLogger(__name__)
+
+def _state_key(room_name):
+    return f'chat:presence:{room_name}'
+
+def _lock_key(room_name):
+    return f'chat:presence:{room_name}:lock'
+
+def _broadcast_key(room_name):
+    return f'chat:presence:{room_name}:broadcast'
+
+# How often and how long updates wait for another worker to finish updating the same room
+LOCK_ATTEMPTS = 100
+LOCK_RETRY_DELAY = 0.01 # seconds
+
+# Raised when another worker is updating the state of a room
+class RoomLocked(Exception):
+    pass
+
+# Applies update to the state of a room and saves it
+# Updates to a room are serialised across workers by a lock in the cache, cache.add only succeeds for one
+# caller at a time. When the room is locked RoomLocked is raised rather than updating it without the lock.
+def _update(room_name, update):
+    key = _lock_key(room_name)
+    if not cache.add(key, 1, timeout=5):
+        raise RoomLocked(room_name)
+    try:
+        state = cache.get(_state_key(room_name)) or {'users': {}, 'typing': {}}
+        update(state)
+        cache.set(_state_key(room_name), state, timeout=PRESENCE_TIMEOUT)
+    finally:
+        cache.delete(key)
+
+# Runs join, leave or set_typing from async code, retrying while the room is locked
+# The retries wait on the event loop, and the cache calls run outside the thread shared by every ORM call.
+# An update that still can't take the lock after LOCK_ATTEMPTS tries is logged and skipped.
+async def run_update(function, room_name, *args):
+    for _ in range(LOCK_ATTEMPTS):
+        try:
+            return await sync_to_async(function, thread_sensitive=False)(room_name, *args)
+        except RoomLocked:
+            await asyncio.sleep(LOCK_RETRY_DELAY)
+    logger.error('Skipped presence update %s of room %s, its lock was held for too long', function.__name__, room_name)
+
+# Records a connection of a user to a room
+def join(room_name, user_id, username):
+    def update(state):
+        user = state['users'].setdefault(user_id, {'username': username, 'connections': 0})
+        user['connections'] += 1
+    _update(room_name, update)
+
+# Records a connection of a user leaving a room, the user is removed once all of their connections have left
+def leave(room_name, user_id):
+    def update(state):
+        user = state['users'].get(user_id)
+        if user is None:
+            return
+        user['connections'] -= 1
+        if user['connections'] <= 0:
+            del state['users'][user_id]
+            state['typing'].pop(user_id, None)
+    _update(room_name, update)
+
+# Marks a user as typing for CHAT_TYPING_TIMEOUT seconds, or as no longer typing
+def set_typing(room_name, user_id, typing):
+    def update(state):
+        if typing:
+            state['typing'][user_id] = time.time() + settings.CHAT_TYPING_TIMEOUT
+        else:
+            state['typing'].pop(user_id, None)
+    _update(room_name, update)
+
+# Returns the amount of users online in a room, their usernames and who of them is typing
+def get_presence(room_name):
+    state = cache.get(_state_key(room_name)) or {'users': {}, 'typing': {}}
+    now = time.time()
+    users = state['users']
+    return {
+        'online': len(users),
+        'users': sorted(user['username'] for user in users.values()),
+        'typing': sorted(users[user_id]['username'] for user_id, until in state['typing'].items() if until > now and user_id in users),
+    }
+
+# Claims the next presence broadcast of a room, only one worker succeeds until release_broadcast is called
+# The timeout only matters when the claiming worker dies before releasing
+def claim_broadcast(room_name):
+    return cache.add(_broadcast_key(room_name), 1, timeout=60)
+
+def release_broadcast(room_name):
+    cache.delete(_broadcast_key(room_name))
@@ -1,8 +1,21 @@
-from django.test import TestCase, Client
+import asyncio
+import msgpack
+from asgiref.testing import ApplicationCommunicator
+from channels.routing import URLRouter
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
 from users.models import StudySphereUser
 
-from .models import ChatRoom
+from .models import ChatMessage, ChatRoom
+from .consumers import SUBPROTOCOL_JSON, SUBPROTOCOL_MSGPACK, ChatConsumer, get_room_id
+from .history import CHAT_HISTORY_PAGE_SIZE, get_history_page
+from .persistence import FLUSH_ATTEMPTS, ChatMessageWriter, get_writer
+from . import presence
+from .routing import websocket_urlpatterns
+from unittest.mock import patch
 import re
 
 # Testing the creation of chat rooms
@@ -30,3 +43,333 @@ class NewChatRoomViewTest(TestCase):
     def test_unauthenticated_user_redirected(self):
         response = self.client.get(reverse('new_chat_room'))
         self.assertEqual(response.status_code, 302)
+
+# Connects a websocket client to a room as the given user
+async def connect_to_room(room_name, user, subprotocols=None):
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/chat_room/{room_name}/', subprotocols=subprotocols)
+    communicator.scope['user'] = user
+    connected, _ = await communicator.connect()
+    return communicator, connected
+
+# Testing the chat consumer's message write path
+class ChatConsumerTest(TestCase):
+    def setUp(self):
+        self.user = StudySphereUser.objects.create(username='testuser', email='testuser@example.com', password='password')
+        self.room = ChatRoom.objects.create(name='test_room')
+
+    # Tests that a sent message is saved and broadcast to the room
+    async def test_message_saved_and_broadcast(self):
+        communicator, connected = await connect_to_room('test_room', self.user)
+        self.assertTrue(connected)
+        await communicator.send_json_to({'message': 'Hello'})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response, {'message': 'testuser: Hello'})
+        await communicator.disconnect()
+        message = await ChatMessage.objects.aget(room=self.room)
+        self.assertEqual((message.user_id, message.message), (self.user.id, 'Hello'))
+
+    # Tests that the room is only looked up on connect rather than for every message
+    async def test_room_resolved_once(self):
+        with patch('chat.consumers.get_room_id', wraps=get_room_id) as mock_get_room_id:
+            communicator, _ = await connect_to_room('test_room', self.user)
+            for i in range(3):
+                await communicator.send_json_to({'message': f'Hello {i}'})
+                await communicator.receive_json_from()
+            await communicator.disconnect()
+        mock_get_room_id.assert_called_once_with('test_room')
+        self.assertEqual(await ChatMessage.objects.filter(room=self.room, user=self.user).acount(), 3)
+
+    # Tests that rooms that don't exist and unauthenticated users are rejected
+    async def test_connect_rejected(self):
+        _, connected = await connect_to_room('missing_room', self.user)
+        self.assertFalse(connected)
+        _, connected = await connect_to_room('test_room', AnonymousUser())
+        self.assertFalse(connected)
+
+# Testing the write-behind persistence of chat messages
+@override_settings(CHAT_WRITE_BEHIND=True, CHAT_WRITE_BEHIND_BATCH_SIZE=3, CHAT_WRITE_BEHIND_FLUSH_INTERVAL=60000, CHAT_WRITE_BEHIND_MAX_QUEUE=100)
+class ChatWriteBehindTest(TestCase):
+    def setUp(self):
+        self.user = StudySphereUser.objects.create(username='testuser', email='testuser@example.com', password='password')
+        self.room = ChatRoom.objects.create(name='test_room')
+
+    # Tests that messages are broadcast before being saved and saved in full batches
+    async def test_messages_saved_in_batches(self):
+        communicator, _ = await connect_to_room('test_room', self.user)
+        for i in range(5):
+            await communicator.send_json_to({'message': f'Hello {i}'})
+            self.assertEqual(await communicator.receive_json_from(), {'message': f'testuser: Hello {i}'})
+        # The first full batch is written by the background flush
+        for _ in range(100):
+            if await ChatMessage.objects.acount() == 3:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(await ChatMessage.objects.acount(), 3)
+        await communicator.disconnect()
+        await get_writer().close()
+
+    # Tests that no message is lost when clients disconnect, as happens on shutdown
+    async def test_no_messages_lost_on_disconnect(self):
+        communicators = [(await connect_to_room('test_room', self.user))[0] for _ in range(2)]
+        for i in range(7):
+            await communicators[i % 2].send_json_to({'message': f'Hello {i}'})
+        for communicator in communicators:
+            for _ in range(7):
+                await communicator.receive_json_from()
+        for communicator in communicators:
+            await communicator.disconnect()
+        messages = [message async for message in ChatMessage.objects.filter(room=self.room).values_list('message', flat=True)]
+        self.assertEqual(sorted(messages), [f'Hello {i}' for i in range(7)])
+        await get_writer().close()
+
+    # Tests that buffered messages are saved once the flush interval passes
+    async def test_flush_interval(self):
+        writer = ChatMessageWriter(batch_size=100, flush_interval=10, max_queue=100)
+        await writer.add(self.room.id, self.user.id, 'Hello')
+        for _ in range(100):
+            if await ChatMessage.objects.acount():
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(await ChatMessage.objects.acount(), 1)
+        await writer.close()
+
+    # Tests that adding to a full buffer waits until it has been flushed, which starts straight away
+    # rather than after the flush interval
+    async def test_backpressure(self):
+        writer = ChatMessageWriter(batch_size=100, flush_interval=60000, max_queue=2)
+        await writer.add(self.room.id, self.user.id, 'First')
+        await writer.add(self.room.id, self.user.id, 'Second')
+        # Holding the lock keeps the flush from finishing
+        async with writer.lock:
+            blocked = asyncio.ensure_future(writer.add(self.room.id, self.user.id, 'Third'))
+            await asyncio.sleep(0.05)
+            self.assertFalse(blocked.done())
+        await asyncio.wait_for(blocked, 1)
+        self.assertEqual(await ChatMessage.objects.acount(), 2)
+        await writer.close()
+        self.assertEqual(await ChatMessage.objects.acount(), 3)
+
+    # Tests that the writer is closed on an ASGI lifespan shutdown
+    async def test_closed_on_shutdown(self):
+        from StudySphere.routing import application
+        await get_writer().add(self.room.id, self.user.id, 'Hello')
+        communicator = ApplicationCommunicator(application, {'type': 'lifespan'})
+        await communicator.send_input({'type': 'lifespan.startup'})
+        self.assertEqual(await communicator.receive_output(1), {'type': 'lifespan.startup.complete'})
+        await communicator.send_input({'type': 'lifespan.shutdown'})
+        self.assertEqual(await communicator.receive_output(1), {'type': 'lifespan.shutdown.complete'})
+        self.assertEqual(await ChatMessage.objects.acount(), 1)
+
+# Testing write-behind batches that fail to save, outside of a transaction so that foreign keys are checked on insert
+class ChatWriteBehindFailureTest(TransactionTestCase):
+    def setUp(self):
+        self.user = StudySphereUser.objects.create(username='testuser', email='testuser@example.com', password='password')
+        self.room = ChatRoom.objects.create(name='test_room')
+
+    # Tests that a message that can never be saved is dropped after FLUSH_ATTEMPTS flushes
+    # without holding back the rest of its batch or the buffer's room
+    async def test_failing_message_dropped(self):
+        writer = ChatMessageWriter(batch_size=100, flush_interval=60000, max_queue=2)
+        await writer.add(self.room.id, self.user.id, 'Saved')
+        await writer.add(self.room.id + 1, self.user.id, 'Missing room')
+        for _ in range(FLUSH_ATTEMPTS - 1):
+            with self.assertRaises(Exception):
+                await writer.flush()
+        with self.assertLogs('chat.persistence', 'ERROR'):
+            self.assertEqual(await writer.flush(), 2)
+        self.assertEqual([message async for message in ChatMessage.objects.values_list('message', flat=True)], ['Saved'])
+        await asyncio.wait_for(writer.add(self.room.id, self.user.id, 'After'), 1)
+        await writer.close()
+        self.assertEqual(await ChatMessage.objects.acount(), 2)
+
+# Testing the paginated chat history
+class ChatHistoryTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = StudySphereUser.objects.create(username='testuser', email='testuser@example.com', password='password')
+        self.room = ChatRoom.objects.create(name='test_room')
+        ChatMessage.objects.bulk_create([ChatMessage(room=self.room, user=self.user, message=f'Message {i}') for i in range(7)])
+
+    # Tests that the room only renders the latest page of messages, oldest first
+    def test_room_renders_latest_page(self):
+        ChatMessage.objects.bulk_create([ChatMessage(room=self.room, user=self.user, message=f'Message {i}') for i in range(7, CHAT_HISTORY_PAGE_SIZE + 7)])
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('chat_room', args=['test_room']))
+        messages = [message.message for message in response.context['room_messages']]
+        self.assertEqual(messages, [f'Message {i}' for i in range(7, CHAT_HISTORY_PAGE_SIZE + 7)])
+        self.assertIsNotNone(response.context['next_cursor'])
+
+    # Tests that walking back through the history returns every message exactly once
+    def test_history_pages_cover_all_messages(self):
+        messages, cursor = get_history_page('test_room', page_size=3)
+        seen = [message.message for message in messages]
+        while cursor:
+            messages, cursor = get_history_page('test_room', cursor, page_size=3)
+            seen = [message.message for message in messages] + seen
+        self.assertEqual(seen, [f'Message {i}' for i in range(7)])
+
+    # Tests that a page and its users are loaded in a single query
+    def test_history_page_single_query(self):
+        with self.assertNumQueries(1):
+            usernames = [message.user.username for message in get_history_page('test_room')[0]]
+        self.assertEqual(usernames, ['testuser'] * 7)
+
+    # Tests that the room runs the same queries however many messages and users the room has
+    # The session, the user and the page of messages along with their users
+    def test_room_query_budget(self):
+        self.client.force_login(self.user)
+        with self.assertNumQueries(3):
+            self.client.get(reverse('chat_room', args=['test_room']))
+        users = StudySphereUser.objects.bulk_create([StudySphereUser(username=f'user{i}', email=f'user{i}@example.com') for i in range(40)])
+        ChatMessage.objects.bulk_create([ChatMessage(room=self.room, user=users[i % len(users)], message=f'More {i}') for i in range(CHAT_HISTORY_PAGE_SIZE * 4)])
+        with self.assertNumQueries(3):
+            self.client.get(reverse('chat_room', args=['test_room']))
+
+    # Tests the JSON history endpoint
+    def test_history_endpoint(self):
+        self.client.force_login(self.user)
+        _, cursor = get_history_page('test_room', page_size=5)
+        response = self.client.get(reverse('chat_room_history', args=['test_room']), {'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([message['message'] for message in data['messages']], ['Message 0', 'Message 1'])
+        self.assertIsNone(data['next_cursor'])
+        response = self.client.get(reverse('chat_room_history', args=['test_room']), {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+# Testing the ASGI protocol router
+class ProtocolRouterTest(TestCase):
+    # Tests that plain HTTP requests are handed to Django
+    async def test_http_routed_to_django(self):
+        from StudySphere.routing import application
+        communicator = HttpCommunicator(application, 'GET', '/courses/not_authorized/', headers=[(b'host', b'testserver')])
+        response = await communicator.get_response()
+        self.assertEqual(response['status'], 200)
+
+# Testing presence tracking and typing indicators
+@override_settings(CHAT_PRESENCE_INTERVAL=0.05)
+class ChatPresenceTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = StudySphereUser.objects.create(username='alice', email='alice@example.com', password='password')
+        self.bob = StudySphereUser.objects.create(username='bob', email='bob@example.com', password='password')
+        self.room = ChatRoom.objects.create(name='test_room')
+
+    # Tests that joins within the same interval are sent to the room as a single update
+    async def test_joins_coalesced(self):
+        alice, _ = await connect_to_room('test_room', self.alice, [SUBPROTOCOL_JSON])
+        bob, _ = await connect_to_room('test_room', self.bob, [SUBPROTOCOL_JSON])
+        update = await alice.receive_json_from()
+        self.assertEqual(update, {'type': 'presence', 'online': 2, 'users': ['alice', 'bob'], 'typing': []})
+        self.assertEqual(await bob.receive_json_from(), update)
+        # No further updates follow for the same changes
+        self.assertTrue(await alice.receive_nothing(0.1))
+        await bob.disconnect()
+        self.assertEqual((await alice.receive_json_from())['online'], 1)
+        await alice.disconnect()
+
+    # Tests that a user with several connections is only counted once and stays until all have left
+    async def test_multiple_connections_counted_once(self):
+        first, _ = await connect_to_room('test_room', self.alice, [SUBPROTOCOL_JSON])
+        second, _ = await connect_to_room('test_room', self.alice, [SUBPROTOCOL_JSON])
+        self.assertEqual((await first.receive_json_from())['online'], 1)
+        await second.disconnect()
+        self.assertEqual(presence.get_presence('test_room')['users'], ['alice'])
+        await first.disconnect()
+        self.assertEqual(presence.get_presence('test_room')['online'], 0)
+
+    # Tests that typing indicators are sent to the room and cleared again
+    async def test_typing_indicator(self):
+        alice, _ = await connect_to_room('test_room', self.alice, [SUBPROTOCOL_JSON])
+        bob, _ = await connect_to_room('test_room', self.bob, [SUBPROTOCOL_JSON])
+        await bob.receive_json_from()
+        await alice.receive_json_from()
+        await alice.send_json_to({'typing': True})
+        self.assertEqual((await bob.receive_json_from())['typing'], ['alice'])
+        await alice.send_json_to({'typing': False})
+        self.assertEqual((await bob.receive_json_from())['typing'], [])
+        await alice.disconnect()
+        await bob.disconnect()
+
+    # Tests that clients of the plain protocol are never sent presence, only chat messages
+    async def test_plain_protocol_not_sent_presence(self):
+        plain, _ = await connect_to_room('test_room', self.alice)
+        batched, _ = await connect_to_room('test_room', self.bob, [SUBPROTOCOL_JSON])
+        self.assertEqual((await batched.receive_json_from())['online'], 2)
+        await batched.send_json_to({'typing': True})
+        self.assertEqual((await batched.receive_json_from())['typing'], ['bob'])
+        self.assertTrue(await plain.receive_nothing(0.1))
+        await plain.disconnect()
+        await batched.disconnect()
+
+    # Tests that an update never runs without the room's lock, and waits on the event loop for it to be released
+    async def test_update_waits_for_lock(self):
+        cache.add(presence._lock_key('test_room'), 1)
+        with self.assertRaises(presence.RoomLocked):
+            presence.join('test_room', self.alice.id, 'alice')
+        waiting = asyncio.ensure_future(presence.run_update(presence.join, 'test_room', self.alice.id, 'alice'))
+        await asyncio.sleep(0.05)
+        self.assertFalse(waiting.done())
+        cache.delete(presence._lock_key('test_room'))
+        await asyncio.wait_for(waiting, 1)
+        self.assertEqual(presence.get_presence('test_room')['users'], ['alice'])
+
+    # Tests that an update is skipped when the lock is never released
+    async def test_update_skipped_when_locked(self):
+        cache.add(presence._lock_key('test_room'), 1)
+        with patch('chat.presence.LOCK_ATTEMPTS', 3), self.assertLogs('chat.presence', 'ERROR'):
+            await presence.run_update(presence.join, 'test_room', self.alice.id, 'alice')
+        self.assertEqual(presence.get_presence('test_room')['online'], 0)
+
+
+# Testing the opt-in batched protocols
+@override_settings(CHAT_BATCH_WINDOW=0.05)
+class ChatBatchedProtocolTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = StudySphereUser.objects.create(username='testuser', email='testuser@example.com', password='password')
+        self.room = ChatRoom.objects.create(name='test_room')
+
+    async def connect(self, subprotocol):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/chat_room/test_room/', subprotocols=[subprotocol])
+        communicator.scope['user'] = self.user
+        connected, accepted = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(accepted, subprotocol)
+        return communicator
+
+    # Tests that messages sent within the window arrive in a single JSON frame with structured fields
+    async def test_json_batches_messages(self):
+        communicator = await self.connect(SUBPROTOCOL_JSON)
+        for i in range(3):
+            await communicator.send_json_to({'message': f'Hello {i}'})
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame['type'], 'messages')
+        saved = [message async for message in ChatMessage.objects.order_by('id')]
+        self.assertEqual(frame['messages'], [{
+            'id': message.id,
+            'user_id': self.user.id,
+            'username': 'testuser',
+            'message': message.message,
+            'timestamp': message.timestamp.isoformat(),
+        } for message in saved])
+        await communicator.disconnect()
+
+    # Tests that msgpack clients send and receive binary frames
+    async def test_msgpack_batches_messages(self):
+        communicator = await self.connect(SUBPROTOCOL_MSGPACK)
+        await communicator.send_to(bytes_data=msgpack.packb({'message': 'Hello'}))
+        await communicator.send_to(bytes_data=msgpack.packb({'message': 'World'}))
+        frame = msgpack.unpackb(await communicator.receive_from())
+        self.assertEqual([message['message'] for message in frame['messages']], ['Hello', 'World'])
+        await communicator.disconnect()
+
+    # Tests that a batch still waiting for its window isn't sent once the client has disconnected
+    async def test_pending_batch_dropped_on_disconnect(self):
+        communicator = await self.connect(SUBPROTOCOL_JSON)
+        with patch.object(ChatConsumer, 'send_frame') as mock_send_frame:
+            await communicator.send_json_to({'message': 'Hello'})
+            await asyncio.sleep(0.01)
+            await communicator.disconnect()
+            await asyncio.sleep(0.1)
+        mock_send_frame.assert_not_called()
@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     path('home/', views.chat_index, name='chat_index'),
     path('chat_room/<str:room_name>/', views.room, name='chat_room'),
+    path('chat_room/<str:room_name>/history/', views.room_history, name='chat_room_history'),
     path('new_chat_room/', views.new_chat_room, name='new_chat_room'),
     # other URL patterns...
 
@@ -1,5 +1,7 @@
+from django.http import JsonResponse
 from django.shortcuts import render, redirect
 from .models import ChatRoom, ChatMessage
+from .history import get_history_page
 
 import re
 from django.utils.text import slugify
@@ -17,12 +19,29 @@ def chat_index(request):
 # This defines the /room view which is accessed when a user is viewing a chat
 def room(request, room_name):
     if request.user.is_authenticated: 
-        # Retrieves all relevant messages and renders them
-        room_messages = ChatMessage.objects.filter(room__name=room_name).order_by('timestamp')
-        return render(request, 'room.html', {'room_name': room_name, 'room_messages': room_messages})
+        # Retrieves the latest messages and renders them, older messages are loaded through room_history
+        room_messages, next_cursor = get_history_page(room_name)
+        return render(request, 'room.html', {'room_name': room_name, 'room_messages': room_messages, 'next_cursor': next_cursor})
     else: 
         return redirect('/courses/not_authorized')
 
+# This returns a page of older messages in a room as JSON when the user scrolls back
+def room_history(request, room_name):
+    if request.user.is_authenticated:
+        try:
+            room_messages, next_cursor = get_history_page(room_name, request.GET.get('cursor'))
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        data = [{
+            'id': message.id,
+            'username': message.user.username,
+            'message': message.message,
+            'timestamp': message.timestamp.isoformat(),
+        } for message in room_messages]
+        return JsonResponse({'messages': data, 'next_cursor': next_cursor})
+    else:
+        return redirect('/courses/not_authorized')
+
 # This defines the view for the creation of a chat room
 def new_chat_room(request):
     if request.user.is_authenticated:
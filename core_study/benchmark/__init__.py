@@ -0,0 +1,2 @@
+# Site wide benchmark: dataset seeds a synthetic dataset and runner drives the site's pages through the
+# Django test client, see `manage.py benchmark_site`
@@ -0,0 +1,37 @@
+from core_study import seeding
+from courses import search
+
+# The amount of each kind of object seeded, each can be changed on the command line
+DEFAULT_SIZES = {
+    'students': 200,
+    'teachers': 20,
+    'courses': 40,
+    'enrollments_per_student': 4,
+    'contents_per_course': 5,
+    'posts': 400,
+    'comments_per_post': 3,
+    'rooms': 5,
+    'messages_per_room': 200,
+}
+
+# Seeds a synthetic dataset of the given sizes with core_study.seeding, the same dataset every time for the same seed
+# Seeding sends no signals, so the search index is rebuilt afterwards. Returns the ids (and room names) the benchmark
+# builds its requests from, courses along with their teacher and contents along with their course.
+def seed_dataset(sizes=None, seed=0):
+    plan = seeding.SeedPlan({**DEFAULT_SIZES, **(sizes or {})}, seed=seed, prefix=f'bench{seed}')
+    seeding.seed(plan)
+    search.rebuild_index()
+    sizes = plan.sizes
+    return {
+        'sizes': sizes,
+        'seed': seed,
+        'students': [plan.student_id(index) for index in range(sizes['students'])],
+        'teachers': [plan.teacher_id(index) for index in range(sizes['teachers'])],
+        'courses': [(plan.course_id(index), plan.course_teacher_id(index)) for index in range(sizes['courses'])],
+        'contents': [
+            (plan.content_id(course, number), plan.course_id(course))
+            for course in range(sizes['courses']) for number in range(sizes['contents_per_course'])
+        ],
+        'posts': [plan.post_id(index) for index in range(sizes['posts'])],
+        'rooms': [plan.room_name(index) for index in range(sizes['rooms'])],
+    }
@@ -0,0 +1,151 @@
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.db import connection, connections
+from django.test import Client
+from django.urls import reverse
+
+from core_study.instrumentation import RequestMetrics
+from core_study.seeding import WORDS
+from users.models import StudySphereUser
+
+# The pages the benchmark requests, as (who requests it, how its url is built from the dataset)
+# Students and teachers are picked at random from the dataset, and teachers only request their own courses
+ENDPOINTS = {
+    'index': ('anonymous', lambda rng, data, user: reverse('index')),
+    'homepage_student': ('student', lambda rng, data, user: reverse('homepage')),
+    'homepage_teacher': ('teacher', lambda rng, data, user: reverse('homepage')),
+    'courses': ('student', lambda rng, data, user: reverse('courses')),
+    'view_course': ('student', lambda rng, data, user: reverse('view', args=[rng.choice(data['courses'])[0]])),
+    'view_content': ('student', lambda rng, data, user: reverse('view_content', args=[rng.choice(data['contents'])[0]])),
+    'edit_course': ('teacher', lambda rng, data, user: reverse('edit', args=[_course_of(rng, data, user)])),
+    'view_submissions': ('teacher', lambda rng, data, user: reverse('view_submissions', args=[_content_of(rng, data, user)])),
+    'notifications_student': ('student', lambda rng, data, user: reverse('notifications')),
+    'notifications_teacher': ('teacher', lambda rng, data, user: reverse('notifications')),
+    'notifications_api': ('student', lambda rng, data, user: reverse('notifications_api')),
+    'status_updates': ('student', lambda rng, data, user: reverse('status_updates')),
+    'view_comments': ('student', lambda rng, data, user: reverse('view_comments', args=[rng.choice(data['posts'])])),
+    'comments_api': ('student', lambda rng, data, user: reverse('comments_api', args=[rng.choice(data['posts'])])),
+    'search': ('student', lambda rng, data, user: f"{reverse('search')}?{urlencode({'query': rng.choice(WORDS)})}"),
+    'user_search': ('teacher', lambda rng, data, user: f"{reverse('user_search')}?{urlencode({'query': rng.choice(WORDS)})}"),
+    'user_autocomplete': ('teacher', lambda rng, data, user: f"{reverse('user_autocomplete')}?{urlencode({'q': rng.choice(WORDS)[:3]})}"),
+    'chat_index': ('student', lambda rng, data, user: reverse('chat_index')),
+    'chat_room': ('student', lambda rng, data, user: reverse('chat_room', args=[rng.choice(data['rooms'])])),
+    'chat_room_history': ('student', lambda rng, data, user: reverse('chat_room_history', args=[rng.choice(data['rooms'])])),
+}
+
+# Returns one of the courses taught by a teacher
+def _course_of(rng, data, teacher_id):
+    return rng.choice([course_id for course_id, course_teacher_id in data['courses'] if course_teacher_id == teacher_id])
+
+# Returns one of the contents of a course taught by a teacher
+def _content_of(rng, data, teacher_id):
+    course_ids = {course_id for course_id, course_teacher_id in data['courses'] if course_teacher_id == teacher_id}
+    return rng.choice([content_id for content_id, course_id in data['contents'] if course_id in course_ids])
+
+# Returns the requests of a run as (endpoint, user id, url), the same requests every time for the same seed
+# Endpoints take turns so that every one is requested about as often. Teachers without courses are never picked.
+def plan_requests(data, amount, endpoints=None, seed=0):
+    rng = random.Random(seed)
+    names = list(endpoints or ENDPOINTS)
+    teaching = sorted({teacher_id for _, teacher_id in data['courses']})
+    requests = []
+    for index in range(amount):
+        name = names[index % len(names)]
+        kind, build_url = ENDPOINTS[name]
+        if kind == 'student':
+            user_id = rng.choice(data['students'])
+        elif kind == 'teacher':
+            user_id = rng.choice(teaching)
+        else:
+            user_id = None
+        requests.append((name, user_id, build_url(rng, data, user_id)))
+    return requests
+
+# Returns a client logged in as each of the users requesting urls (None for anonymous requests)
+# Logging in writes the session and the user's last login, so it is done before any requests are timed
+def _login_clients(requests):
+    clients = {}
+    for _, user_id, _ in requests:
+        if user_id not in clients:
+            clients[user_id] = Client(raise_request_exception=False)
+            if user_id is not None:
+                clients[user_id].force_login(StudySphereUser.objects.get(id=user_id))
+    return clients
+
+# Requests urls with the clients of their users and returns a sample per request: (endpoint, status, seconds, queries)
+# The queries are counted with the instrumentation's execute wrapper
+def _run_requests(requests, clients):
+    samples = []
+    try:
+        for name, user_id, url in requests:
+            metrics = RequestMetrics()
+            with connection.execute_wrapper(metrics):
+                start = time.perf_counter()
+                response = clients[user_id].get(url)
+                elapsed = time.perf_counter() - start
+            samples.append((name, response.status_code, elapsed, metrics.queries))
+    finally:
+        # Each worker thread has its own connections, which are closed when it is done
+        if threading.current_thread() is not threading.main_thread():
+            connections.close_all()
+    return samples
+
+# Returns the value below which a fraction of the sorted values fall (nearest rank)
+def percentile(values, fraction):
+    if not values:
+        return 0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+def _summarize(samples, elapsed=None):
+    latencies = sorted(seconds * 1000 for _, _, seconds, _ in samples)
+    queries = [count for _, _, _, count in samples]
+    summary = {
+        'requests': len(samples),
+        'errors': sum(1 for _, status, _, _ in samples if status >= 400),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.5), 2),
+            'p95': round(percentile(latencies, 0.95), 2),
+            'p99': round(percentile(latencies, 0.99), 2),
+            'mean': round(sum(latencies) / len(latencies), 2) if latencies else 0,
+            'max': round(latencies[-1], 2) if latencies else 0,
+        },
+        'queries_per_request': {
+            'mean': round(sum(queries) / len(queries), 2) if queries else 0,
+            'max': max(queries, default=0),
+        },
+    }
+    if elapsed is not None:
+        summary['duration_s'] = round(elapsed, 3)
+        summary['requests_per_second'] = round(len(samples) / elapsed, 2) if elapsed else 0
+    return summary
+
+# Runs planned requests across concurrency threads, each taking every concurrency'th request, and returns the report:
+# requests per second, latency percentiles and queries per request overall and for each endpoint
+# warmup requests (planned the same way) are run first and left out of the report
+def run_benchmark(requests, concurrency=1, warmup=()):
+    if warmup:
+        _run_requests(warmup, _login_clients(warmup))
+    shares = [requests[worker::concurrency] for worker in range(concurrency)]
+    # Every worker has clients of its own, as clients aren't shared between threads
+    clients = [_login_clients(share) for share in shares]
+    start = time.perf_counter()
+    if concurrency == 1:
+        samples = _run_requests(requests, clients[0])
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = [sample for share in executor.map(_run_requests, shares, clients) for sample in share]
+    elapsed = time.perf_counter() - start
+
+    report = {'concurrency': concurrency, **_summarize(samples, elapsed), 'endpoints': {}}
+    for name in sorted({sample[0] for sample in samples}):
+        endpoint_samples = [sample for sample in samples if sample[0] == name]
+        report['endpoints'][name] = {
+            **_summarize(endpoint_samples),
+            'statuses': sorted({status for _, status, _, _ in endpoint_samples}),
+        }
+    return report
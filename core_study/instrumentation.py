@@ -0,0 +1,242 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+# Per request instrumentation, enabled with REQUEST_INSTRUMENTATION. Every request records its amount of
+# SQL queries, the time spent running them, the time spent rendering templates and its wall time. These are
+# sent back in a Server-Timing header (shown in the browser's network panel), requests slower than
+# REQUEST_SLOW_MS are logged along with their most repeated queries (the signature of an N+1), and every
+# request adds to a histogram of its route which `manage.py request_timings` reads percentiles from.
+# Template time includes any queries run lazily while rendering, so db and tpl can overlap.
+# Queries are counted on the connections of the thread handling the request, which under ASGI is also the thread
+# that the ORM calls of async views run in. Queries run by other threads (EG. ones a view starts itself) aren't counted.
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, anything above the last bound goes in an overflow bucket
+# Percentiles are answered with the upper bound of the bucket they fall in
+TIME_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000] # milliseconds
+QUERY_BUCKETS = [0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000]
+METRICS = {
+    'wall': TIME_BUCKETS,
+    'db': TIME_BUCKETS,
+    'template': TIME_BUCKETS,
+    'queries': QUERY_BUCKETS,
+}
+
+# How many of a slow request's repeated queries are logged
+SLOW_REQUEST_FINGERPRINTS = 5
+
+TIMINGS_KEY = 'instrumentation:timings'
+LOCK_KEY = 'instrumentation:timings:lock'
+LOCK_TIMEOUT = 5
+
+# The metrics of the request being handled
+_current = ContextVar('request_metrics', default=None)
+
+# Literals and placeholders are replaced so that queries differing only in their parameters share a fingerprint
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST_RE = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+_SPACE_RE = re.compile(r'\s+')
+
+# Returns the fingerprint of a SQL statement EG. "... WHERE id IN (%s, %s)" and "... WHERE id IN (%s)" both give "... WHERE id IN (...)"
+def fingerprint(sql):
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _LIST_RE.sub('(...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+# What is recorded while a request is handled
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.rendering = False
+        self.fingerprints = Counter()
+
+    # A database execute wrapper, see https://docs.djangoproject.com/en/5.0/topics/db/instrumentation/
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+# Django templates have no hook for timing their rendering, so settings switch to this template backend when
+# REQUEST_INSTRUMENTATION is enabled. Its templates time their rendering into the metrics of the request being
+# handled, and render as usual outside of requests (EG. in management commands) or while already being timed.
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None or metrics.rendering:
+            return super().render(context, request)
+        metrics.rendering = True
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template += time.perf_counter() - start
+            metrics.rendering = False
+
+class InstrumentedTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+def _bucket(bounds, value):
+    for index, bound in enumerate(bounds):
+        if value <= bound:
+            return index
+    return len(bounds)
+
+# Returns an empty histogram of a metric: its count, sum, maximum and the count of each bucket
+def _new_histogram(metric):
+    return {'count': 0, 'sum': 0, 'max': 0, 'buckets': [0] * (len(METRICS[metric]) + 1)}
+
+def _merge_histogram(into, histogram):
+    into['count'] += histogram['count']
+    into['sum'] += histogram['sum']
+    into['max'] = max(into['max'], histogram['max'])
+    into['buckets'] = [a + b for a, b in zip(into['buckets'], histogram['buckets'])]
+
+# Collects the histograms of each route in this process and merges them into the cache every
+# REQUEST_TIMINGS_FLUSH_INTERVAL seconds, so that a request costs no cache round trips of its own.
+# The cache copy is shared by every worker, which take a short lock in the cache to merge into it.
+class TimingAggregator:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_flush = time.monotonic()
+
+    # Adds the metrics of a request to the histograms of its route, flushing them when they are due
+    def record(self, route, values):
+        with self.lock:
+            histograms = self.pending.setdefault(route, {metric: _new_histogram(metric) for metric in METRICS})
+            for metric, value in values.items():
+                histogram = histograms[metric]
+                histogram['count'] += 1
+                histogram['sum'] += value
+                histogram['max'] = max(histogram['max'], value)
+                histogram['buckets'][_bucket(METRICS[metric], value)] += 1
+            due = time.monotonic() - self.last_flush >= settings.REQUEST_TIMINGS_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    # Merges the pending histograms into the cache, keeping them for the next flush when another worker holds the lock
+    # Returns whether they were merged
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = time.monotonic()
+        if not pending:
+            return True
+        if not cache.add(LOCK_KEY, 1, timeout=LOCK_TIMEOUT):
+            self._restore(pending)
+            return False
+        try:
+            timings = cache.get(TIMINGS_KEY) or {}
+            for route, histograms in pending.items():
+                stored = timings.setdefault(route, {metric: _new_histogram(metric) for metric in METRICS})
+                for metric, histogram in histograms.items():
+                    _merge_histogram(stored[metric], histogram)
+            cache.set(TIMINGS_KEY, timings, timeout=None)
+        finally:
+            cache.delete(LOCK_KEY)
+        return True
+
+    def _restore(self, pending):
+        with self.lock:
+            for route, histograms in pending.items():
+                current = self.pending.setdefault(route, {metric: _new_histogram(metric) for metric in METRICS})
+                for metric, histogram in histograms.items():
+                    _merge_histogram(current[metric], histogram)
+
+aggregator = TimingAggregator()
+
+# Returns the histograms of every route shared by all workers
+def get_timings():
+    return cache.get(TIMINGS_KEY) or {}
+
+def reset_timings():
+    cache.delete(TIMINGS_KEY)
+
+# Returns the value below which a fraction of a histogram's samples fall, as the upper bound of its bucket
+# Samples in the overflow bucket are answered with the largest sample seen
+def percentile(histogram, metric, fraction):
+    if not histogram['count']:
+        return 0
+    bounds = METRICS[metric]
+    target = fraction * histogram['count']
+    seen = 0
+    for index, count in enumerate(histogram['buckets']):
+        seen += count
+        if seen >= target:
+            return min(bounds[index], histogram['max']) if index < len(bounds) else histogram['max']
+    return histogram['max']
+
+# Returns the route a request was resolved to EG. "/courses/view/<int:course_id>", which groups requests to the same view
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return f'/{match.route}'
+
+# Measures every request, see the top of this module. Only loaded when REQUEST_INSTRUMENTATION is enabled,
+# and it should come first in MIDDLEWARE so that the other middleware is included in the wall time.
+class RequestInstrumentationMiddleware:
+    def __init__(self, get_response):
+        if not settings.REQUEST_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                # Wrapping a connection doesn't open it, so every database is wrapped. Connections belong to a
+                # thread, so these are the connections of the thread handling the request.
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        wall = time.perf_counter() - start
+
+        route = _route(request)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={metrics.db * 1000:.1f};desc="{metrics.queries} queries"',
+            f'tpl;dur={metrics.template * 1000:.1f}',
+            f'total;dur={wall * 1000:.1f}',
+        ])
+        aggregator.record(route, {
+            'wall': wall * 1000,
+            'db': metrics.db * 1000,
+            'template': metrics.template * 1000,
+            'queries': metrics.queries,
+        })
+        if wall * 1000 >= settings.REQUEST_SLOW_MS:
+            repeated = [(sql, count) for sql, count in metrics.fingerprints.most_common(SLOW_REQUEST_FINGERPRINTS) if count > 1]
+            logger.warning(
+                'Slow request %s %s (%s) took %.0fms: %d queries in %.0fms, templates %.0fms%s',
+                request.method, request.path, route, wall * 1000, metrics.queries, metrics.db * 1000, metrics.template * 1000,
+                ''.join(f'\n  {count}x {sql[:300]}' for sql, count in repeated),
+            )
+        return response
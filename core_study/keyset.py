@@ -0,0 +1,45 @@
+import base64
+import datetime
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+# Keyset (cursor) pagination, used by the status feed, chat history, a post's comments and the notification inboxes.
+# Rather than skipping an offset, each page starts after the (time, id) of the last row of the previous page, so
+# that every page is a single indexed range scan however far back the reader goes. The cursor is that pair,
+# encoded so that it can be passed around in a URL.
+
+# Encodes the position of a row into an opaque cursor
+def encode_cursor(timestamp, row_id):
+    raw = f'{timestamp.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+# Decodes a cursor back into its (time, id) pair, raising ValueError when it is malformed
+def decode_cursor(cursor):
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        timestamp = parse_datetime(timestamp)
+        row_id = int(row_id)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(timestamp, datetime.datetime):
+        raise ValueError('Invalid cursor')
+    return timestamp, row_id
+
+# Returns the page of a queryset after the cursor (the first page without one) ordered by field and then id, newest
+# first unless oldest_first, along with the cursor of the next page (None on the last page)
+def get_page(queryset, field, cursor=None, page_size=20, oldest_first=False):
+    if oldest_first:
+        queryset, after = queryset.order_by(field, 'id'), 'gt'
+    else:
+        queryset, after = queryset.order_by(f'-{field}', '-id'), 'lt'
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f'{field}__{after}': timestamp}) | Q(**{field: timestamp, f'id__{after}': row_id}))
+    # One extra row is fetched to find out whether there is a next page
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(getattr(rows[-1], field), rows[-1].id)
+    return rows, next_cursor
@@ -0,0 +1,73 @@
+import json
+import platform
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from core_study.benchmark.dataset import DEFAULT_SIZES, seed_dataset
+from core_study.benchmark.runner import ENDPOINTS, plan_requests, run_benchmark
+
+# Seeds a synthetic dataset into a throwaway test database and requests the site's pages against it,
+# printing requests per second, latency percentiles and queries per request as JSON. Runs with the same
+# options make the same dataset and requests, so reports of different commits can be compared.
+# The cache is swapped for an in-memory one so that nothing is read from or written to a shared cache.
+class Command(BaseCommand):
+    help = 'Benchmarks the site against a seeded synthetic dataset, reporting throughput and latency as JSON'
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_SIZES.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default, help=f'Amount of {name.replace("_", " ")} seeded')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the dataset and the requests')
+        parser.add_argument('--requests', type=int, default=2000, help='Amount of requests measured')
+        parser.add_argument('--concurrency', type=int, default=4, help='Amount of threads sending requests')
+        parser.add_argument('--warmup', type=int, default=100, help='Amount of requests sent before measuring')
+        parser.add_argument('--endpoint', action='append', choices=sorted(ENDPOINTS), help='Only request this endpoint, can be given more than once')
+        parser.add_argument('--label', default='', help='Label stored in the report EG. a commit hash')
+        parser.add_argument('--output', help='Write the report to this file rather than printing it')
+        parser.add_argument('--use-current-db', action='store_true', help='Seed into the configured database rather than a new test database')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1')
+        sizes = {name: options[name] for name in DEFAULT_SIZES}
+        if min(sizes['teachers'], sizes['students'], sizes['courses'], sizes['contents_per_course'], sizes['posts'], sizes['rooms']) < 1:
+            raise CommandError('At least one teacher, student, course, content per course, post and room are needed')
+
+        old_name = None
+        if not options['use_current_db']:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}},
+                EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+            ):
+                self.stderr.write('Seeding the dataset')
+                data = seed_dataset(sizes, seed=options['seed'])
+                requests = plan_requests(data, options['requests'], options['endpoint'], seed=options['seed'])
+                warmup = plan_requests(data, options['warmup'], options['endpoint'], seed=options['seed'] + 1)
+                self.stderr.write(f"Sending {options['requests']} requests from {options['concurrency']} threads")
+                report = run_benchmark(requests, options['concurrency'], warmup)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            'label': options['label'],
+            'seed': options['seed'],
+            'sizes': sizes,
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            **report,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+            self.stderr.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from core_study import instrumentation
+
+# Percentiles printed for each metric
+PERCENTILES = [0.5, 0.9, 0.99]
+
+# Prints the percentiles of each route's wall time, database time, template time and query count
+# as recorded by core_study.instrumentation (enabled with REQUEST_INSTRUMENTATION)
+class Command(BaseCommand):
+    help = 'Shows per route request timing and query count percentiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--route', help='Only show routes containing this text')
+        parser.add_argument('--sort', choices=sorted(instrumentation.METRICS), default='wall', help='Metric whose p90 the routes are sorted by, slowest first')
+        parser.add_argument('--limit', type=int, default=20, help='Amount of routes shown')
+        parser.add_argument('--reset', action='store_true', help='Reset all timings after printing them')
+
+    def handle(self, *args, **options):
+        timings = instrumentation.get_timings()
+        routes = [route for route in timings if not options['route'] or options['route'] in route]
+        if not routes:
+            self.stdout.write('No requests recorded')
+        sort = options['sort']
+        routes.sort(key=lambda route: instrumentation.percentile(timings[route][sort], sort, 0.9), reverse=True)
+        for route in routes[:options['limit']]:
+            histograms = timings[route]
+            self.stdout.write(f"{route} ({histograms['wall']['count']} requests)")
+            for metric, histogram in histograms.items():
+                unit = '' if metric == 'queries' else 'ms'
+                values = ', '.join(f'p{round(fraction * 100)} {instrumentation.percentile(histogram, metric, fraction):g}{unit}' for fraction in PERCENTILES)
+                mean = histogram['sum'] / histogram['count'] if histogram['count'] else 0
+                self.stdout.write(f"  {metric}: {values}, mean {mean:.1f}{unit}, max {histogram['max']:.1f}{unit}")
+        if options['reset']:
+            instrumentation.reset_timings()
+            self.stdout.write('Timings have been reset')
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core_study.seeding import DEFAULT_SIZES, SEED_BATCH_SIZE, SeedPlan, seed
+from courses import search
+from users.models import StudySphereUser
+
+# Seeds synthetic users, courses, enrollments, content, deadlines, submissions, notifications, posts,
+# comments and chat messages with chunked bulk_create, see core_study.seeding
+# EG. `manage.py seed_studysphere --students 1000000 --workers 8` for a production sized database
+class Command(BaseCommand):
+    help = 'Seeds a synthetic dataset of any size with bulk inserts, the same data for the same seed'
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_SIZES.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default, help=f'Amount of {name.replace("_", " ")} seeded')
+        parser.add_argument('--seed', type=int, default=0, help='Seed the data is generated from')
+        parser.add_argument('--prefix', default='seed', help='Prefix of the seeded usernames, emails and room names')
+        parser.add_argument('--workers', type=int, default=4, help='Amount of threads inserting rows, always 1 on SQLite')
+        parser.add_argument('--batch-size', type=int, default=SEED_BATCH_SIZE, help='Rows inserted per INSERT statement')
+        parser.add_argument('--skip-search-index', action='store_true', help='Leave the search index as it is, seeded objects then won\'t be found by search')
+
+    def handle(self, *args, **options):
+        sizes = {name: options[name] for name in DEFAULT_SIZES}
+        if min(sizes.values()) < 0 or sizes['teachers'] < 1 or sizes['courses'] < 1 or sizes['rooms'] < 1:
+            raise CommandError('Sizes can not be negative, and at least one teacher, course and room are needed')
+        if StudySphereUser.objects.filter(username__startswith=f"{options['prefix']}_").exists():
+            raise CommandError(f"Users prefixed {options['prefix']}_ have already been seeded, pick another --prefix")
+        workers = options['workers']
+        if connection.vendor == 'sqlite' and workers > 1:
+            self.stderr.write('SQLite allows a single writer, seeding with 1 worker')
+            workers = 1
+
+        plan = SeedPlan(sizes, seed=options['seed'], prefix=options['prefix'])
+        started = time.perf_counter()
+        counts = seed(plan, workers=max(1, workers), batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        total = sum(counts.values())
+        for name, count in counts.items():
+            self.stdout.write(f'{name}: {count} rows')
+        self.stdout.write(f'Seeded {total} rows in {elapsed:.1f}s ({total / elapsed:.0f} rows/sec) with {workers} worker(s)')
+
+        # bulk_create sends no signals, so the seeded objects are only searchable once the index is rebuilt
+        if not options['skip_search_index']:
+            self.stdout.write(f'Search index rebuilt with {search.rebuild_index()} entries')
@@ -0,0 +1,262 @@
+import datetime
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from chat.models import ChatMessage, ChatRoom
+from courses import cache as homepage_cache
+from courses import catalog
+from courses.models import Comment, Course, CourseContent, CourseDeadline, NotificationContent, NotificationEnroll, Post, Submission
+from users.models import StudySphereUser
+
+# Fast synthetic data at any scale, used by `manage.py seed_studysphere` and the site benchmark.
+# Rows are built in memory and inserted with chunked bulk_create, never one save() at a time, and every
+# user shares a single password hash rather than hashing a password per user.
+# Ids are assigned by the plan rather than the database (continuing after the rows already there), so
+# every table can be generated on its own: a content knows its course's id without reading it back. The
+# tables are seeded in stages, parents before children, with the jobs of each stage run in parallel.
+# Every job draws from a random generator seeded by the seed, its table and its first row, so the same seed
+# gives the same data however many workers there are.
+DEFAULT_SIZES = {
+    'students': 10000,
+    'teachers': 200,
+    'courses': 1000,
+    'enrollments_per_student': 4,
+    'contents_per_course': 10,
+    'posts': 20000,
+    'comments_per_post': 3,
+    'rooms': 50,
+    'messages_per_room': 1000,
+}
+
+# Rows inserted per INSERT statement
+SEED_BATCH_SIZE = 2000
+
+# About how many rows each job (and so each transaction) inserts
+JOB_ROWS = 20000
+
+# Every seeded user has this password
+PASSWORD = 'studysphere'
+
+WORDS = ['algebra', 'biology', 'chemistry', 'drawing', 'economics', 'french', 'geography', 'history', 'latin', 'maths', 'music', 'physics']
+
+# Returns a few words picked by rng, so that search has something to match
+def _sentence(rng, length):
+    return ' '.join(rng.choices(WORDS, k=length))
+
+# The models whose ids are assigned by the plan
+ID_MODELS = {
+    'users': StudySphereUser,
+    'courses': Course,
+    'contents': CourseContent,
+    'posts': Post,
+    'rooms': ChatRoom,
+}
+
+# What is seeded, and the ids of every row. Teachers are the first users, followed by the students.
+class SeedPlan:
+    def __init__(self, sizes=None, seed=0, prefix='seed'):
+        self.sizes = {**DEFAULT_SIZES, **(sizes or {})}
+        self.seed = seed
+        self.prefix = prefix
+        self.now = timezone.now()
+        self.password = make_password(PASSWORD)
+        # Ids continue after the rows already in each table
+        self.bases = {name: model.objects.aggregate(max_id=Max('id'))['max_id'] or 0 for name, model in ID_MODELS.items()}
+
+    # Returns the random generator of a part of the data
+    def rng(self, *key):
+        return random.Random(':'.join(str(part) for part in (self.seed, *key)))
+
+    def user_id(self, index):
+        return self.bases['users'] + index + 1
+
+    def teacher_id(self, index):
+        return self.user_id(index)
+
+    def student_id(self, index):
+        return self.user_id(self.sizes['teachers'] + index)
+
+    def course_id(self, index):
+        return self.bases['courses'] + index + 1
+
+    # Courses are shared out between the teachers in turn
+    def course_teacher_id(self, index):
+        return self.teacher_id(index % self.sizes['teachers'])
+
+    def content_id(self, course_index, number):
+        return self.bases['contents'] + course_index * self.sizes['contents_per_course'] + number + 1
+
+    def post_id(self, index):
+        return self.bases['posts'] + index + 1
+
+    def room_id(self, index):
+        return self.bases['rooms'] + index + 1
+
+    def room_name(self, index):
+        return f'{self.prefix}_room{index}'
+
+    # Returns the indexes of the distinct courses a student is enrolled on, the same every time it is asked
+    def courses_of(self, student_index):
+        amount = min(self.sizes['enrollments_per_student'], self.sizes['courses'])
+        return sorted(self.rng('enrollments', student_index).sample(range(self.sizes['courses']), amount))
+
+    def random_user_id(self, rng):
+        return self.user_id(rng.randrange(self.sizes['teachers'] + self.sizes['students']))
+
+def _users(plan, start, stop):
+    rng = plan.rng('users', start)
+    for index in range(start, stop):
+        teacher = index < plan.sizes['teachers']
+        kind = 'teacher' if teacher else 'student'
+        yield StudySphereUser(
+            id=plan.user_id(index), username=f'{plan.prefix}_{kind}{index}', email=f'{plan.prefix}_{kind}{index}@example.com',
+            first_name=rng.choice(WORDS).title(), last_name=rng.choice(WORDS).title(), auth_level=kind, password=plan.password,
+        )
+
+def _rooms(plan, start, stop):
+    for index in range(start, stop):
+        yield ChatRoom(id=plan.room_id(index), name=plan.room_name(index))
+
+def _courses(plan, start, stop):
+    rng = plan.rng('courses', start)
+    for index in range(start, stop):
+        yield Course(id=plan.course_id(index), name=f'{_sentence(rng, 2).title()} {index}', description=_sentence(rng, 40), teacher_id=plan.course_teacher_id(index))
+
+def _posts(plan, start, stop):
+    rng = plan.rng('posts', start)
+    for index in range(start, stop):
+        yield Post(id=plan.post_id(index), user_id=plan.random_user_id(rng), text=_sentence(rng, 12))
+
+def _messages(plan, start, stop):
+    rng = plan.rng('messages', start)
+    for index in range(start, stop):
+        yield ChatMessage(room_id=plan.room_id(index // plan.sizes['messages_per_room']), user_id=plan.random_user_id(rng), message=_sentence(rng, 10))
+
+# Enrollments are inserted straight into the through table of Course.students
+def _enrollments(plan, start, stop):
+    through = Course.students.through
+    for index in range(start, stop):
+        for course in plan.courses_of(index):
+            yield through(course_id=plan.course_id(course), studysphereuser_id=plan.student_id(index))
+
+def _contents(plan, start, stop):
+    rng = plan.rng('contents', start)
+    per_course = plan.sizes['contents_per_course']
+    for index in range(start, stop):
+        course, number = divmod(index, per_course)
+        yield CourseContent(id=plan.content_id(course, number), course_id=plan.course_id(course), title=f'{_sentence(rng, 2).title()} {number}', content_text=_sentence(rng, 80))
+
+def _comments(plan, start, stop):
+    rng = plan.rng('comments', start)
+    for index in range(start, stop):
+        yield Comment(post_id=plan.post_id(index // plan.sizes['comments_per_post']), user_id=plan.random_user_id(rng), text=_sentence(rng, 8))
+
+# Teachers are notified of every student enrolling on their courses
+def _enroll_notifications(plan, start, stop):
+    for index in range(start, stop):
+        for course in plan.courses_of(index):
+            yield NotificationEnroll(course_id=plan.course_id(course), student_id=plan.student_id(index), teacher_id=plan.course_teacher_id(course))
+
+# Every content has a deadline between 10 days ago and 60 days ahead
+def _deadlines(plan, start, stop):
+    rng = plan.rng('deadlines', start)
+    per_course = plan.sizes['contents_per_course']
+    for index in range(start, stop):
+        yield CourseDeadline(content_id=plan.content_id(*divmod(index, per_course)), deadline=plan.now + datetime.timedelta(days=rng.randint(-10, 60)))
+
+# Students have submitted to the first content of each of their courses
+def _submissions(plan, start, stop):
+    if not plan.sizes['contents_per_course']:
+        return
+    rng = plan.rng('submissions', start)
+    for index in range(start, stop):
+        for course in plan.courses_of(index):
+            yield Submission(student_id=plan.student_id(index), content_id=plan.content_id(course, 0), submission_text=_sentence(rng, 20))
+
+# Students are notified of every content on their courses
+def _content_notifications(plan, start, stop):
+    for index in range(start, stop):
+        for course in plan.courses_of(index):
+            for number in range(plan.sizes['contents_per_course']):
+                yield NotificationContent(student_id=plan.student_id(index), course_content_id=plan.content_id(course, number))
+
+# Each table: its name, model, how many units it is built from and the rows each unit makes, and how its rows are built
+# Units are what a table's jobs are split by EG. students for the tables holding rows for each student
+# The tables of a stage only refer to tables of earlier stages
+STAGES = [
+    [
+        ('users', StudySphereUser, lambda sizes: sizes['teachers'] + sizes['students'], lambda sizes: 1, _users),
+        ('rooms', ChatRoom, lambda sizes: sizes['rooms'], lambda sizes: 1, _rooms),
+    ],
+    [
+        ('courses', Course, lambda sizes: sizes['courses'], lambda sizes: 1, _courses),
+        ('posts', Post, lambda sizes: sizes['posts'], lambda sizes: 1, _posts),
+        ('messages', ChatMessage, lambda sizes: sizes['rooms'] * sizes['messages_per_room'], lambda sizes: 1, _messages),
+    ],
+    [
+        ('enrollments', Course.students.through, lambda sizes: sizes['students'], lambda sizes: sizes['enrollments_per_student'], _enrollments),
+        ('contents', CourseContent, lambda sizes: sizes['courses'] * sizes['contents_per_course'], lambda sizes: 1, _contents),
+        ('comments', Comment, lambda sizes: sizes['posts'] * sizes['comments_per_post'], lambda sizes: 1, _comments),
+        ('enroll_notifications', NotificationEnroll, lambda sizes: sizes['students'], lambda sizes: sizes['enrollments_per_student'], _enroll_notifications),
+    ],
+    [
+        ('deadlines', CourseDeadline, lambda sizes: sizes['courses'] * sizes['contents_per_course'], lambda sizes: 1, _deadlines),
+        ('submissions', Submission, lambda sizes: sizes['students'], lambda sizes: sizes['enrollments_per_student'], _submissions),
+        ('content_notifications', NotificationContent, lambda sizes: sizes['students'], lambda sizes: sizes['enrollments_per_student'] * sizes['contents_per_course'], _content_notifications),
+    ],
+]
+
+# Inserts the rows of one job in a single transaction, returning the table and the amount of rows inserted
+def _run_job(plan, name, model, build, start, stop, batch_size, threaded):
+    try:
+        with transaction.atomic():
+            rows = model.objects.bulk_create(list(build(plan, start, stop)), batch_size=batch_size)
+        return name, len(rows)
+    finally:
+        # Worker threads open a connection of their own, which is closed once their job is done
+        if threaded:
+            connection.close()
+
+def _run_job_args(job):
+    return _run_job(*job)
+
+# Points the id sequences past the ids assigned by the plan (a no-op on databases without sequences)
+def _reset_sequences():
+    statements = connection.ops.sequence_reset_sql(no_style(), list(ID_MODELS.values()))
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+# Seeds every table of a plan, running the jobs of each stage on workers threads
+# SQLite allows a single writer, so it should be seeded with one worker, which runs every job in the calling thread.
+# on_progress is called with a table's name and the amount of rows just inserted into it. Returns the rows inserted per table.
+def seed(plan, workers=1, batch_size=SEED_BATCH_SIZE, on_progress=None):
+    counts = {}
+    for stage in STAGES:
+        jobs = []
+        for name, model, units, rows_per_unit, build in stage:
+            counts[name] = 0
+            job_units = max(1, JOB_ROWS // max(1, rows_per_unit(plan.sizes)))
+            total = units(plan.sizes)
+            for start in range(0, total, job_units):
+                jobs.append((plan, name, model, build, start, min(start + job_units, total), batch_size, workers > 1))
+        # The executor only starts threads when it is given jobs, which it isn't with a single worker
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_run_job_args, jobs) if workers > 1 else map(_run_job_args, jobs)
+            for name, inserted in results:
+                counts[name] += inserted
+                if on_progress:
+                    on_progress(name, inserted)
+
+    _reset_sequences()
+    # bulk_create sends no signals, so the caches listing everyone's courses, posts and users are dropped here
+    catalog.invalidate()
+    homepage_cache.invalidate(homepage_cache.FEED)
+    homepage_cache.invalidate(homepage_cache.ACTIVE_STUDENTS)
+    return counts
@@ -1,3 +1,151 @@
-from django.test import TestCase
+import json
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.template.backends.django import Template
+from django.template.loader import render_to_string
+from django.urls import reverse
+
+from courses.models import Course, Submission
+from users.models import StudySphereUser
+from . import instrumentation, seeding
+from .benchmark.dataset import seed_dataset
+from .benchmark.runner import ENDPOINTS, plan_requests, run_benchmark
+
+ORIGINAL_RENDER = Template.render
+
+# Tests the request instrumentation middleware and the request_timings command
+@override_settings(
+    REQUEST_INSTRUMENTATION=True, REQUEST_SLOW_MS=60000, REQUEST_TIMINGS_FLUSH_INTERVAL=0,
+    TEMPLATES=[{**settings.TEMPLATES[0], 'BACKEND': 'core_study.instrumentation.InstrumentedTemplates'}],
+)
+class RequestInstrumentationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        teacher = StudySphereUser.objects.create(username='teacher', email='teacher@example.com', auth_level='teacher')
+        Course.objects.create(name='Maths', description='Numbers', teacher=teacher)
+
+    # Tests that queries differing only in their parameters share a fingerprint
+    def test_fingerprint(self):
+        self.assertEqual(
+            instrumentation.fingerprint('SELECT * FROM t WHERE id IN (%s, %s)  AND name = \'x\' LIMIT 21'),
+            instrumentation.fingerprint('SELECT * FROM t WHERE id IN (%s) AND name = \'y\' LIMIT 5'),
+        )
+
+    # Tests that a request gets a Server-Timing header and is added to the timings of its route
+    def test_server_timing_and_percentiles(self):
+        for _ in range(3):
+            response = self.client.get(reverse('index'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=[\d.]+$')
+        timings = instrumentation.get_timings()
+        self.assertEqual(timings['/']['wall']['count'], 3)
+        self.assertGreater(timings['/']['queries']['sum'], 0)
+        self.assertGreater(timings['/']['template']['sum'], 0)
+
+        output = StringIO()
+        call_command('request_timings', '--reset', stdout=output)
+        self.assertIn('(3 requests)', output.getvalue())
+        self.assertIn('queries: p50', output.getvalue())
+        self.assertEqual(instrumentation.get_timings(), {})
+
+    # Tests that templates rendered outside of a request are rendered as usual and Django's own templates are left alone
+    def test_templates_outside_requests(self):
+        self.assertTrue(render_to_string('not_authorized.html'))
+        self.assertIs(Template.render, ORIGINAL_RENDER)
+
+    # Tests that slow requests are logged with their repeated queries
+    @override_settings(REQUEST_SLOW_MS=0)
+    def test_slow_request_logged(self):
+        with self.assertLogs('core_study.instrumentation', 'WARNING') as logs:
+            self.client.get(reverse('index'))
+        self.assertIn('Slow request GET /', logs.output[0])
+
+    # Tests that nothing is recorded unless instrumentation is enabled
+    @override_settings(REQUEST_INSTRUMENTATION=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('index'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(instrumentation.get_timings(), {})
+
+    # Tests that percentiles are read from the histogram buckets
+    def test_percentile(self):
+        histogram = instrumentation._new_histogram('queries')
+        for value in [1, 1, 1, 4, 40]:
+            histogram['count'] += 1
+            histogram['max'] = max(histogram['max'], value)
+            histogram['buckets'][instrumentation._bucket(instrumentation.QUERY_BUCKETS, value)] += 1
+        self.assertEqual(instrumentation.percentile(histogram, 'queries', 0.5), 1)
+        self.assertEqual(instrumentation.percentile(histogram, 'queries', 0.8), 5)
+        self.assertEqual(instrumentation.percentile(histogram, 'queries', 0.99), 40)
+
+# Tests the site benchmark against a small dataset
+class BenchmarkTestCase(TestCase):
+    sizes = {'students': 6, 'teachers': 2, 'courses': 3, 'enrollments_per_student': 2, 'contents_per_course': 2, 'posts': 4, 'comments_per_post': 2, 'rooms': 2, 'messages_per_room': 5}
+
+    # Tests that the same seed plans the same requests and that every endpoint is requested without errors
+    def test_run_benchmark(self):
+        data = seed_dataset(self.sizes, seed=3)
+        requests = plan_requests(data, len(ENDPOINTS) * 2, seed=3)
+        self.assertEqual(requests, plan_requests(data, len(ENDPOINTS) * 2, seed=3))
+        report = run_benchmark(requests)
+        self.assertEqual(report['requests'], len(ENDPOINTS) * 2)
+        self.assertEqual(report['errors'], 0, report['endpoints'])
+        self.assertEqual(set(report['endpoints']), set(ENDPOINTS))
+        self.assertGreater(report['queries_per_request']['mean'], 0)
+
+    # Tests that the command prints its report as JSON
+    def test_command(self):
+        output = StringIO()
+        options = {name: value for name, value in self.sizes.items()}
+        call_command('benchmark_site', '--use-current-db', '--requests=10', '--concurrency=1', '--warmup=0', '--endpoint=homepage_student', '--label=test', stdout=output, stderr=StringIO(), **options)
+        report = json.loads(output.getvalue())
+        self.assertEqual((report['label'], report['requests'], report['errors']), ('test', 10, 0))
+        self.assertEqual(list(report['endpoints']), ['homepage_student'])
+        self.assertEqual(set(report['latency_ms']), {'p50', 'p95', 'p99', 'mean', 'max'})
+
+# Tests seeding synthetic data with core_study.seeding and the seed_studysphere command
+class SeedingTestCase(TestCase):
+    sizes = {'students': 7, 'teachers': 2, 'courses': 3, 'enrollments_per_student': 2, 'contents_per_course': 2, 'posts': 5, 'comments_per_post': 2, 'rooms': 2, 'messages_per_room': 3}
+
+    # Tests that every table gets its rows and that the rows refer to each other through the planned ids
+    def test_seed(self):
+        existing = StudySphereUser.objects.create(username='existing', email='existing@example.com')
+        plan = seeding.SeedPlan(self.sizes, seed=1, prefix='test')
+        counts = seeding.seed(plan)
+        self.assertEqual(counts, {
+            'users': 9, 'rooms': 2, 'courses': 3, 'posts': 5, 'messages': 6, 'enrollments': 14, 'contents': 6,
+            'comments': 10, 'enroll_notifications': 14, 'deadlines': 6, 'submissions': 14, 'content_notifications': 28,
+        })
+        self.assertEqual(plan.teacher_id(0), existing.id + 1)
+        student = StudySphereUser.objects.get(id=plan.student_id(3))
+        self.assertEqual(student.username, 'test_student5')
+        self.assertEqual(sorted(student.enrolled_courses.values_list('id', flat=True)), [plan.course_id(course) for course in plan.courses_of(3)])
+        self.assertEqual(Submission.objects.filter(student=student, content__course__students=student).count(), 2)
+        # Every user shares the one password hash
+        self.assertTrue(student.check_password(seeding.PASSWORD))
+        self.assertEqual(StudySphereUser.objects.filter(password=student.password).count(), 9)
+        # The sequences continue after the planned ids
+        self.assertEqual(StudySphereUser.objects.create(username='after', email='after@example.com').id, plan.user_id(9))
+
+    # Tests that the same seed builds the same rows
+    def test_deterministic(self):
+        first = seeding.SeedPlan(self.sizes, seed=4)
+        second = seeding.SeedPlan(self.sizes, seed=4)
+        for build in [seeding._users, seeding._posts, seeding._enrollments]:
+            self.assertEqual(
+                [(row.__dict__.get('id'), row.__dict__.get('username'), row.__dict__.get('text'), row.__dict__.get('course_id')) for row in build(first, 0, 5)],
+                [(row.__dict__.get('id'), row.__dict__.get('username'), row.__dict__.get('text'), row.__dict__.get('course_id')) for row in build(second, 0, 5)],
+            )
+        self.assertNotEqual([course for index in range(7) for course in first.courses_of(index)], [course for index in range(7) for course in seeding.SeedPlan(self.sizes, seed=5).courses_of(index)])
+
+    # Tests the command, which refuses to seed the same prefix twice
+    def test_command(self):
+        output = StringIO()
+        call_command('seed_studysphere', '--prefix=cmd', '--workers=1', stdout=output, stderr=StringIO(), **self.sizes)
+        self.assertIn('content_notifications: 28 rows', output.getvalue())
+        self.assertEqual(StudySphereUser.objects.filter(username__startswith='cmd_').count(), 9)
+        with self.assertRaises(CommandError):
+            call_command('seed_studysphere', '--prefix=cmd', stdout=StringIO(), stderr=StringIO(), **self.sizes)
@@ -1,7 +1,8 @@
 from django.shortcuts import render
-from courses.views import view_all_courses
+from courses.catalog import get_catalog_page
 
 # / homepage
 def index (request):
-    courses = view_all_courses(request, mode="DATA")
-    return  render(request, 'index.html', {'courses': courses})
+    # Everyone sees the same catalog here, so the cached visitor pages are used
+    catalog = get_catalog_page(request.GET.get('page'))
+    return  render(request, 'index.html', {'courses': catalog['courses'], 'catalog': catalog})
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class CoursesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'courses'
+
+    def ready(self):
+        # Registers the receivers that invalidate the cached homepage sections
+        from . import signals
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from users.models import StudySphereUser
+from . import images
+
+# Lookup-as-you-type for the user search box. Users whose username, first name or last name start
+# with the typed prefix are returned as just their id, username and a thumbnail. On PostgreSQL the
+# case-insensitive prefix lookups use the trigram GIN index created by users migration 0002.
+# Answers for recently typed prefixes are kept in a small LRU cache in each process, which is cleared
+# whenever a user's names or picture change and otherwise expires after AUTOCOMPLETE_CACHE_TIMEOUT.
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MIN_LENGTH = 2
+AUTOCOMPLETE_CACHE_SIZE = 256
+AUTOCOMPLETE_CACHE_TIMEOUT = 60
+
+# Fields of a user that the answers are built from
+FIELDS = ('username', 'first_name', 'last_name', 'profile_picture')
+
+# A least recently used cache of limited size whose entries also expire after timeout seconds
+class LRUCache:
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    # Returns the cached value of key, or None when it isn't cached or has expired
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    # Caches a value, evicting the least recently used entry when the cache is full
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+prefix_cache = LRUCache(AUTOCOMPLETE_CACHE_SIZE, AUTOCOMPLETE_CACHE_TIMEOUT)
+
+# Returns the url of the smallest derivative of a profile picture, falling back to the original
+# manifests holds the manifests of the pictures, looked up together by _lookup
+def thumbnail_url(field_file, manifests):
+    if not field_file:
+        return None
+    widths = manifests[field_file.name].get('jpeg')
+    if widths:
+        return field_file.storage.url(images.derivative_name(field_file.name, widths[0], 'jpeg'))
+    return field_file.url
+
+# Returns the users matching a prefix, those whose username matches before those matched by name
+def _lookup(prefix, limit):
+    matches_username = Q(username__istartswith=prefix)
+    users = StudySphereUser.objects.filter(
+        matches_username | Q(first_name__istartswith=prefix) | Q(last_name__istartswith=prefix)
+    ).annotate(
+        username_match=Case(When(matches_username, then=Value(0)), default=Value(1), output_field=IntegerField())
+    ).only('id', 'username', 'profile_picture').order_by('username_match', 'username')[:limit]
+    manifests = images.get_manifests([user.profile_picture.name for user in users if user.profile_picture])
+    return [{'id': user.id, 'username': user.username, 'thumbnail': thumbnail_url(user.profile_picture, manifests)} for user in users]
+
+# Returns at most AUTOCOMPLETE_LIMIT users matching the typed text, nothing for text shorter than AUTOCOMPLETE_MIN_LENGTH
+def suggest_users(text):
+    prefix = (text or '').strip().lower()
+    if len(prefix) < AUTOCOMPLETE_MIN_LENGTH:
+        return []
+    suggestions = prefix_cache.get(prefix)
+    if suggestions is None:
+        suggestions = _lookup(prefix, AUTOCOMPLETE_LIMIT)
+        prefix_cache.set(prefix, suggestions)
+    return suggestions
+
+# Drops every cached answer, called when a user is saved with changes to the fields answers are built from
+def user_changed(update_fields=None):
+    if update_fields is None or set(update_fields) & set(FIELDS):
+        prefix_cache.clear()
@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+# The homepage is split into sections which are cached separately so that a change only
+# invalidates the sections that actually display it. Sections that are the same for every
+# user (the feed and the list of active students) are cached once rather than per user.
+ENROLLED_COURSES = 'enrolled_courses'
+CREATED_COURSES = 'created_courses'
+DEADLINES = 'deadlines'
+FEED = 'feed'
+ACTIVE_STUDENTS = 'active_students'
+SECTIONS = [ENROLLED_COURSES, CREATED_COURSES, DEADLINES, FEED, ACTIVE_STUDENTS]
+
+KEY_PREFIX = 'homepage'
+
+# Used to tell a cache miss apart from a cached value of None
+_MISSING = object()
+
+# Builds the cache key of a section, user_id is None for sections shared by all users
+def section_key(section, user_id=None):
+    if user_id is None:
+        return f'{KEY_PREFIX}:{section}'
+    return f'{KEY_PREFIX}:{section}:{user_id}'
+
+def _stat_key(section, outcome):
+    return f'{KEY_PREFIX}:stats:{section}:{outcome}'
+
+# Hits and misses are counted in each process and added to counters kept in the cache, which are shared between
+# workers, every HOMEPAGE_CACHE_STATS_FLUSH_INTERVAL seconds, so that a lookup costs no cache round trips of its own
+# (see also core_study.instrumentation.TimingAggregator)
+class StatsCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = Counter()
+        self.last_flush = time.monotonic()
+
+    def record(self, section, outcome):
+        with self.lock:
+            self.pending[_stat_key(section, outcome)] += 1
+            due = time.monotonic() - self.last_flush >= getattr(settings, 'HOMEPAGE_CACHE_STATS_FLUSH_INTERVAL', 10)
+        if due:
+            self.flush()
+
+    # Adds the pending counts to the shared counters, incr being atomic no lock is needed between workers
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+            self.last_flush = time.monotonic()
+        for key, count in pending.items():
+            cache.add(key, 0, timeout=None)
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                # The counter was evicted between add and incr
+                cache.set(key, count, timeout=None)
+
+    def clear(self):
+        with self.lock:
+            self.pending.clear()
+
+stats_counter = StatsCounter()
+
+# Returns the cached value of a section, computing and caching it on a miss
+def get_section(section, user_id, compute):
+    key = section_key(section, user_id)
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        stats_counter.record(section, 'hits')
+        return value
+    stats_counter.record(section, 'misses')
+    value = compute()
+    cache.set(key, value, timeout=getattr(settings, 'HOMEPAGE_CACHE_TIMEOUT', 300))
+    return value
+
+# Drops a section for the given users, or the shared copy of a section when no users are given
+def invalidate(section, user_ids=None):
+    if user_ids is None:
+        cache.delete(section_key(section))
+    else:
+        keys = [section_key(section, user_id) for user_id in user_ids]
+        if keys:
+            cache.delete_many(keys)
+
+# Returns the hit and miss counters of every section along with its hit ratio
+# The counts of this process are flushed first, those of other processes are included up to their last flush
+def get_stats():
+    stats_counter.flush()
+    keys = [_stat_key(section, outcome) for section in SECTIONS for outcome in ('hits', 'misses')]
+    counters = cache.get_many(keys)
+    stats = {}
+    for section in SECTIONS:
+        hits = counters.get(_stat_key(section, 'hits'), 0)
+        misses = counters.get(_stat_key(section, 'misses'), 0)
+        total = hits + misses
+        stats[section] = {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else 0.0}
+    return stats
+
+# Resets every hit and miss counter back to zero
+def reset_stats():
+    stats_counter.clear()
+    cache.delete_many([_stat_key(section, outcome) for section in SECTIONS for outcome in ('hits', 'misses')])
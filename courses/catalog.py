@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Left
+from django.utils.text import Truncator
+
+from .models import Course
+
+# The course catalog is shown a page at a time. Each card only needs a course's name, banner
+# and the start of its description, so only those columns are selected and the description is
+# cut short in the database rather than transferring it whole.
+CATALOG_PAGE_SIZE = 12
+CATALOG_DESCRIPTION_LENGTH = 300
+
+# The catalog shown to visitors (the landing page) is the same for everyone so its pages are cached.
+# Every cached page includes the catalog version in its key, so bumping the version whenever a course
+# is saved or deleted drops all of them at once.
+VERSION_KEY = 'catalog:version'
+
+def _page_key(version, number):
+    return f'catalog:anonymous:{version}:{number}'
+
+# Returns the current catalog version, starting it at 1
+def _get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+# Drops every cached page of the visitor catalog
+def invalidate():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # There is no version yet, so nothing has been cached under one either
+        cache.add(VERSION_KEY, 1, timeout=None)
+
+# Returns the courses shown in the catalog, leaving out the courses a user is enrolled on when one is given
+# The enrollments are excluded with a NOT EXISTS subquery rather than loading the user's course ids first
+def catalog_queryset(user=None):
+    courses = Course.objects.only('id', 'name', 'banner_image', 'teacher_id').annotate(
+        summary=Left('description', CATALOG_DESCRIPTION_LENGTH + 1)
+    ).order_by('id')
+    if user is not None:
+        enrolled = Course.students.through.objects.filter(course_id=OuterRef('pk'), studysphereuser_id=user.id)
+        courses = courses.filter(~Exists(enrolled))
+    return courses
+
+# Returns a page of courses and where it is in the catalog, page_number can be anything sent by the client
+def _build_page(courses, page_number, page_size):
+    page = Paginator(courses, page_size).get_page(page_number)
+    course_list = list(page.object_list)
+    for course in course_list:
+        course.summary = Truncator(course.summary).chars(CATALOG_DESCRIPTION_LENGTH)
+    return {
+        'courses': course_list,
+        'number': page.number,
+        'num_pages': page.paginator.num_pages,
+        'has_previous': page.has_previous(),
+        'has_next': page.has_next(),
+    }
+
+# Returns a page of the catalog. With a user it leaves out their enrolled courses, without one it is
+# the visitor catalog which is cached until a course changes
+def get_catalog_page(page_number=1, user=None, page_size=CATALOG_PAGE_SIZE):
+    if user is not None:
+        return _build_page(catalog_queryset(user), page_number, page_size)
+
+    try:
+        number = int(page_number)
+    except (TypeError, ValueError):
+        number = 1
+    key = _page_key(_get_version(), number)
+    page = cache.get(key)
+    if page is None:
+        page = _build_page(catalog_queryset(), number, page_size)
+        # Out of range numbers are answered with the nearest page but not cached under their own key
+        if page['number'] == number:
+            cache.set(key, page, timeout=settings.CATALOG_CACHE_TIMEOUT)
+    return page
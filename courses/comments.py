@@ -0,0 +1,32 @@
+from django.db.models import Count
+
+from core_study import keyset
+from .models import Comment
+
+# Amount of comments shown per page of a post's comments
+COMMENTS_PAGE_SIZE = 20
+
+# A post's comments are read oldest first, a page at a time, with a keyset (cursor) on (created_at, id), see
+# core_study.keyset, which the (post, created_at, id) index answers with a range scan however many comments the
+# post has. The cursor points at the last comment already shown.
+
+# Returns the page of a post's comments made after the cursor (the first comments without one), oldest first,
+# along with the cursor of the next page (None on the last page). Each comment has its author fetched alongside it.
+def get_comments_page(post_id, cursor=None, page_size=COMMENTS_PAGE_SIZE):
+    comments = Comment.objects.filter(post_id=post_id).select_related('user')
+    return keyset.get_page(comments, 'created_at', cursor, page_size, oldest_first=True)
+
+# Returns the amount of comments on each of the given posts from a single grouped count
+# Posts without comments are left out, so look counts up with .get(post_id, 0)
+def get_comment_counts(post_ids):
+    counts = Comment.objects.filter(post_id__in=set(post_ids)).values('post_id').annotate(count=Count('id')).order_by()
+    return {row['post_id']: row['count'] for row in counts}
+
+# Returns a comment as the fields that clients display
+def serialize_comment(comment):
+    return {
+        'id': comment.id,
+        'user': comment.user.username,
+        'text': comment.text,
+        'created_at': comment.created_at.isoformat(),
+    }
@@ -0,0 +1,38 @@
+import json
+from asgiref.sync import sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from . import notifications
+
+# Pushes a user's new notifications to their open pages as they are created, so that the nav badge
+# and inbox update without reloading. Every connection of a user joins that user's group, which
+# notifications.push sends to. The unread count is sent once on connect and clients add each pushed
+# notification to it, so pushes don't need a count per recipient.
+class NotificationConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+        self.group_name = notifications.group_name(self.user.id)
+
+        # Join the user's group
+        await self.channel_layer.group_add(
+            self.group_name,
+            self.channel_name
+        )
+        await self.accept()
+
+        unread_count = await sync_to_async(notifications.get_unread_count)(self.user)
+        await self.send(text_data=json.dumps({'type': 'unread', 'unread_count': unread_count}))
+
+    async def disconnect(self, close_code):
+        if self.user.is_authenticated:
+            # Leave the user's group
+            await self.channel_layer.group_discard(
+                self.group_name,
+                self.channel_name
+            )
+
+    # Receive a new notification from the user's group
+    async def notification_created(self, event):
+        await self.send(text_data=json.dumps({'type': 'notification', 'notification': event['notification']}))
@@ -0,0 +1,18 @@
+from core_study import keyset
+from .comments import get_comment_counts
+from .models import Post
+
+# Amount of posts returned per page of the status feed
+FEED_PAGE_SIZE = 20
+
+# The feed is paginated with a keyset (cursor) on (created_at, id) rather than an offset, see core_study.keyset
+
+# Returns one page of posts, newest first, along with the cursor of the next page (None on the last page)
+# Each post has its author fetched alongside it and its amount of comments set as comment_count. The comments are
+# counted for the page's posts alone rather than grouped over every post, so the page stays a plain index scan.
+def get_feed_page(cursor=None, page_size=FEED_PAGE_SIZE):
+    posts, next_cursor = keyset.get_page(Post.objects.select_related('user'), 'created_at', cursor, page_size)
+    counts = get_comment_counts([post.id for post in posts])
+    for post in posts:
+        post.comment_count = counts.get(post.id, 0)
+    return posts, next_cursor
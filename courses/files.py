@@ -0,0 +1,108 @@
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+# Size of the chunks that ranges are streamed in
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Parses a single "bytes=start-end" range header into an inclusive (start, end) pair
+# Returns None when there is no usable range and raises ValueError when it can't be satisfied
+def parse_range(header, size):
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Multiple ranges and other units aren't supported, the whole file is sent instead
+        return None
+    start, end = match.groups()
+    if start == '':
+        # "bytes=-500" is the last 500 bytes
+        if end == '' or int(end) == 0:
+            raise ValueError('Unsatisfiable range')
+        return max(size - int(end), 0), size - 1
+    start = int(start)
+    end = size - 1 if end == '' else min(int(end), size - 1)
+    if start >= size or start > end:
+        raise ValueError('Unsatisfiable range')
+    return start, end
+
+# Yields the bytes between start and end (inclusive) of a file, closing it afterwards
+def stream_range(path, start, end):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+# Returns whether an If-Range header still matches the file, in which case the range applies
+def if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    if_range_date = parse_http_date_safe(if_range)
+    return if_range_date is not None and if_range_date >= int(last_modified)
+
+# Serves a stored file with validators and range support. The ETag and Last-Modified headers let
+# browsers revalidate with a 304, byte ranges resume downloads with a 206, and with FILE_DOWNLOAD_OFFLOAD
+# set to "sendfile" or "accel" the web server streams the bytes rather than the Django worker
+def serve_file(request, field_file, content_type='application/pdf'):
+    path = field_file.path
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return HttpResponse("File not found", status=404)
+    size = stat.st_size
+    last_modified = stat.st_mtime
+    etag = quote_etag(f'{size:x}-{int(last_modified * 1000000):x}')
+    filename = os.path.basename(field_file.name)
+
+    # Answers conditional requests (If-None-Match / If-Modified-Since) with a 304, which carries the validators
+    # so that the browser keeps revalidating against them
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if response is not None:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    offload = getattr(settings, 'FILE_DOWNLOAD_OFFLOAD', None)
+    if offload == 'sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+    elif offload == 'accel':
+        response = HttpResponse(content_type=content_type)
+        # nginx decodes the URI it is redirected to, so names with spaces or non-ASCII characters are percent-encoded
+        response['X-Accel-Redirect'] = settings.FILE_DOWNLOAD_ACCEL_PREFIX + quote(field_file.name)
+    else:
+        byte_range = None
+        range_header = request.META.get('HTTP_RANGE')
+        if range_header and if_range_matches(request, etag, last_modified):
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+        if byte_range is None:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(stream_range(path, start, end), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+        response['Accept-Ranges'] = 'bytes'
+
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -65,4 +65,18 @@ class CourseFeedbackForm(forms.ModelForm):
 
 #  Search for users
 class UserSearchForm(forms.Form):
-    query = forms.CharField(label='Search Users', max_length=100)
\ No newline at end of file
+    query = forms.CharField(label='Search Users', max_length=100, widget=forms.TextInput(attrs={'list': 'user-suggestions', 'autocomplete': 'off'}))
+# Search across courses, course content and users
+class SearchForm(forms.Form):
+    KINDS = (
+        ('', 'Everything'),
+        ('course', 'Courses'),
+        ('content', 'Content'),
+        ('user', 'Users')
+    )
+    query = forms.CharField(label='Search', max_length=100)
+    kind = forms.ChoiceField(label='In', choices=KINDS, required=False)
+
+# Upload of a CSV roster of students to enroll on a course
+class RosterImportForm(forms.Form):
+    roster = forms.FileField(label='Roster CSV (username and/or email columns)')
@@ -0,0 +1,116 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Uploaded images (profile pictures, course banners and content images) are resized by a celery task
+# into derivatives at each of IMAGE_DERIVATIVE_WIDTHS, saved as WebP and JPEG next to the original
+# EG. course_banners/maths.jpg gets course_banners/maths.320w.webp and course_banners/maths.320w.jpg
+# The widths that exist for an image are kept in a manifest in the cache, which the templates read
+# to build srcset attributes without touching the storage on every request, only when a manifest is missing.
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+MANIFEST_TIMEOUT = None # Manifests only change when derivatives are generated again
+
+def _manifest_key(name):
+    return f'images:derivatives:{name}'
+
+# Returns the storage name of the derivative of an image at a width and in a format
+def derivative_name(name, width, image_format):
+    root, _ = os.path.splitext(name)
+    return f'{root}.{width}w.{EXTENSIONS[image_format]}'
+
+# Returns the widths that derivatives are generated at for an image of the given width
+# Images are never upscaled, so an image narrower than a width only gets the widths below it
+def derivative_widths(original_width):
+    return [width for width in sorted(settings.IMAGE_DERIVATIVE_WIDTHS) if width < original_width]
+
+# Saves content under name, replacing a file that is already there rather than picking a new name
+def _replace(name, content):
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    default_storage.save(name, ContentFile(content))
+
+# Generates every derivative of a stored image and records them in its manifest
+# Returns the manifest, which maps each format to the widths that were generated
+def generate_derivatives(name):
+    with default_storage.open(name, 'rb') as file:
+        image = Image.open(file)
+        # Applies the EXIF orientation as the derivatives are saved without the EXIF data
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    widths = derivative_widths(image.width)
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS)
+        for image_format, options in FORMATS.items():
+            converted = resized
+            if options['format'] == 'JPEG' and resized.mode != 'RGB':
+                converted = resized.convert('RGB')
+            elif resized.mode not in ('RGB', 'RGBA'):
+                converted = resized.convert('RGBA' if 'A' in resized.getbands() else 'RGB')
+            output = BytesIO()
+            converted.save(output, **options)
+            _replace(derivative_name(name, width, image_format), output.getvalue())
+
+    manifest = {image_format: widths for image_format in FORMATS}
+    cache.set(_manifest_key(name), manifest, timeout=MANIFEST_TIMEOUT)
+    return manifest
+
+# Returns the manifests of images from a single cache lookup
+# An image whose manifest isn't cached (EG. after the cache was cleared) has its derivatives looked for in the
+# storage once and its manifest cached again, all of those missing being cached again together. Manifests are
+# otherwise cached when derivatives are generated, or for every image by
+# `manage.py generate_image_derivatives --manifests-only`.
+def get_manifests(names):
+    keys = {_manifest_key(name): name for name in set(names)}
+    cached = cache.get_many(keys)
+    missing = {key: _find_manifest(name) for key, name in keys.items() if key not in cached}
+    if missing:
+        cache.set_many(missing, timeout=MANIFEST_TIMEOUT)
+        cached.update(missing)
+    return {name: cached[key] for key, name in keys.items()}
+
+# Returns the manifest of an image
+def get_manifest(name):
+    return get_manifests([name])[name]
+
+# Returns the manifest of the derivatives of an image found in the storage
+def _find_manifest(name):
+    return {
+        image_format: [width for width in sorted(settings.IMAGE_DERIVATIVE_WIDTHS) if default_storage.exists(derivative_name(name, width, image_format))]
+        for image_format in FORMATS
+    }
+
+# Looks for the derivatives of an image in the storage and caches its manifest, returning it
+def rebuild_manifest(name):
+    manifest = _find_manifest(name)
+    cache.set(_manifest_key(name), manifest, timeout=MANIFEST_TIMEOUT)
+    return manifest
+
+# Forgets the manifest of an image, EG. before its derivatives are generated again
+def forget_manifest(name):
+    cache.delete(_manifest_key(name))
+
+# Returns the srcset attribute value of every format of an image from its manifest (looked up when not given)
+# Each lists the derivatives of the image in that format and is empty if there are none
+def get_srcsets(name, manifest=None):
+    if manifest is None:
+        manifest = get_manifest(name)
+    return {
+        image_format: ', '.join(f'{default_storage.url(derivative_name(name, width, image_format))} {width}w' for width in widths)
+        for image_format, widths in manifest.items()
+    }
+
+# Returns the srcset attribute value of an image in a single format
+def get_srcset(name, image_format):
+    return get_srcsets(name).get(image_format, '')
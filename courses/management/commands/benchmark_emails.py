@@ -0,0 +1,38 @@
+import time
+
+from django.core import mail
+from django.core.mail import get_connection, send_mail
+from django.core.management.base import BaseCommand
+
+from courses.tasks import EMAIL_SENDER, deliver_emails
+
+LOCMEM_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+
+# Measures how many emails per second are delivered using Django's in-memory email backend
+# comparing a new connection per message against the batched, single connection delivery
+class Command(BaseCommand):
+    help = 'Benchmarks email delivery against the locmem email backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=10000, help='Amount of recipients to send to')
+        parser.add_argument('--batch-size', type=int, default=100, help='Messages sent per batch')
+
+    def handle(self, *args, **options):
+        recipients = [f'student{i}@example.com' for i in range(options['recipients'])]
+        mail.outbox = []
+
+        # One send_mail call, and so one connection, per recipient
+        started = time.perf_counter()
+        for recipient in recipients:
+            send_mail('Benchmark', 'Benchmark message', EMAIL_SENDER, [recipient], connection=get_connection(LOCMEM_BACKEND))
+        self.report('per-message connection', len(recipients), time.perf_counter() - started)
+        mail.outbox = []
+
+        # Batched delivery over a single connection
+        started = time.perf_counter()
+        sent = deliver_emails('Benchmark', 'Benchmark message', recipients, batch_size=options['batch_size'], rate_limit=0, connection=get_connection(LOCMEM_BACKEND))
+        self.report('batched single connection', sent, time.perf_counter() - started)
+        mail.outbox = []
+
+    def report(self, name, sent, elapsed):
+        self.stdout.write(f'{name}: {sent} messages in {elapsed:.2f}s ({sent / elapsed:.0f} messages/sec)')
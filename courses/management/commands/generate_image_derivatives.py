@@ -0,0 +1,37 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from courses import images
+from courses.models import Course, CourseContent
+from courses.tasks import generate_image_derivatives
+from users.models import StudySphereUser
+
+# Generates derivatives for images uploaded before the derivative pipeline existed, including the default images
+# Each distinct image is only processed once, however many rows use it
+class Command(BaseCommand):
+    help = 'Generates the resized derivatives of every stored profile picture, banner and content image'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='store_true', help='Queue a celery task per image rather than generating them here')
+        parser.add_argument('--manifests-only', action='store_true', help='Only cache the manifests of the derivatives already stored EG. after the cache was cleared')
+
+    def handle(self, *args, **options):
+        names = set()
+        names.update(StudySphereUser.objects.values_list('profile_picture', flat=True).distinct())
+        names.update(Course.objects.values_list('banner_image', flat=True).distinct())
+        names.update(CourseContent.objects.exclude(content_image='').values_list('content_image', flat=True).distinct())
+        names.discard(None)
+        names.discard('')
+
+        for name in sorted(names):
+            if not default_storage.exists(name):
+                self.stdout.write(f'{name}: missing, skipped')
+            elif options['manifests_only']:
+                manifest = images.rebuild_manifest(name)
+                self.stdout.write(f"{name}: {len(manifest['webp'])} widths found")
+            elif options['queue']:
+                generate_image_derivatives.delay(name)
+                self.stdout.write(f'{name}: queued')
+            else:
+                manifest = images.generate_derivatives(name)
+                self.stdout.write(f"{name}: {len(manifest['webp'])} widths")
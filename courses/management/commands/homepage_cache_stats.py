@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from courses import cache as homepage_cache
+
+# Prints the hit and miss counters of each cached homepage section
+class Command(BaseCommand):
+    help = 'Shows how effective the homepage cache is per section'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset all counters after printing them')
+
+    def handle(self, *args, **options):
+        for section, stats in homepage_cache.get_stats().items():
+            self.stdout.write(f"{section}: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_ratio']:.1%} hit ratio)")
+        if options['reset']:
+            homepage_cache.reset_stats()
+            self.stdout.write('Counters have been reset')
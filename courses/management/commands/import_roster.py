@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from courses.models import Course
+from courses.roster import ROSTER_BATCH_SIZE, import_roster, read_roster
+
+# Enrolls the students listed in a CSV file on a course, reporting progress after each batch
+# The file needs a header naming a username and/or email column
+class Command(BaseCommand):
+    help = 'Imports a CSV roster of students (username/email) onto a course'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_id', type=int, help='Id of the course to enroll the students on')
+        parser.add_argument('path', help='Path of the CSV file')
+        parser.add_argument('--batch-size', type=int, default=ROSTER_BATCH_SIZE, help='Rows enrolled per batch')
+
+    def handle(self, *args, **options):
+        try:
+            course = Course.objects.get(id=options['course_id'])
+        except Course.DoesNotExist:
+            raise CommandError(f"Course {options['course_id']} does not exist")
+
+        def on_progress(report):
+            self.stdout.write(f"{report['rows']} rows read, {report['enrolled']} enrolled")
+
+        with open(options['path'], 'rb') as file:
+            report = import_roster(course, read_roster(file), batch_size=options['batch_size'], on_progress=on_progress)
+
+        self.stdout.write(
+            f"Done: {report['rows']} rows, {report['enrolled']} enrolled, {report['already_enrolled']} already enrolled, "
+            f"{report['not_found']} not found, {report['not_students']} not students, {report['invalid']} invalid"
+        )
+        for problem in report['problems']:
+            self.stdout.write(f"Line {problem['line']} ({problem['username'] or problem['email']}): {problem['reason']}")
+        # The rows before a file failed to read are enrolled and reported above, the command still fails
+        if report['error']:
+            raise CommandError(f"The roster stopped being read after {report['rows']} rows: {report['error']}")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from courses import search
+
+# Indexes every course, content and user from scratch, needed once for objects created before search existed
+# Afterwards the index is kept up to date as objects are saved and deleted
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of courses, course content and users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Objects read and entries inserted per batch')
+
+    def handle(self, *args, **options):
+        entries = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(f'Indexed {entries} objects')
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='coursedeadline',
+            index=models.Index(fields=['deadline'], name='courses_cou_deadlin_aa205b_idx'),
+        ),
+    ]
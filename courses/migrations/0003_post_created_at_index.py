@@ -0,0 +1,19 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0002_coursedeadline_deadline_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['created_at', 'id'], name='courses_pos_created_8ba2b8_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:26
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+# The GIN index that full-text queries use, PostgreSQL only as other databases have no tsvector
+def create_search_vector_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE INDEX courses_searchentry_vector_gin ON courses_searchentry USING GIN (search_vector)')
+
+
+def drop_search_vector_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS courses_searchentry_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0003_post_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('course', 'course'), ('content', 'content'), ('user', 'user')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('title', models.TextField()),
+                ('body', models.TextField(blank=True)),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='searchentry',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_search_entry'),
+        ),
+        migrations.RunPython(create_search_vector_index, drop_search_vector_index),
+    ]
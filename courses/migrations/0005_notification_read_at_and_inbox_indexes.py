@@ -0,0 +1,33 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0004_searchentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationcontent',
+            name='read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='notificationenroll',
+            name='read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='notificationcontent',
+            index=models.Index(fields=['student', 'created_at', 'id'], name='courses_not_student_ec1f31_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationenroll',
+            index=models.Index(fields=['teacher', 'enrolled_at', 'id'], name='courses_not_teacher_cebf31_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+# The kind, model and indexed title and body of every searchable object, as in courses.search.DOCUMENTS
+DOCUMENTS = [
+    ('course', 'courses', 'Course', ('name', 'description'), lambda course: (course.name, course.description)),
+    ('content', 'courses', 'CourseContent', ('title', 'content_text'), lambda content: (content.title, content.content_text or '')),
+    ('user', *settings.AUTH_USER_MODEL.split('.'), ('username', 'first_name', 'last_name'), lambda user: (user.username, f'{user.first_name} {user.last_name}')),
+]
+
+
+# Indexes every object created before the search index existed, objects already indexed are left as they are
+def backfill_search_entries(apps, schema_editor):
+    SearchEntry = apps.get_model('courses', 'SearchEntry')
+    for kind, app_label, model_name, fields, document in DOCUMENTS:
+        model = apps.get_model(app_label, model_name)
+        entries = []
+        for instance in model.objects.only('id', *fields).iterator(chunk_size=BATCH_SIZE):
+            title, body = document(instance)
+            entries.append(SearchEntry(kind=kind, object_id=instance.pk, title=title, body=body))
+            if len(entries) >= BATCH_SIZE:
+                SearchEntry.objects.bulk_create(entries, ignore_conflicts=True)
+                entries = []
+        SearchEntry.objects.bulk_create(entries, ignore_conflicts=True)
+    if schema_editor.connection.vendor == 'postgresql':
+        SearchEntry.objects.filter(search_vector__isnull=True).update(
+            search_vector=SearchVector('title', weight='A', config='simple') + SearchVector('body', weight='B', config='simple')
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0007_comment_post_created_at_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_entries, migrations.RunPython.noop),
+    ]
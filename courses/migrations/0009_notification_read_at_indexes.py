@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 20:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0008_backfill_search_entries'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notificationcontent',
+            index=models.Index(fields=['read_at'], name='courses_not_read_at_7dc9f4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationenroll',
+            index=models.Index(fields=['read_at'], name='courses_not_read_at_f6f6b8_idx'),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from users.models import StudySphereUser
 
@@ -28,12 +29,22 @@ class CourseDeadline(models.Model):
     content = models.ForeignKey(CourseContent, on_delete=models.CASCADE) # Relationship to CourseContent
     deadline = models.DateTimeField() # Deadline for each course content
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['deadline']), # Upcoming deadlines are filtered and ordered by date
+        ]
+
 # Models each post made by the users
 class Post(models.Model):
     user = models.ForeignKey(StudySphereUser, on_delete=models.CASCADE) # Relationship to the User that creates the post
     text = models.TextField() # Post text EG. Welcome to the Platform!
     created_at = models.DateTimeField(auto_now_add=True) # Date - Time when post was made.
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']), # The feed is paginated newest first by (created_at, id)
+        ]
+
     def __str__(self):
         return f"Post by {self.user.username} at {self.created_at}"
 
@@ -44,6 +55,11 @@ class Comment(models.Model):
     text = models.TextField() # Text that the comment contains
     created_at = models.DateTimeField(auto_now_add=True) # Date - Time when comment was made created
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created_at', 'id']), # A post's comments are paginated oldest first by (created_at, id)
+        ]
+
     def __str__(self):
         return f"Comment by {self.user.username} on post '{self.post}' at {self.created_at}"
     
@@ -71,10 +87,63 @@ class NotificationContent(models.Model):
     student = models.ForeignKey(StudySphereUser, on_delete=models.CASCADE) # Relationship to the student that is to receive the notification
     course_content = models.ForeignKey(CourseContent, on_delete=models.CASCADE) # Relationship to the course content
     created_at = models.DateTimeField(auto_now_add=True) # Date - Time created at
+    read_at = models.DateTimeField(null=True, blank=True) # Date - Time the student read it at, None while unread
+
+    class Meta:
+        indexes = [
+            # A student's inbox is read newest first, a page at a time
+            models.Index(fields=['student', 'created_at', 'id']),
+            # Read notifications are pruned by when they were read
+            models.Index(fields=['read_at']),
+        ]
 
 # Models a notification when student is enrolled into course
 class NotificationEnroll(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE) # The relationship to the course that the student enrolled to
     student = models.ForeignKey(StudySphereUser, null=True, on_delete=models.CASCADE, related_name='enrolled_student') # relationship to the student that enrolled
     teacher = models.ForeignKey(StudySphereUser, null=True, on_delete=models.CASCADE, related_name='enrolled_teacher') # relationship to the teacher that created the course
-    enrolled_at = models.DateTimeField(auto_now_add=True) # Date - Time created at
\ No newline at end of file
+    enrolled_at = models.DateTimeField(auto_now_add=True) # Date - Time created at
+    read_at = models.DateTimeField(null=True, blank=True) # Date - Time the teacher read it at, None while unread
+
+    class Meta:
+        indexes = [
+            # A teacher's inbox is read newest first, a page at a time
+            models.Index(fields=['teacher', 'enrolled_at', 'id']),
+            # Read notifications are pruned by when they were read
+            models.Index(fields=['read_at']),
+        ]
+
+# Models the removal of a student from a course by its teacher, kept as an audit of who removed whom and when
+class EnrollmentRemoval(models.Model):
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='removals') # The course the student was removed from
+    student = models.ForeignKey(StudySphereUser, null=True, on_delete=models.SET_NULL, related_name='+') # The student that was removed
+    username = models.CharField(max_length=150) # The username of the student, kept should the student be deleted
+    removed_by = models.ForeignKey(StudySphereUser, null=True, on_delete=models.SET_NULL, related_name='+') # The teacher that removed them
+    removed_at = models.DateTimeField(auto_now_add=True) # Date - Time removed at
+
+    class Meta:
+        indexes = [
+            # A course's removals are listed newest first
+            models.Index(fields=['course', 'removed_at']),
+        ]
+
+# Models an entry of the search index, one for each searchable course, content and user
+# On PostgreSQL the title and body are also stored as a weighted tsvector which is GIN indexed by migration 0004
+# (the index is created on PostgreSQL only, so it isn't declared here)
+class SearchEntry(models.Model):
+    KINDS = (
+        ('course', 'course'),
+        ('content', 'content'),
+        ('user', 'user')
+    )
+    kind = models.CharField(max_length=20, choices=KINDS) # What kind of object the entry is for
+    object_id = models.BigIntegerField() # The id of the object
+    title = models.TextField() # The most relevant text EG. a course name, weighted higher when ranking
+    body = models.TextField(blank=True) # Any other searchable text EG. a course description
+    search_vector = SearchVectorField(null=True) # Weighted tsvector of the title and body, only filled on PostgreSQL
+    updated_at = models.DateTimeField(auto_now=True) # Date - Time last indexed at
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='unique_search_entry'),
+        ]
@@ -0,0 +1,149 @@
+import datetime
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+
+from core_study import keyset
+from .models import NotificationContent, NotificationEnroll
+
+# The notification inbox. Teachers are notified of students enrolling on their courses (NotificationEnroll)
+# and students of content added to their courses (NotificationContent). Inboxes are read newest first with
+# a keyset (cursor) over (created, id), see core_study.keyset, which the (recipient, created, id)
+# indexes answer with a range scan. Notifications are unread until marked read, and the amount of unread
+# notifications shown on the nav badge is cached per user until one of theirs is created, read or pruned.
+INBOX_PAGE_SIZE = 20
+
+logger = logging.getLogger(__name__)
+
+# Counts are invalidated whenever notifications are created, read or pruned. Notifications deleted along with their
+# course aren't tracked (a post_delete receiver would stop notifications being deleted in bulk) so this bounds how long
+# such a stale count is shown for
+UNREAD_COUNT_TIMEOUT = 60 * 10
+
+# Each inbox: its model, the field holding the recipient, the field holding when it was created and what to fetch alongside it
+INBOXES = {
+    'teacher': (NotificationEnroll, 'teacher', 'enrolled_at', ('student', 'course')),
+    'student': (NotificationContent, 'student', 'created_at', ('course_content__course',)),
+}
+
+def _unread_key(user_id):
+    return f'notifications:unread:{user_id}'
+
+# Returns the inbox of a user: its model, recipient field, created field and related fields
+def _inbox(user):
+    return INBOXES['teacher' if user.auth_level == 'teacher' else 'student']
+
+# Returns all notifications of a user
+def inbox_queryset(user):
+    model, recipient, _, related = _inbox(user)
+    return model.objects.filter(**{recipient: user}).select_related(*related)
+
+# Returns one page of a user's notifications, newest first, along with the cursor of the next page (None on the last page)
+def get_inbox_page(user, cursor=None, page_size=INBOX_PAGE_SIZE):
+    _, _, created, _ = _inbox(user)
+    return keyset.get_page(inbox_queryset(user), created, cursor, page_size)
+
+# Returns the amount of unread notifications of a user, counted once and then cached
+def get_unread_count(user):
+    key = _unread_key(user.id)
+    count = cache.get(key)
+    if count is None:
+        count = inbox_queryset(user).filter(read_at__isnull=True).count()
+        cache.set(key, count, timeout=UNREAD_COUNT_TIMEOUT)
+    return count
+
+# Drops the cached unread counts of users
+def invalidate_unread_counts(user_ids):
+    keys = [_unread_key(user_id) for user_id in set(user_ids)]
+    if keys:
+        cache.delete_many(keys)
+
+# Marks a user's unread notifications as read, only those with the given ids when ids are given
+# Returns the amount of notifications marked
+def mark_read(user, ids=None):
+    model, recipient, _, _ = _inbox(user)
+    notifications = model.objects.filter(**{recipient: user}, read_at__isnull=True)
+    if ids is not None:
+        notifications = notifications.filter(id__in=ids)
+    marked = notifications.update(read_at=timezone.now())
+    if marked:
+        invalidate_unread_counts([user.id])
+    return marked
+
+# Returns a notification as the fields that clients display
+def serialize_notification(notification):
+    if isinstance(notification, NotificationEnroll):
+        return {
+            'id': notification.id,
+            'type': 'enroll',
+            'student': notification.student.username if notification.student else None,
+            'course': notification.course.name,
+            'created_at': notification.enrolled_at.isoformat(),
+            'read': notification.read_at is not None,
+            'url': reverse('view', args=[notification.course_id]),
+        }
+    return {
+        'id': notification.id,
+        'type': 'content',
+        'content': notification.course_content.title,
+        'course': notification.course_content.course.name if notification.course_content.course else None,
+        'created_at': notification.created_at.isoformat(),
+        'read': notification.read_at is not None,
+        'url': reverse('view_content', args=[notification.course_content_id]),
+    }
+
+# Returns the channel layer group that a user's notification websockets are in
+def group_name(user_id):
+    return f'notifications_{user_id}'
+
+# Sends new notifications to their recipients' open websockets, see consumers.NotificationConsumer
+# Pushing is best effort, the notifications are already saved and shown in the inbox if it fails
+def push(new_notifications):
+    messages = []
+    for notification in new_notifications:
+        recipient_id = notification.teacher_id if isinstance(notification, NotificationEnroll) else notification.student_id
+        if recipient_id is not None:
+            messages.append((group_name(recipient_id), {'type': 'notification_created', 'notification': serialize_notification(notification)}))
+    if not messages:
+        return
+
+    # Every message is sent from a single trip into the event loop
+    async def send_all(channel_layer):
+        for group, message in messages:
+            await channel_layer.group_send(group, message)
+
+    try:
+        async_to_sync(send_all)(get_channel_layer())
+    except Exception:
+        logger.exception('Failed to push notifications')
+
+# Deletes read notifications older than NOTIFICATION_READ_RETENTION_DAYS and unread ones older than
+# NOTIFICATION_UNREAD_RETENTION_DAYS, batch_size at a time so that no delete holds locks for long
+# Each condition is pruned with its own queries so that it can use its index, and batches walk up the ids
+# from the last one deleted rather than searching the whole table again for every batch.
+# Returns the amount of notifications deleted from each inbox
+def prune(batch_size=1000, now=None):
+    now = now or timezone.now()
+    read_before = now - datetime.timedelta(days=settings.NOTIFICATION_READ_RETENTION_DAYS)
+    unread_before = now - datetime.timedelta(days=settings.NOTIFICATION_UNREAD_RETENTION_DAYS)
+    deleted = {}
+    for inbox, (model, recipient, created, _) in INBOXES.items():
+        deleted[inbox] = 0
+        for expired in (Q(read_at__lt=read_before), Q(**{f'{created}__lt': unread_before})):
+            last_id = 0
+            while True:
+                batch = list(model.objects.filter(expired, id__gt=last_id).order_by('id').values_list('id', f'{recipient}_id')[:batch_size])
+                if not batch:
+                    break
+                model.objects.filter(id__in=[notification_id for notification_id, _ in batch]).delete()
+                # Pruned unread notifications change their recipients' unread counts
+                invalidate_unread_counts([user_id for _, user_id in batch])
+                deleted[inbox] += len(batch)
+                last_id = batch[-1][0]
+    return deleted
@@ -0,0 +1,181 @@
+import csv
+import io
+
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Q
+
+from users.models import StudySphereUser
+from . import cache as homepage_cache
+from . import notifications
+from .models import Course, EnrollmentRemoval, NotificationEnroll
+from .tasks import send_emails
+
+# Rows resolved and enrolled per batch when importing a roster
+ROSTER_BATCH_SIZE = 1000
+
+# Students shown per page of a course's roster when editing it
+ROSTER_PAGE_SIZE = 50
+
+# At most this many problem rows are listed in a report, the rest are only counted
+ROSTER_REPORT_LIMIT = 50
+
+# Returns an empty import report
+def _new_report():
+    return {
+        'rows': 0,
+        'enrolled': 0,
+        'already_enrolled': 0,
+        'not_found': 0,
+        'not_students': 0,
+        'invalid': 0,
+        'problems': [],
+        'error': None,
+    }
+
+def _problem(report, line, row, reason):
+    report[reason] += 1
+    if len(report['problems']) < ROSTER_REPORT_LIMIT:
+        report['problems'].append({'line': line, 'username': row.get('username', ''), 'email': row.get('email', ''), 'reason': reason})
+
+# Reads roster rows from an uploaded CSV file one line at a time, the header names the username and/or email columns
+# Yields (line number, row) pairs, raising ValueError on the first read when neither column is present
+def read_roster(file):
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+    fields = {(name or '').strip().lower() for name in reader.fieldnames or []}
+    if not fields & {'username', 'email'}:
+        raise ValueError('The roster needs a username or email column')
+    for row in reader:
+        yield reader.line_num, {(key or '').strip().lower(): (value or '').strip() for key, value in row.items() if key is not None}
+
+# Enrolls the students of one batch of rows, returning the ids and emails of those newly enrolled
+def _enroll_batch(course, batch, report):
+    usernames = {row['username'] for _, row in batch if row.get('username')}
+    # Emails are looked up as written and in lowercase, the case they are usually stored in
+    emails = {email for _, row in batch if row.get('email') for email in (row['email'], row['email'].lower())}
+    # Every user in the batch is resolved in one query
+    users = StudySphereUser.objects.filter(Q(username__in=usernames) | Q(email__in=emails)).only('id', 'username', 'email', 'auth_level')
+    by_username = {}
+    by_email = {}
+    for user in users:
+        by_username[user.username] = user
+        by_email[user.email.lower()] = user
+
+    students = {}
+    for line, row in batch:
+        if not row.get('username') and not row.get('email'):
+            _problem(report, line, row, 'invalid')
+            continue
+        user = by_username.get(row.get('username')) or by_email.get(row.get('email', '').lower())
+        if user is None:
+            _problem(report, line, row, 'not_found')
+        elif user.auth_level != 'student':
+            _problem(report, line, row, 'not_students')
+        else:
+            students[user.id] = user
+
+    through = Course.students.through
+    with transaction.atomic():
+        enrolled = set(through.objects.filter(course=course, studysphereuser_id__in=students).values_list('studysphereuser_id', flat=True))
+        # Students enrolling themselves meanwhile make their rows conflict, those are skipped rather than failing the batch
+        through.objects.bulk_create(
+            [through(course_id=course.id, studysphereuser_id=student_id) for student_id in students if student_id not in enrolled],
+            ignore_conflicts=True,
+        )
+        # bulk_create can't tell which rows it skipped, so the enrollments are read back: the new students are
+        # those enrolled now that weren't before the insert
+        now_enrolled = set(through.objects.filter(course=course, studysphereuser_id__in=students).values_list('studysphereuser_id', flat=True))
+        new_ids = [student_id for student_id in students if student_id in now_enrolled and student_id not in enrolled]
+        created = NotificationEnroll.objects.bulk_create([NotificationEnroll(course=course, student=students[student_id], teacher_id=course.teacher_id) for student_id in new_ids])
+        # bulk_create sends no post_save, so the teacher's websockets are sent the notifications here
+        transaction.on_commit(lambda: notifications.push(created))
+    report['already_enrolled'] += len(students) - len(new_ids)
+    report['enrolled'] += len(new_ids)
+
+    # bulk_create sends no signals, so the caches are invalidated here
+    homepage_cache.invalidate(homepage_cache.ENROLLED_COURSES, new_ids)
+    homepage_cache.invalidate(homepage_cache.DEADLINES, new_ids)
+    return [(student_id, students[student_id].email) for student_id in new_ids]
+
+# Enrolls the students listed in roster rows on a course, batch_size rows at a time
+# Rows are (line number, row) pairs as yielded by read_roster, so a file is never read into memory whole.
+# Students are matched by username or email, those already enrolled are skipped, and the teacher gets an
+# enrollment notification for each new student, pushed to their websockets. The new students of each batch
+# are emailed by one email job once the batch is enrolled.
+# A file that can't be read stops the import where it fails: the rows before it are still enrolled and the
+# report of them is returned with the reading error as its error.
+# on_progress is called with the report after each batch. Returns the report.
+def import_roster(course, rows, batch_size=ROSTER_BATCH_SIZE, on_progress=None):
+    report = _new_report()
+    batch = []
+
+    def flush():
+        new_students = _enroll_batch(course, batch, report)
+        batch.clear()
+        if new_students:
+            notifications.invalidate_unread_counts([course.teacher_id])
+            recipients = [email for _, email in new_students]
+            transaction.on_commit(lambda: send_emails.delay('You have been enrolled on a course!', f'You have been enrolled on course {course.name}', recipients))
+        if on_progress:
+            on_progress(report)
+
+    try:
+        for line, row in rows:
+            report['rows'] += 1
+            batch.append((line, row))
+            if len(batch) >= batch_size:
+                flush()
+    except (ValueError, UnicodeDecodeError, csv.Error) as error:
+        report['error'] = str(error)
+    if batch:
+        flush()
+    return report
+
+# Returns the students enrolled on a course ordered by username, only those whose username, names or email
+# contain query when one is given. Only the columns shown on the roster are selected.
+def roster_queryset(course, query=''):
+    students = StudySphereUser.objects.filter(enrolled_courses=course).only('id', 'username', 'first_name', 'last_name', 'email')
+    query = (query or '').strip()
+    if query:
+        students = students.filter(
+            Q(username__icontains=query) | Q(first_name__icontains=query) | Q(last_name__icontains=query) | Q(email__icontains=query)
+        )
+    return students.order_by('username', 'id')
+
+# Returns a page of a course's roster and where it is in the roster, page_number can be anything sent by the client
+def get_roster_page(course, query='', page_number=1, page_size=ROSTER_PAGE_SIZE):
+    page = Paginator(roster_queryset(course, query), page_size).get_page(page_number)
+    return {
+        'students': list(page.object_list),
+        'query': (query or '').strip(),
+        'count': page.paginator.count,
+        'number': page.number,
+        'num_pages': page.paginator.num_pages,
+        'has_previous': page.has_previous(),
+        'has_next': page.has_next(),
+    }
+
+# Removes students from a course, recording each removal made by removed_by
+# The enrollments are locked and read, deleted with a single DELETE on the through table and their
+# removals inserted with a single INSERT, all in one transaction. Ids of students that aren't enrolled
+# are ignored. Returns the usernames of the students removed.
+def remove_students(course, student_ids, removed_by):
+    through = Course.students.through
+    with transaction.atomic():
+        enrollments = list(
+            through.objects.filter(course=course, studysphereuser_id__in=set(student_ids)).select_for_update(of=('self',))
+            .values_list('id', 'studysphereuser_id', 'studysphereuser__username')
+        )
+        if not enrollments:
+            return []
+        through.objects.filter(id__in=[enrollment_id for enrollment_id, _, _ in enrollments]).delete()
+        EnrollmentRemoval.objects.bulk_create([
+            EnrollmentRemoval(course=course, student_id=student_id, username=username, removed_by=removed_by)
+            for _, student_id, username in enrollments
+        ])
+
+    # Deleting from the through table sends no m2m_changed signal, so the caches are invalidated here
+    removed_ids = [student_id for _, student_id, _ in enrollments]
+    homepage_cache.invalidate(homepage_cache.ENROLLED_COURSES, removed_ids)
+    homepage_cache.invalidate(homepage_cache.DEADLINES, removed_ids)
+    return [username for _, _, username in enrollments]
@@ -0,0 +1,243 @@
+import math
+import re
+import threading
+from bisect import bisect_left
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection, transaction
+from django.db.models import Count, F, Max
+
+from users.models import StudySphereUser
+from .models import Course, CourseContent, SearchEntry
+
+# Full-text search over courses, course content and users. Every searchable object has a SearchEntry
+# holding its title and body, kept up to date by signals whenever the object is saved or deleted.
+# On PostgreSQL entries also store a weighted tsvector that is queried through a GIN index and ranked
+# with ts_rank. Other databases (SQLite in development and tests) use an in-memory inverted index
+# built from the entries instead, which ranks the same way: title matches count more than body matches.
+# Every word of a query has to match, and words match as prefixes so that "math" finds "maths".
+SEARCH_PAGE_SIZE = 20
+
+COURSE = 'course'
+CONTENT = 'content'
+USER = 'user'
+KINDS = [COURSE, CONTENT, USER]
+
+# The same weights PostgreSQL gives to A (title) and B (body) by default
+TITLE_WEIGHT = 1.0
+BODY_WEIGHT = 0.4
+
+# The 'simple' configuration lowercases words without stemming, matching the fallback's tokenizer
+SEARCH_CONFIG = 'simple'
+SEARCH_VECTOR = SearchVector('title', weight='A', config=SEARCH_CONFIG) + SearchVector('body', weight='B', config=SEARCH_CONFIG)
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Splits text into lowercase words
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+# The kind, title and body that an object is indexed with, and the fields they are built from
+DOCUMENTS = {
+    Course: (COURSE, ('name', 'description'), lambda course: (course.name, course.description)),
+    CourseContent: (CONTENT, ('title', 'content_text'), lambda content: (content.title, content.content_text or '')),
+    StudySphereUser: (USER, ('username', 'first_name', 'last_name'), lambda user: (user.username, f'{user.first_name} {user.last_name}')),
+}
+MODELS = {kind: model for model, (kind, _, _) in DOCUMENTS.items()}
+
+def uses_postgres():
+    return connection.vendor == 'postgresql'
+
+# An inverted index of the search entries kept in memory, used when the database has no full-text search
+# Each word maps to the entries containing it and their weighted amount of occurrences. The index is built
+# from the database on first use, updated in place as objects are saved, and rebuilt when the entries were
+# changed elsewhere (EG. by another process), which is noticed by their count and latest update changing.
+class FallbackIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    # Forgets everything, the index is built again on its next use
+    def reset(self):
+        with self.lock:
+            self.loaded = False
+            self.signature = None
+            self.postings = {}
+            self.documents = {}
+            self.terms = []
+            self.terms_dirty = False
+
+    # Returns the count and latest update of the entries in the database
+    def _database_signature(self):
+        stats = SearchEntry.objects.aggregate(count=Count('id'), updated_at=Max('updated_at'))
+        return stats['count'], stats['updated_at']
+
+    # Builds the index from the database unless it is already up to date with it
+    def ensure_loaded(self):
+        with self.lock:
+            signature = self._database_signature()
+            if self.loaded and signature == self.signature:
+                return
+            self.reset()
+            for kind, object_id, title, body in SearchEntry.objects.values_list('kind', 'object_id', 'title', 'body').iterator():
+                self._add((kind, object_id), title, body)
+            self.loaded = True
+            self.signature = signature
+
+    def _add(self, key, title, body):
+        weights = {}
+        for term in tokenize(title):
+            weights[term] = weights.get(term, 0) + TITLE_WEIGHT
+        for term in tokenize(body):
+            weights[term] = weights.get(term, 0) + BODY_WEIGHT
+        for term, weight in weights.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                self.terms_dirty = True
+            self.postings[term][key] = weight
+        self.documents[key] = set(weights)
+
+    def _remove(self, key):
+        for term in self.documents.pop(key, ()):
+            postings = self.postings[term]
+            postings.pop(key, None)
+            if not postings:
+                del self.postings[term]
+                self.terms_dirty = True
+
+    # Applies a saved entry, entries saved before the index is built are picked up when it is built
+    def update(self, entry, created):
+        with self.lock:
+            if not self.loaded:
+                return
+            key = (entry.kind, entry.object_id)
+            self._remove(key)
+            self._add(key, entry.title, entry.body)
+            count, _ = self.signature
+            self.signature = (count + 1 if created else count, entry.updated_at)
+
+    # Applies a deleted entry
+    def remove(self, kind, object_id, deleted):
+        with self.lock:
+            if not self.loaded:
+                return
+            self._remove((kind, object_id))
+            if deleted:
+                count, updated_at = self.signature
+                self.signature = (count - deleted, updated_at)
+
+    # Returns every indexed word starting with prefix, found by bisecting the sorted words
+    def _terms_starting_with(self, prefix):
+        if self.terms_dirty:
+            self.terms = sorted(self.postings)
+            self.terms_dirty = False
+        index = bisect_left(self.terms, prefix)
+        while index < len(self.terms) and self.terms[index].startswith(prefix):
+            yield self.terms[index]
+            index += 1
+
+    # Returns (score, kind, object_id) of every entry matching all of the tokens, best first
+    # Scores add up the weighted occurrences of each token times how rare it is (its inverse document frequency)
+    def search(self, tokens, kinds):
+        self.ensure_loaded()
+        with self.lock:
+            total = len(self.documents)
+            scores = None
+            for token in tokens:
+                token_scores = {}
+                for term in self._terms_starting_with(token):
+                    postings = self.postings[term]
+                    idf = math.log(1 + total / len(postings))
+                    for key, weight in postings.items():
+                        token_scores[key] = max(token_scores.get(key, 0), weight * idf)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {key: score + token_scores[key] for key, score in scores.items() if key in token_scores}
+                if not scores:
+                    return []
+        results = [(score, kind, object_id) for (kind, object_id), score in scores.items() if kind in kinds]
+        results.sort(key=lambda result: (-result[0], result[1], result[2]))
+        return results
+
+fallback_index = FallbackIndex()
+
+# Adds or updates the entry of an object, called whenever it is saved
+# update_fields is passed on from post_save so that saves not touching indexed fields (EG. logins) are skipped
+def index_object(instance, update_fields=None):
+    kind, fields, document = DOCUMENTS[type(instance)]
+    if update_fields is not None and not set(update_fields) & set(fields):
+        return
+    title, body = document(instance)
+    entry, created = SearchEntry.objects.update_or_create(kind=kind, object_id=instance.pk, defaults={'title': title, 'body': body})
+    if uses_postgres():
+        SearchEntry.objects.filter(id=entry.id).update(search_vector=SEARCH_VECTOR)
+    else:
+        fallback_index.update(entry, created)
+
+# Removes the entry of an object, called whenever it is deleted
+def remove_object(instance):
+    kind, _, _ = DOCUMENTS[type(instance)]
+    deleted, _ = SearchEntry.objects.filter(kind=kind, object_id=instance.pk).delete()
+    if not uses_postgres():
+        fallback_index.remove(kind, instance.pk, deleted)
+
+# Indexes every object from scratch, EG. for objects created before search existed
+# The entries are inserted batch_size at a time as the objects are read, and the index is replaced in one
+# transaction, so searches see the old index until the new one is complete. Returns the amount of entries in the index.
+def rebuild_index(batch_size=500):
+    with transaction.atomic():
+        SearchEntry.objects.all().delete()
+        for model, (kind, fields, document) in DOCUMENTS.items():
+            entries = []
+            for instance in model.objects.only('id', *fields).iterator(chunk_size=batch_size):
+                title, body = document(instance)
+                entries.append(SearchEntry(kind=kind, object_id=instance.pk, title=title, body=body))
+                if len(entries) >= batch_size:
+                    SearchEntry.objects.bulk_create(entries)
+                    entries = []
+            SearchEntry.objects.bulk_create(entries)
+        if uses_postgres():
+            SearchEntry.objects.update(search_vector=SEARCH_VECTOR)
+    fallback_index.reset()
+    return SearchEntry.objects.count()
+
+# Returns the (rank, kind, object_id) of the entries matching tokens from offset, at most limit of them
+def _ranked_entries(tokens, kinds, offset, limit):
+    if uses_postgres():
+        # Tokens only hold word characters, so they can't break out of the raw tsquery syntax
+        query = SearchQuery(' & '.join(f'{token}:*' for token in tokens), search_type='raw', config=SEARCH_CONFIG)
+        entries = SearchEntry.objects.filter(search_vector=query, kind__in=kinds).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', 'kind', 'object_id')
+        return list(entries.values_list('rank', 'kind', 'object_id')[offset:offset + limit])
+    return fallback_index.search(tokens, kinds)[offset:offset + limit]
+
+# Returns a page of objects matching a query, best matches first, optionally only of some kinds
+# Each result holds the kind of object, the object itself and its rank. Objects are loaded with one
+# query per kind on the page.
+def search(query, kinds=None, page_number=1, page_size=SEARCH_PAGE_SIZE):
+    try:
+        number = max(1, int(page_number))
+    except (TypeError, ValueError):
+        number = 1
+    page = {'query': query, 'results': [], 'number': number, 'has_previous': number > 1, 'has_next': False}
+    tokens = tokenize(query or '')
+    if not tokens:
+        return page
+
+    kinds = [kind for kind in (kinds or KINDS) if kind in MODELS]
+    # One extra entry is fetched to tell whether there is a next page without counting every match
+    entries = _ranked_entries(tokens, kinds, (number - 1) * page_size, page_size + 1)
+    page['has_next'] = len(entries) > page_size
+    entries = entries[:page_size]
+
+    objects = {}
+    for kind in {kind for _, kind, _ in entries}:
+        objects[kind] = MODELS[kind].objects.in_bulk([object_id for _, entry_kind, object_id in entries if entry_kind == kind])
+    for rank, kind, object_id in entries:
+        # Entries of objects deleted without signals (EG. queryset deletes) are left out
+        instance = objects[kind].get(object_id)
+        if instance is not None:
+            page['results'].append({'kind': kind, 'object': instance, 'rank': rank})
+    return page
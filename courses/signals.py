@@ -0,0 +1,151 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from users.models import StudySphereUser
+from . import cache as homepage_cache
+from . import autocomplete, catalog, images, notifications, search
+from .models import Comment, Course, CourseContent, CourseDeadline, NotificationContent, NotificationEnroll, Post
+from .tasks import generate_image_derivatives
+
+# These receivers keep the cached homepage sections in line with the database by dropping
+# exactly the sections (and users) that a write affects.
+
+# Returns the ids of all students enrolled on a course
+def _course_student_ids(course_id):
+    return list(StudySphereUser.objects.filter(enrolled_courses=course_id).values_list('id', flat=True))
+
+# Returns the ids of all students enrolled on the course that a content belongs to
+def _content_student_ids(content_id):
+    return list(StudySphereUser.objects.filter(enrolled_courses__content=content_id).values_list('id', flat=True))
+
+# Enrollments and unenrollments change a student's courses and deadlines
+@receiver(m2m_changed, sender=Course.students.through)
+def enrollment_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # The ids are gone after a clear, so they are stored until post_clear
+        if reverse:
+            instance._cleared_student_ids = [instance.id]
+        else:
+            instance._cleared_student_ids = _course_student_ids(instance.id)
+        return
+    if action == 'post_clear':
+        student_ids = getattr(instance, '_cleared_student_ids', [])
+    elif action in ('post_add', 'post_remove'):
+        # When changed from the user's side the instance is the student and pk_set holds courses
+        student_ids = [instance.id] if reverse else list(pk_set or [])
+    else:
+        return
+    homepage_cache.invalidate(homepage_cache.ENROLLED_COURSES, student_ids)
+    homepage_cache.invalidate(homepage_cache.DEADLINES, student_ids)
+
+# Course names are shown to its teacher, its students and in its students' deadlines
+@receiver(post_save, sender=Course)
+def course_saved(sender, instance, **kwargs):
+    student_ids = _course_student_ids(instance.id)
+    homepage_cache.invalidate(homepage_cache.CREATED_COURSES, [instance.teacher_id])
+    homepage_cache.invalidate(homepage_cache.ENROLLED_COURSES, student_ids)
+    homepage_cache.invalidate(homepage_cache.DEADLINES, student_ids)
+
+# Enrollments are deleted alongside the course, so students are looked up before the delete
+@receiver(pre_delete, sender=Course)
+def course_deleted(sender, instance, **kwargs):
+    course_saved(sender, instance)
+
+# The visitor catalog lists every course
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def catalog_changed(sender, instance, **kwargs):
+    catalog.invalidate()
+
+@receiver(post_save, sender=CourseContent)
+@receiver(post_delete, sender=CourseContent)
+def content_changed(sender, instance, **kwargs):
+    if instance.course_id is not None:
+        homepage_cache.invalidate(homepage_cache.DEADLINES, _course_student_ids(instance.course_id))
+
+@receiver(post_save, sender=CourseDeadline)
+@receiver(post_delete, sender=CourseDeadline)
+def deadline_changed(sender, instance, **kwargs):
+    homepage_cache.invalidate(homepage_cache.DEADLINES, _content_student_ids(instance.content_id))
+
+# The feed shows posts, their authors and their amount of comments
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def feed_changed(sender, instance, **kwargs):
+    homepage_cache.invalidate(homepage_cache.FEED)
+
+# Logging in only updates last_login which is shown on the active student list but not in the feed
+@receiver(post_save, sender=StudySphereUser)
+@receiver(post_delete, sender=StudySphereUser)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    homepage_cache.invalidate(homepage_cache.ACTIVE_STUDENTS)
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        homepage_cache.invalidate(homepage_cache.FEED)
+
+# Image fields that get resized derivatives whenever a new image is uploaded to them
+IMAGE_FIELDS = {
+    StudySphereUser: 'profile_picture',
+    Course: 'banner_image',
+    CourseContent: 'content_image',
+}
+
+# Returns the name of the image stored in a field, or None when it isn't loaded (EG. deferred by only())
+# The raw value is read from __dict__ so that no FieldFile is created for every loaded row
+def _image_name(instance, attname):
+    if attname not in instance.__dict__:
+        return None
+    value = instance.__dict__[attname]
+    return getattr(value, 'name', value) or ''
+
+# Remembers which image a row was loaded with, so that saving it can tell whether a new one was uploaded
+@receiver(post_init, sender=StudySphereUser)
+@receiver(post_init, sender=Course)
+@receiver(post_init, sender=CourseContent)
+def remember_image(sender, instance, **kwargs):
+    instance._loaded_image_name = _image_name(instance, IMAGE_FIELDS[sender])
+
+# Generates the derivatives of a newly uploaded image once the upload has been committed
+@receiver(post_save, sender=StudySphereUser)
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=CourseContent)
+def image_saved(sender, instance, **kwargs):
+    name = _image_name(instance, IMAGE_FIELDS[sender])
+    if name and name != instance._loaded_image_name:
+        images.forget_manifest(name)
+        transaction.on_commit(lambda: generate_image_derivatives.delay(name))
+    instance._loaded_image_name = name
+
+# Keeps the search index up to date with every searchable object
+@receiver(post_save, sender=StudySphereUser)
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=CourseContent)
+def searchable_saved(sender, instance, update_fields=None, **kwargs):
+    search.index_object(instance, update_fields)
+
+@receiver(post_delete, sender=StudySphereUser)
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=CourseContent)
+def searchable_deleted(sender, instance, **kwargs):
+    search.remove_object(instance)
+
+# Cached autocomplete answers hold usernames and thumbnails
+@receiver(post_save, sender=StudySphereUser)
+def autocomplete_user_saved(sender, instance, update_fields=None, **kwargs):
+    autocomplete.user_changed(update_fields)
+
+@receiver(post_delete, sender=StudySphereUser)
+def autocomplete_user_deleted(sender, instance, **kwargs):
+    autocomplete.user_changed()
+
+# A new notification adds to its recipient's unread count and is pushed to them
+@receiver(post_save, sender=NotificationEnroll)
+@receiver(post_save, sender=NotificationContent)
+def notification_created(sender, instance, created, **kwargs):
+    if created:
+        recipient_id = instance.teacher_id if sender is NotificationEnroll else instance.student_id
+        notifications.invalidate_unread_counts([recipient_id])
+        # Pushed to the recipient's open pages once the notification is committed
+        transaction.on_commit(lambda: notifications.push([instance]))
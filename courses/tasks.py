@@ -1,9 +1,140 @@
 from celery import shared_task
-from django.core.mail import send_mail
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.mail import EmailMessage, get_connection
+from itertools import islice
+from PIL import UnidentifiedImageError
+import logging
+import smtplib
+import time
+
+from users.models import StudySphereUser
+from . import images, notifications
+from .models import CourseContent, CourseDeadline, NotificationContent
+
+logger = logging.getLogger(__name__)
+
+# Address that all emails are sent from
+EMAIL_SENDER = 'studysphereauth@gmail.com'
+
+# Amount of rows inserted per bulk_create and recipients per email job when fanning out notifications
+NOTIFICATION_BATCH_SIZE = 500
+
+# Splits an iterator into lists of at most size items
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+# Returns whether an error raised while sending email is likely to go away when retried
+# such as dropped connections or temporary (4xx) SMTP replies
+def is_transient_email_error(error):
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+# Returns whether an error raised while sending to one recipient is a permanent (5xx) refusal of that message,
+# such as an unknown or disabled address, which no retry will get through
+def is_rejected_recipient_error(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+# Sends one message per recipient so that addresses aren't exposed to each other
+# All messages go over a single connection, in batches of batch_size, and no faster than rate_limit messages per second
+# A recipient whose message is permanently refused is logged and skipped, the others are still sent to.
+# on_sent is called with the amount of recipients dealt with (sent to or skipped) so far after each message, so that
+# when sending fails partway through a batch it is known exactly which recipients have already been dealt with.
+# Returns the amount of messages sent.
+def deliver_emails(subject, content, recipient_list, batch_size=None, rate_limit=None, connection=None, on_sent=None):
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    rate_limit = settings.EMAIL_RATE_LIMIT if rate_limit is None else rate_limit
+    connection = connection or get_connection()
+    sent = 0
+    done = 0
+    connection.open()
+    try:
+        for batch in batched(recipient_list, batch_size):
+            started = time.monotonic()
+            for recipient in batch:
+                try:
+                    connection.send_messages([EmailMessage(subject, content, EMAIL_SENDER, [recipient], connection=connection)])
+                    sent += 1
+                except Exception as error:
+                    if not is_rejected_recipient_error(error):
+                        raise
+                    logger.warning('Skipped emailing %s, the message was refused: %r', recipient, error)
+                done += 1
+                if on_sent:
+                    on_sent(done)
+            # Waits out the remainder of the batch's time slot when rate limited
+            if rate_limit:
+                remaining = len(batch) / rate_limit - (time.monotonic() - started)
+                if remaining > 0:
+                    time.sleep(remaining)
+    finally:
+        connection.close()
+    return sent
 
 # This task sends emails to users, varying from Content notifications to enrollment notifications
+# On a transient SMTP error only the recipients that haven't been dealt with yet are retried, with an exponential backoff
 @shared_task(bind=True)
 def send_emails(self, subject ,content, recipient_list):
-    message = content
-    # Sends the email to the recipient list async
-    send_mail(subject, message, 'studysphereauth@gmail.com', recipient_list)
+    progress = {'sent': 0}
+
+    def on_sent(sent):
+        progress['sent'] = sent
+
+    try:
+        return deliver_emails(subject, content, recipient_list, on_sent=on_sent)
+    except Exception as error:
+        if not is_transient_email_error(error):
+            raise
+        countdown = settings.EMAIL_RETRY_BACKOFF * (2 ** self.request.retries)
+        raise self.retry(exc=error, args=(subject, content, recipient_list[progress['sent']:]), countdown=countdown, max_retries=settings.EMAIL_MAX_RETRIES)
+
+# This task notifies every student enrolled on a course that new content has been added
+# Notifications are inserted in batches and students are streamed from the database rather than loaded at once
+@shared_task(bind=True)
+def notify_new_content(self, content_id, batch_size=NOTIFICATION_BATCH_SIZE):
+    content = CourseContent.objects.select_related('course').get(id=content_id)
+    students = StudySphereUser.objects.filter(enrolled_courses=content.course_id).order_by('id')
+
+    # Creates a notification for every student
+    created = 0
+    for student_ids in batched(students.values_list('id', flat=True).iterator(chunk_size=batch_size), batch_size):
+        created_notifications = NotificationContent.objects.bulk_create([NotificationContent(student_id=student_id, course_content=content) for student_id in student_ids], batch_size=batch_size)
+        # bulk_create doesn't send post_save, so the unread counts are dropped and the notifications pushed here
+        notifications.invalidate_unread_counts(student_ids)
+        notifications.push(created_notifications)
+        created += len(student_ids)
+
+    # Sends the email out in batches of recipients via the email task
+    deadline = CourseDeadline.objects.filter(content=content).order_by('deadline').first()
+    message = f'New content added on course {content.course.name} \nContent: {content.title},\nDescription: {content.content_text}\nDeadline:{deadline.deadline if deadline else None}'
+    for recipients in batched(students.values_list('email', flat=True).iterator(chunk_size=batch_size), batch_size):
+        send_emails.delay('New course content added!', message, recipients)
+
+    return {'content_id': content_id, 'notifications': created}
+
+# This task generates the resized WebP and JPEG derivatives of an uploaded image
+# Missing files (EG. replaced again before the task ran) and files that aren't images are skipped
+@shared_task
+def generate_image_derivatives(name):
+    if not default_storage.exists(name):
+        return None
+    try:
+        return images.generate_derivatives(name)
+    except UnidentifiedImageError:
+        return None
+
+# This periodic task deletes old notifications so that the notification tables don't grow without bound
+# Scheduled by CELERY_BEAT_SCHEDULE
+@shared_task
+def prune_notifications():
+    return notifications.prune()
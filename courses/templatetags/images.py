@@ -0,0 +1,53 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from .. import images
+
+register = template.Library()
+
+# Returns the srcset of an image field's derivatives in a format ("webp" or "jpeg")
+# EG. <img src="{{ course.banner_image.url }}" srcset="{{ course.banner_image|srcset:'jpeg' }}" sizes="300px">
+@register.filter
+def srcset(field_file, image_format='jpeg'):
+    if not field_file:
+        return ''
+    return images.get_srcset(field_file.name, image_format)
+
+# Where image_manifests keeps the manifests it looked up for the template being rendered
+MANIFESTS = 'image_manifests'
+
+# Returns the name of the image at path (EG. "object.profile_picture") on an object or dict, None when there isn't one
+def _image_name(obj, path):
+    for attribute in path.split('.'):
+        obj = obj.get(attribute) if isinstance(obj, dict) else getattr(obj, attribute, None)
+    return getattr(obj, 'name', None) or None
+
+# Looks up the manifests of an image field of every object in a single cache round trip, for the
+# responsive_image tags further down the template, so that a page of N images doesn't make N lookups
+# EG. {% image_manifests courses "banner_image" %} before looping over the courses
+@register.simple_tag(takes_context=True)
+def image_manifests(context, objects, path):
+    names = [name for name in (_image_name(obj, path) for obj in objects) if name]
+    context.render_context.setdefault(MANIFESTS, {}).update(images.get_manifests(names))
+    return ''
+
+# Renders an image field as a <picture> offering its WebP derivatives with the JPEG ones as the fallback
+# sizes tells the browser how wide the image is displayed so that it downloads the smallest derivative that fits
+# Any other keyword arguments become attributes of the <img>, EG. {% responsive_image user.profile_picture sizes="10vw" class="profile_picture" %}
+# Manifests already looked up by image_manifests are used, others are looked up one image at a time
+# Images without derivatives yet are rendered as a plain <img> of the original
+@register.simple_tag(takes_context=True)
+def responsive_image(context, field_file, sizes='100vw', **attributes):
+    if not field_file:
+        return ''
+    attributes = format_html_join('', ' {}="{}"', attributes.items())
+    srcsets = images.get_srcsets(field_file.name, context.render_context.get(MANIFESTS, {}).get(field_file.name))
+    webp = srcsets.get('webp', '')
+    jpeg = srcsets.get('jpeg', '')
+    if not webp and not jpeg:
+        return format_html('<img src="{}"{}>', field_file.url, attributes)
+    source = format_html('<source type="image/webp" srcset="{}" sizes="{}">', webp, sizes) if webp else ''
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        source, field_file.url, jpeg, sizes, attributes,
+    )
@@ -1,12 +1,16 @@
+import csv
 import datetime
+import os
+import importlib
+from django.apps import apps as django_apps
 from users.models import StudySphereUser
 
-from django.test import Client, TestCase, RequestFactory
+from django.test import Client, TestCase, RequestFactory, override_settings
 from django.http import HttpRequest, HttpResponseNotFound
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from .views import view_all_courses
-from .models import Course, NotificationEnroll
+from .models import Course, EnrollmentRemoval, NotificationContent, NotificationEnroll, SearchEntry
 from unittest.mock import patch
 from django.urls import reverse
 from .views import *
@@ -15,6 +19,27 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.messages.storage.fallback import FallbackStorage
 
 from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from io import BytesIO, StringIO
+import shutil
+import smtplib
+import tempfile
+from .tasks import deliver_emails, prune_notifications
+from .routing import websocket_urlpatterns
+from .roster import get_roster_page, import_roster, read_roster, remove_students
+from core_study.keyset import encode_cursor
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from . import autocomplete, catalog, images, notifications, search
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.core.files.storage import default_storage
+from django.template import Context, Template
+from PIL import Image
 
 # This tests the function that is meant to allow the user to view all courses
 class TestViewAllCourses(TestCase):
@@ -35,17 +60,14 @@ class TestViewAllCourses(TestCase):
         # Makes sure that it returns an empty data object
         self.assertQuerysetEqual(courses, Course.objects.none(), transform=lambda x: x)
 
-    @patch('courses.views.Course.objects.all')
-    @patch('courses.views.user_subscribed_courses')
+    @patch('courses.views.get_catalog_page')
     @patch('courses.views.render')
-    def test_mode_not_data(self, mock_render, mock_user_subscribed_courses, mock_courses_all):
-        # Mock user_subscribed_courses to return an empty queryset
-        mock_user_subscribed_courses.return_value = Course.objects.none()
-
-        # Mock Course.objects.all() to return an empty queryset
-        mock_courses_all.return_value = Course.objects.none()
+    def test_mode_not_data(self, mock_render, mock_get_catalog_page):
+        # Mock the catalog to return an empty page
+        mock_get_catalog_page.return_value = {'courses': [], 'number': 1, 'num_pages': 1, 'has_previous': False, 'has_next': False}
 
         # Call the view_all_courses function with mode not equal to "DATA"
+        self.request.user = self.user
         view_all_courses(self.request, mode="")
 
         # Check that the correct responses are sent
@@ -597,4 +619,1012 @@ class ViewSubmissionViewTest(TestCase):
     # Ensures that unauthenticated users can't access user submissions
     def test_unauthenticated_user_accessing_submission(self):
         response = self.client.get(reverse('submission', args=[self.submission.id]))
-        self.assertEqual(response.status_code, 302)  
\ No newline at end of file
+        self.assertEqual(response.status_code, 302)  
+# Tests the upcoming deadline timeline shown on the student homepage
+class UpcomingDeadlinesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.teacher_user = StudySphereUser.objects.create_user(username='teacher', email='teacher@example.com', password='password', auth_level='teacher')
+        self.student_user = StudySphereUser.objects.create_user(username='student', email='student@example.com', password='password', auth_level='student')
+        self.course = Course.objects.create(name='Test Course', teacher=self.teacher_user)
+        self.other_course = Course.objects.create(name='Other Course', teacher=self.teacher_user)
+        self.course.students.add(self.student_user)
+        now = timezone.now()
+        # Content on the enrolled course due later, sooner, in the past and outside of the window
+        self.later = CourseDeadline.objects.create(content=CourseContent.objects.create(course=self.course, title='Later'), deadline=now + datetime.timedelta(days=5))
+        self.sooner = CourseDeadline.objects.create(content=CourseContent.objects.create(course=self.course, title='Sooner'), deadline=now + datetime.timedelta(days=1))
+        CourseDeadline.objects.create(content=CourseContent.objects.create(course=self.course, title='Past'), deadline=now - datetime.timedelta(days=1))
+        CourseDeadline.objects.create(content=CourseContent.objects.create(course=self.course, title='Far'), deadline=now + datetime.timedelta(days=365))
+        # Content without a deadline and content on a course the student isn't enrolled in
+        CourseContent.objects.create(course=self.course, title='No Deadline')
+        CourseDeadline.objects.create(content=CourseContent.objects.create(course=self.other_course, title='Other'), deadline=now + datetime.timedelta(days=2))
+
+    def get_request(self):
+        request = self.factory.get(reverse('homepage'))
+        request.user = self.student_user
+        return request
+
+    # Ensures that only upcoming deadlines within the window on enrolled courses are returned in order
+    def test_upcoming_deadlines_ordered_and_windowed(self):
+        deadlines = list(get_upcoming_deadlines(self.get_request()))
+        self.assertEqual(deadlines, [self.sooner, self.later])
+
+    # Ensures that the limit caps the amount of deadlines returned
+    def test_upcoming_deadlines_limit(self):
+        deadlines = list(get_upcoming_deadlines(self.get_request(), days=None, limit=1))
+        self.assertEqual(deadlines, [self.sooner])
+
+    # Ensures that deadlines, their content and the course are all fetched in a single query
+    def test_upcoming_deadlines_single_query(self):
+        with self.assertNumQueries(1):
+            titles = [(deadline.content.title, deadline.content.course.name) for deadline in get_upcoming_deadlines(self.get_request())]
+        self.assertEqual(titles, [('Sooner', 'Test Course'), ('Later', 'Test Course')])
+
+    # Ensures that the homepage renders even when content has no deadline
+    def test_homepage_renders_deadlines(self):
+        self.client.force_login(self.student_user)
+        response = self.client.get(reverse('homepage'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Sooner')
+        self.assertNotContains(response, 'Past')
+
+# Tests the cursor paginated status feed
+class StatusFeedTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = StudySphereUser.objects.create_user(username='testuser', password='testpassword', email='tester1@test.com')
+        self.other_user = StudySphereUser.objects.create_user(username='otheruser', password='testpassword', email='tester2@test.com')
+        self.posts = [Post.objects.create(user=self.user, text=f'Post {i}') for i in range(5)]
+        # Two posts share the same timestamp to ensure the id breaks ties
+        Post.objects.filter(pk__in=[self.posts[1].pk, self.posts[2].pk]).update(created_at=self.posts[1].created_at)
+        Comment.objects.create(user=self.other_user, post=self.posts[4], text='First')
+        Comment.objects.create(user=self.other_user, post=self.posts[4], text='Second')
+
+    # Ensures that walking every page returns each post exactly once, newest first
+    def test_feed_pages_cover_all_posts_in_order(self):
+        seen = []
+        posts, cursor = get_feed_page(page_size=2)
+        seen.extend(posts)
+        while cursor:
+            posts, cursor = get_feed_page(cursor, page_size=2)
+            seen.extend(posts)
+        expected = sorted(Post.objects.all(), key=lambda post: (post.created_at, post.id), reverse=True)
+        self.assertEqual([post.id for post in seen], [post.id for post in expected])
+
+    # Ensures that a page and its authors are loaded in one query and its comment counts in a second
+    def test_feed_page_queries(self):
+        with self.assertNumQueries(2):
+            posts, cursor = get_feed_page(page_size=5)
+            authors = [post.user.username for post in posts]
+        self.assertIsNone(cursor)
+        self.assertEqual(authors, ['testuser'] * 5)
+        self.assertEqual(posts[0].comment_count, 2)
+        self.assertEqual(posts[1].comment_count, 0)
+
+    # Ensures that the posts of a page are read without grouping the posts and comments tables
+    def test_feed_page_not_grouped(self):
+        with CaptureQueriesContext(connection) as queries:
+            get_feed_page(page_size=2)
+        post_query = next(query['sql'] for query in queries.captured_queries if 'FROM "courses_post"' in query['sql'])
+        self.assertNotIn('GROUP BY', post_query)
+        self.assertNotIn('courses_comment', post_query)
+
+    # Tests the JSON endpoint including the next cursor being returned
+    def test_feed_endpoint(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('status_updates'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['posts']), 5)
+        self.assertEqual(data['posts'][0]['text'], 'Post 4')
+        self.assertEqual(data['posts'][0]['comment_count'], 2)
+        self.assertIsNone(data['next_cursor'])
+
+    # Ensures that malformed cursors are rejected
+    def test_feed_endpoint_invalid_cursor(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('status_updates'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+# Tests the per section homepage cache and its invalidation
+class HomepageCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        homepage_cache.stats_counter.clear()
+        self.client = Client()
+        self.teacher_user = StudySphereUser.objects.create_user(username='teacher', email='teacher@example.com', password='password', auth_level='teacher')
+        self.student_user = StudySphereUser.objects.create_user(username='student', email='student@example.com', password='password', auth_level='student')
+        self.course = Course.objects.create(name='Test Course', teacher=self.teacher_user)
+        self.client.force_login(self.student_user)
+
+    # Ensures that a repeated homepage request is served from the cache without querying the sections again
+    def test_homepage_sections_cached(self):
+        self.client.get(reverse('homepage'))
+        stats = homepage_cache.get_stats()
+        self.assertEqual(stats[homepage_cache.FEED]['misses'], 1)
+        with self.assertNumQueries(2): # Session and user lookups only
+            response = self.client.get(reverse('homepage'))
+        self.assertEqual(response.status_code, 200)
+        stats = homepage_cache.get_stats()
+        self.assertEqual(stats[homepage_cache.FEED]['hits'], 1)
+        self.assertEqual(stats[homepage_cache.DEADLINES]['hits'], 1)
+
+    # Ensures that hits and misses are counted in the process and only added to the shared counters when flushed
+    @override_settings(HOMEPAGE_CACHE_STATS_FLUSH_INTERVAL=3600)
+    def test_stats_counted_in_process(self):
+        with patch('courses.cache.cache.incr', wraps=cache.incr) as incr:
+            for _ in range(3):
+                homepage_cache.get_section(homepage_cache.FEED, None, list)
+            incr.assert_not_called()
+            stats = homepage_cache.get_stats()
+        self.assertEqual((stats[homepage_cache.FEED]['hits'], stats[homepage_cache.FEED]['misses']), (2, 1))
+        self.assertEqual(incr.call_count, 2)
+
+    # Ensures that enrolling invalidates the student's courses and deadlines
+    def test_enrollment_invalidates_sections(self):
+        self.client.get(reverse('homepage'))
+        self.course.students.add(self.student_user)
+        CourseDeadline.objects.create(content=CourseContent.objects.create(course=self.course, title='Essay'), deadline=timezone.now() + datetime.timedelta(days=1))
+        response = self.client.get(reverse('homepage'))
+        self.assertEqual(list(response.context['enrolled_courses']), [self.course])
+        self.assertEqual([deadline.content.title for deadline in response.context['deadlines']], ['Essay'])
+        # Unenrolling from the student's side also invalidates them
+        self.student_user.enrolled_courses.remove(self.course)
+        response = self.client.get(reverse('homepage'))
+        self.assertEqual(list(response.context['enrolled_courses']), [])
+        self.assertEqual(list(response.context['deadlines']), [])
+
+    # Ensures that new posts and comments invalidate the shared feed
+    def test_post_invalidates_feed(self):
+        self.client.get(reverse('homepage'))
+        post = Post.objects.create(user=self.teacher_user, text='Welcome!')
+        response = self.client.get(reverse('homepage'))
+        self.assertContains(response, 'Welcome!')
+        Comment.objects.create(user=self.student_user, post=post, text='Thanks')
+        response = self.client.get(reverse('homepage'))
+        self.assertEqual(response.context['posts'][0].comment_count, 1)
+
+    # Ensures that the stats command prints the counters
+    def test_cache_stats_command(self):
+        self.client.get(reverse('homepage'))
+        out = StringIO()
+        call_command('homepage_cache_stats', stdout=out)
+        self.assertIn('feed: 0 hits, 1 misses', out.getvalue())
+
+# Tests the background fan-out of new content notifications
+class NotifyNewContentTaskTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.teacher_user = StudySphereUser.objects.create_user(username='teacher', email='teacher@example.com', password='password', auth_level='teacher')
+        self.course = Course.objects.create(name='Test Course', teacher=self.teacher_user)
+        self.students = [StudySphereUser.objects.create_user(username=f'student{i}', email=f'student{i}@example.com', password='password') for i in range(5)]
+        self.course.students.add(*self.students)
+        self.content = CourseContent.objects.create(course=self.course, title='Essay')
+
+    # Ensures that every student is notified and that emails are sent out in batches
+    @patch('courses.tasks.send_emails.delay')
+    def test_notify_new_content_batches(self, mock_send_emails):
+        result = notify_new_content.apply(args=[self.content.id], kwargs={'batch_size': 2}).get()
+        self.assertEqual(result['notifications'], 5)
+        self.assertEqual(NotificationContent.objects.filter(course_content=self.content).count(), 5)
+        recipients = [call.args[2] for call in mock_send_emails.call_args_list]
+        self.assertEqual([len(batch) for batch in recipients], [2, 2, 1])
+        self.assertEqual(sorted(sum(recipients, [])), sorted(student.email for student in self.students))
+
+    # Ensures that the view hands the fan-out to the task once committed and returns straight away
+    @patch('courses.views.notify_new_content.apply_async')
+    def test_add_content_enqueues_fan_out(self, mock_apply_async):
+        self.client.force_login(self.teacher_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('add_course_content', args=[self.course.id]), {'title': 'Reading', 'deadline': '2024-03-31'})
+        self.assertEqual(response.status_code, 302)
+        content = CourseContent.objects.get(title='Reading')
+        task_id = self.client.session['notification_task_id']
+        mock_apply_async.assert_called_once_with(args=[content.id], task_id=task_id)
+        # No notifications are created within the request itself
+        self.assertFalse(NotificationContent.objects.exists())
+
+    # Tests the endpoint that the homepage polls for the state of the task
+    @patch('courses.views.AsyncResult')
+    def test_task_status(self, mock_async_result):
+        mock_async_result.return_value.state = 'SUCCESS'
+        mock_async_result.return_value.ready.return_value = True
+        mock_async_result.return_value.successful.return_value = True
+        mock_async_result.return_value.result = {'content_id': self.content.id, 'notifications': 5}
+        self.client.force_login(self.teacher_user)
+        session = self.client.session
+        session['started_task_ids'] = ['some-task-id']
+        session.save()
+        response = self.client.get(reverse('task_status', args=['some-task-id']))
+        self.assertEqual(response.json(), {'task_id': 'some-task-id', 'state': 'SUCCESS', 'ready': True, 'result': {'content_id': self.content.id, 'notifications': 5}})
+
+    # Tests that only the tasks started by the session can be polled
+    @patch('courses.views.AsyncResult')
+    @patch('courses.views.notify_new_content.apply_async')
+    def test_task_status_of_other_sessions(self, mock_apply_async, mock_async_result):
+        mock_async_result.return_value.state = 'PENDING'
+        mock_async_result.return_value.ready.return_value = False
+        mock_async_result.return_value.successful.return_value = False
+        self.client.force_login(self.teacher_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add_course_content', args=[self.course.id]), {'title': 'Reading', 'deadline': '2024-03-31'})
+        task_id = self.client.session['notification_task_id']
+        self.assertEqual(self.client.get(reverse('task_status', args=[task_id])).status_code, 200)
+        other = Client()
+        other.force_login(self.teacher_user)
+        self.assertEqual(other.get(reverse('task_status', args=[task_id])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('task_status', args=['some-task-id'])).status_code, 404)
+
+# Tests the batched delivery of emails
+class SendEmailsTaskTestCase(TestCase):
+    def setUp(self):
+        self.recipients = [f'student{i}@example.com' for i in range(5)]
+
+    # Ensures that every recipient gets their own message without seeing the others
+    @override_settings(EMAIL_BATCH_SIZE=2)
+    def test_one_message_per_recipient(self):
+        sent = send_emails.apply(args=['Subject', 'Body', self.recipients]).get()
+        self.assertEqual(sent, 5)
+        self.assertEqual([message.to for message in mail.outbox], [[recipient] for recipient in self.recipients])
+
+    # Ensures that a single connection is opened for all batches
+    def test_single_connection(self):
+        connection = mail.get_connection()
+        with patch.object(connection, 'open', wraps=connection.open) as mock_open:
+            sent = deliver_emails('Subject', 'Body', self.recipients, batch_size=2, connection=connection)
+        self.assertEqual(sent, 5)
+        mock_open.assert_called_once()
+
+    # Ensures that after a transient error only the recipients that weren't sent to are retried
+    @override_settings(EMAIL_BATCH_SIZE=2)
+    def test_transient_error_retries_remaining_recipients(self):
+        def deliver(subject, content, recipient_list, on_sent=None):
+            on_sent(2)
+            raise smtplib.SMTPServerDisconnected('Connection lost')
+        with patch('courses.tasks.deliver_emails', side_effect=deliver), patch.object(send_emails, 'retry', side_effect=Exception('retry')) as mock_retry:
+            with self.assertRaises(Exception):
+                send_emails.run('Subject', 'Body', self.recipients)
+        self.assertEqual(mock_retry.call_args.kwargs['args'], ('Subject', 'Body', self.recipients[2:]))
+
+    # Ensures that when sending fails partway through a batch, the recipients of that batch already sent to aren't retried
+    @override_settings(EMAIL_BATCH_SIZE=4)
+    def test_failure_within_batch_retries_from_failed_message(self):
+        connection = mail.get_connection()
+        send_messages = connection.send_messages
+
+        def fail_third(messages):
+            if messages[0].to == [self.recipients[2]]:
+                raise smtplib.SMTPServerDisconnected('Connection lost')
+            return send_messages(messages)
+        with patch('courses.tasks.get_connection', return_value=connection), patch.object(connection, 'send_messages', side_effect=fail_third):
+            with patch.object(send_emails, 'retry', side_effect=Exception('retry')) as mock_retry, self.assertRaises(Exception):
+                send_emails.run('Subject', 'Body', self.recipients)
+        self.assertEqual([message.to for message in mail.outbox], [[recipient] for recipient in self.recipients[:2]])
+        self.assertEqual(mock_retry.call_args.kwargs['args'], ('Subject', 'Body', self.recipients[2:]))
+
+    # Ensures that recipients whose messages are refused are skipped and the later recipients still get their email
+    @override_settings(EMAIL_BATCH_SIZE=2)
+    def test_refused_recipients_skipped(self):
+        connection = mail.get_connection()
+        send_messages = connection.send_messages
+
+        def refuse(messages):
+            if messages[0].to == [self.recipients[1]]:
+                raise smtplib.SMTPRecipientsRefused({self.recipients[1]: (550, b'No such user')})
+            if messages[0].to == [self.recipients[3]]:
+                raise smtplib.SMTPDataError(554, b'Message rejected')
+            return send_messages(messages)
+        with patch('courses.tasks.get_connection', return_value=connection), patch.object(connection, 'send_messages', side_effect=refuse):
+            with patch.object(send_emails, 'retry') as mock_retry, self.assertLogs('courses.tasks', 'WARNING') as logs:
+                sent = send_emails.run('Subject', 'Body', self.recipients)
+        self.assertEqual(sent, 3)
+        self.assertEqual([message.to for message in mail.outbox], [[self.recipients[0]], [self.recipients[2]], [self.recipients[4]]])
+        self.assertEqual(len(logs.output), 2)
+        mock_retry.assert_not_called()
+
+    # Ensures that permanent errors aren't retried
+    def test_permanent_error_not_retried(self):
+        with patch('courses.tasks.deliver_emails', side_effect=smtplib.SMTPRecipientsRefused({})), patch.object(send_emails, 'retry') as mock_retry:
+            with self.assertRaises(smtplib.SMTPRecipientsRefused):
+                send_emails.run('Subject', 'Body', self.recipients)
+        mock_retry.assert_not_called()
+
+# Tests the PDF downloads including conditional and range requests
+class DownloadPdfTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.pdf_bytes = b'%PDF-1.4 ' + bytes(range(256)) * 4
+        self.content = CourseContent.objects.create(title='Lecture', pdf_files=SimpleUploadedFile('lecture.pdf', self.pdf_bytes, content_type='application/pdf'))
+        self.url = reverse('download_pdf', args=[self.content.id])
+
+    # Tests that the whole file is returned along with its validators
+    def test_full_download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.pdf_bytes)
+        self.assertEqual(response['Content-Length'], str(len(self.pdf_bytes)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="lecture.pdf"')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+    # Tests that a repeated download with a matching ETag or date gets a 304
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        for headers in ({'HTTP_IF_NONE_MATCH': response['ETag']}, {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}):
+            not_modified = self.client.get(self.url, **headers)
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual((not_modified['ETag'], not_modified['Last-Modified']), (response['ETag'], response['Last-Modified']))
+
+    # Tests that byte ranges return a 206 with only the requested bytes
+    def test_range_request(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.pdf_bytes[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.pdf_bytes)}')
+        self.assertEqual(response['Content-Length'], '10')
+        # Suffix ranges return the end of the file
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.pdf_bytes[-5:])
+
+    # Tests that unsatisfiable ranges get a 416 and outdated If-Range headers get the whole file
+    def test_invalid_and_outdated_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.pdf_bytes)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.pdf_bytes)}')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(response.status_code, 200)
+
+    # Tests that the bytes are left to the web server when offloading
+    def test_offload(self):
+        with override_settings(FILE_DOWNLOAD_OFFLOAD='accel'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.content.pdf_files.name)
+        self.assertEqual(response.content, b'')
+        with override_settings(FILE_DOWNLOAD_OFFLOAD='sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], self.content.pdf_files.path)
+
+    # Tests that the path the web server is redirected to is percent-encoded
+    @override_settings(FILE_DOWNLOAD_OFFLOAD='accel')
+    def test_offload_quotes_path(self):
+        content = CourseContent.objects.create(title='Lecture', pdf_files=SimpleUploadedFile('lécture.pdf', self.pdf_bytes, content_type='application/pdf'))
+        response = self.client.get(reverse('download_pdf', args=[content.id]))
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + content.pdf_files.name.replace('é', '%C3%A9'))
+        self.assertIn('%C3%A9', response['X-Accel-Redirect'])
+
+    # Tests that submissions are served through the same helper
+    def test_submission_download(self):
+        student = StudySphereUser.objects.create_user(username='student', password='password', email='student@test.com')
+        submission = Submission.objects.create(student=student, content=self.content, pdf_files=SimpleUploadedFile('work.pdf', b'%PDF-1.4 work'))
+        response = self.client.get(reverse('download_pdf_submission', args=[submission.id]), HTTP_RANGE='bytes=0-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF')
+
+# Tests the resized image derivatives and the template helpers that offer them
+class ImageDerivativesTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root, IMAGE_DERIVATIVE_WIDTHS=[160, 320, 640])
+        media.enable()
+        self.addCleanup(media.disable)
+        cache.clear()
+        self.teacher = StudySphereUser.objects.create(username='teacher', email='teacher@example.com', auth_level='teacher')
+
+    def upload(self, name, size, mode='RGB'):
+        output = BytesIO()
+        Image.new(mode, size).save(output, format='PNG')
+        return SimpleUploadedFile(name, output.getvalue(), content_type='image/png')
+
+    # Tests that derivatives are generated in both formats, at every width below the original's
+    def test_generate_derivatives(self):
+        course = Course.objects.create(name='Maths', teacher=self.teacher, banner_image=self.upload('banner.png', (500, 250), 'RGBA'))
+        manifest = images.generate_derivatives(course.banner_image.name)
+        self.assertEqual(manifest, {'webp': [160, 320], 'jpeg': [160, 320]})
+        for width in [160, 320]:
+            with default_storage.open(images.derivative_name(course.banner_image.name, width, 'webp')) as file:
+                image = Image.open(file)
+                self.assertEqual((image.format, image.size), ('WEBP', (width, width // 2)))
+            with default_storage.open(images.derivative_name(course.banner_image.name, width, 'jpeg')) as file:
+                self.assertEqual(Image.open(file).format, 'JPEG')
+        self.assertFalse(default_storage.exists(images.derivative_name(course.banner_image.name, 640, 'webp')))
+
+    # Tests that uploading a new image queues its derivatives once the transaction commits, and other saves don't
+    def test_upload_queues_derivatives(self):
+        with patch('courses.signals.generate_image_derivatives.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                course = Course.objects.create(name='Maths', teacher=self.teacher, banner_image=self.upload('banner.png', (500, 250)))
+            delay.assert_called_once_with(course.banner_image.name)
+            delay.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                course.name = 'Further Maths'
+                course.save()
+                Course.objects.get(id=course.id).save()
+            delay.assert_not_called()
+
+    # Tests that the responsive_image tag offers the derivatives, and falls back to the original without them
+    def test_responsive_image_tag(self):
+        user = StudySphereUser.objects.create(username='student', email='student@example.com', profile_picture=self.upload('me.png', (400, 400)))
+        template = Template('{% load images %}{% responsive_image user.profile_picture sizes="10vw" class="profile_picture" %}')
+        rendered = template.render(Context({'user': user}))
+        self.assertEqual(rendered, f'<img src="{user.profile_picture.url}" class="profile_picture">')
+
+        images.generate_derivatives(user.profile_picture.name)
+        rendered = template.render(Context({'user': user}))
+        webp = images.derivative_name(user.profile_picture.url, 160, 'webp')
+        jpeg = images.derivative_name(user.profile_picture.url, 320, 'jpeg')
+        self.assertIn(f'<source type="image/webp" srcset="{webp} 160w, ', rendered)
+        self.assertIn(f'{jpeg} 320w" sizes="10vw" class="profile_picture"></picture>', rendered)
+
+    # Tests that a page's manifests are looked up in one cache round trip and that missing ones are found in the storage once
+    def test_manifests_batched(self):
+        users = [StudySphereUser.objects.create(username=f'student{i}', email=f'student{i}@example.com', profile_picture=self.upload(f'me{i}.png', (400, 400))) for i in range(3)]
+        images.generate_derivatives(users[0].profile_picture.name)
+        images.generate_derivatives(users[1].profile_picture.name)
+        images.forget_manifest(users[1].profile_picture.name)
+        template = Template('{% load images %}{% image_manifests users "profile_picture" %}{% for user in users %}{% responsive_image user.profile_picture %}{% endfor %}')
+        with patch('courses.images.cache.get_many', wraps=cache.get_many) as get_many, patch('courses.images.get_manifest') as get_manifest, patch.object(default_storage, 'exists', wraps=default_storage.exists) as exists:
+            rendered = template.render(Context({'users': users}))
+        get_many.assert_called_once()
+        get_manifest.assert_not_called()
+        # The lost manifest and that of the image without derivatives are each looked for once in the storage
+        probed = {os.path.basename(call.args[0]).split('.')[0] for call in exists.call_args_list}
+        self.assertEqual(probed, {'me1', 'me2'})
+        self.assertEqual(rendered.count('<picture>'), 2)
+        self.assertEqual(images.get_manifest(users[1].profile_picture.name), {'webp': [160, 320], 'jpeg': [160, 320]})
+
+        # Both are cached again, so the next render doesn't touch the storage
+        with patch.object(default_storage, 'exists') as exists:
+            self.assertEqual(template.render(Context({'users': users})), rendered)
+        exists.assert_not_called()
+
+        # Manifests lost from the cache are also found again by the management command
+        images.forget_manifest(users[1].profile_picture.name)
+        call_command('generate_image_derivatives', '--manifests-only', stdout=StringIO())
+        self.assertEqual(cache.get(f'images:derivatives:{users[1].profile_picture.name}'), {'webp': [160, 320], 'jpeg': [160, 320]})
+
+# Tests the paginated course catalog and the cached copy shown to visitors
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = StudySphereUser.objects.create(username='teacher', email='teacher@example.com', auth_level='teacher')
+        self.student = StudySphereUser.objects.create(username='student', email='student@example.com')
+        self.courses = [Course.objects.create(name=f'Course {i}', description='x' * 500, teacher=self.teacher) for i in range(5)]
+        self.courses[1].students.add(self.student)
+
+    # Tests that enrolled courses are left out in the same statement, with the description cut short
+    def test_user_catalog(self):
+        with CaptureQueriesContext(connection) as queries:
+            page = catalog.get_catalog_page(1, user=self.student, page_size=3)
+        self.assertEqual([course.name for course in page['courses']], ['Course 0', 'Course 2', 'Course 3'])
+        self.assertEqual((page['number'], page['num_pages'], page['has_next']), (1, 2, True))
+        self.assertEqual(len(page['courses'][0].summary), catalog.CATALOG_DESCRIPTION_LENGTH)
+        self.assertIn('description', page['courses'][0].get_deferred_fields())
+        # One count and one select, each excluding the enrollments with NOT EXISTS
+        self.assertEqual(len(queries), 2)
+        self.assertIn('NOT EXISTS', queries[1]['sql'])
+
+    # Tests that the visitor catalog is served from the cache until a course is saved or deleted
+    def test_anonymous_catalog_cache(self):
+        self.assertEqual(len(catalog.get_catalog_page()['courses']), 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(catalog.get_catalog_page('1')['courses']), 5)
+        Course.objects.create(name='Course 5', description='New', teacher=self.teacher)
+        self.assertEqual(len(catalog.get_catalog_page()['courses']), 6)
+        self.courses[0].delete()
+        self.assertEqual(len(catalog.get_catalog_page()['courses']), 5)
+
+    # Tests that the landing page and course list are paginated
+    def test_catalog_pages(self):
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Course 4')
+        self.client.force_login(self.student)
+        response = self.client.get(reverse('courses'), {'page': 'invalid'})
+        self.assertEqual([course.name for course in response.context['courses']], ['Course 0', 'Course 2', 'Course 3', 'Course 4'])
+
+# Tests the full-text search index over courses, content and users
+class SearchTestCase(TestCase):
+    def setUp(self):
+        self.teacher = StudySphereUser.objects.create(username='mrsmith', email='smith@example.com', first_name='John', last_name='Smith', auth_level='teacher')
+        self.maths = Course.objects.create(name='Mathematics', description='Algebra and geometry', teacher=self.teacher)
+        self.physics = Course.objects.create(name='Physics', description='Mechanics with some mathematics', teacher=self.teacher)
+        self.content = CourseContent.objects.create(course=self.maths, title='Linear algebra', content_text='Matrices and vectors')
+
+    def names(self, page):
+        return [(result['kind'], str(result['object'])) for result in page['results']]
+
+    # Tests that matches are ranked with title matches first and that words match as prefixes
+    def test_ranked_prefix_search(self):
+        page = search.search('math')
+        self.assertEqual(self.names(page), [('course', 'Mathematics'), ('course', 'Physics')])
+        self.assertEqual(self.names(search.search('algebra')), [('content', 'Linear algebra'), ('course', 'Mathematics')])
+        self.assertEqual(self.names(search.search('john smi', kinds=[search.USER])), [('user', 'mrsmith')])
+        self.assertEqual(search.search('algebra chemistry')['results'], [])
+
+    # Tests that saving, deleting and logging in keep the index up to date
+    def test_incremental_updates(self):
+        self.assertEqual(self.names(search.search('chemistry')), [])
+        self.physics.name = 'Chemistry'
+        self.physics.save()
+        self.assertEqual(self.names(search.search('chemistry')), [('course', 'Chemistry')])
+        self.maths.delete()
+        self.assertEqual(self.names(search.search('algebra')), [])
+        with self.assertNumQueries(1):
+            self.teacher.save(update_fields=['last_login'])
+
+    # Tests that results are paginated, and that the index is rebuilt when changed outside of signals
+    def test_pagination_and_rebuild(self):
+        for i in range(5):
+            Course.objects.create(name=f'Biology {i}', description='Cells', teacher=self.teacher)
+        first = search.search('biology', page_size=3)
+        second = search.search('biology', page_number=2, page_size=3)
+        self.assertEqual((len(first['results']), first['has_next'], len(second['results']), second['has_next']), (3, True, 2, False))
+        SearchEntry.objects.filter(kind=search.COURSE).delete()
+        self.assertEqual(search.search('biology')['results'], [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(search.search('biology')['results']), 5)
+
+    # Tests that a rebuild inserts the entries a batch at a time as the objects are read
+    def test_rebuild_batched(self):
+        for i in range(4):
+            Course.objects.create(name=f'Biology {i}', description='Cells', teacher=self.teacher)
+        with patch.object(SearchEntry.objects, 'bulk_create', wraps=SearchEntry.objects.bulk_create) as bulk_create:
+            entries = search.rebuild_index(batch_size=2)
+        self.assertEqual(entries, Course.objects.count() + CourseContent.objects.count() + StudySphereUser.objects.count())
+        self.assertLessEqual(max(len(call.args[0]) for call in bulk_create.call_args_list), 2)
+        self.assertEqual(len(search.search('biology')['results']), 4)
+
+    # Tests that the migration adding the index backfills the objects created before it, keeping existing entries
+    def test_migration_backfills_index(self):
+        backfill = importlib.import_module('courses.migrations.0008_backfill_search_entries').backfill_search_entries
+        SearchEntry.objects.exclude(kind=search.COURSE, object_id=self.maths.id).delete()
+        SearchEntry.objects.filter(kind=search.COURSE).update(title='Kept')
+        backfill(django_apps, connection.schema_editor())
+        self.assertEqual(SearchEntry.objects.count(), Course.objects.count() + CourseContent.objects.count() + StudySphereUser.objects.count())
+        self.assertEqual(SearchEntry.objects.get(kind=search.COURSE, object_id=self.maths.id).title, 'Kept')
+        search.fallback_index.reset()
+        self.assertEqual(self.names(search.search('john smi', kinds=[search.USER])), [('user', 'mrsmith')])
+
+    # Tests the search page and the user search that now goes through the index
+    def test_search_views(self):
+        self.client.force_login(self.teacher)
+        response = self.client.get(reverse('search'), {'query': 'mechanics', 'kind': 'course'})
+        self.assertContains(response, 'Course: Physics')
+        response = self.client.get(reverse('user_search'), {'query': 'Smith'})
+        self.assertEqual(response.context['users'], [self.teacher])
+
+# Tests the user autocomplete used by the user search box
+class UserAutocompleteTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        autocomplete.prefix_cache.clear()
+        self.teacher = StudySphereUser.objects.create(username='teacher', email='teacher@example.com', auth_level='teacher')
+        self.anna = StudySphereUser.objects.create(username='anna', email='anna@example.com', first_name='Anna', last_name='Jones')
+        self.ben = StudySphereUser.objects.create(username='ben', email='ben@example.com', first_name='Ben', last_name='Annable')
+
+    # Tests that username matches come before name matches and that short prefixes aren't looked up
+    def test_suggestions(self):
+        self.assertEqual([user['username'] for user in autocomplete.suggest_users('ANN')], ['anna', 'ben'])
+        self.assertEqual(autocomplete.suggest_users('a'), [])
+        suggestion = autocomplete.suggest_users('be')[0]
+        self.assertEqual(suggestion, {'id': self.ben.id, 'username': 'ben', 'thumbnail': self.ben.profile_picture.url})
+
+    # Tests that suggestions are capped
+    def test_limit(self):
+        StudySphereUser.objects.bulk_create([StudySphereUser(username=f'student{i}', email=f'student{i}@example.com') for i in range(15)])
+        self.assertEqual(len(autocomplete.suggest_users('student')), autocomplete.AUTOCOMPLETE_LIMIT)
+
+    # Tests that repeated prefixes are answered from the cache until a user's names change
+    def test_prefix_cache(self):
+        autocomplete.suggest_users('jor')
+        with self.assertNumQueries(0):
+            self.assertEqual(autocomplete.suggest_users('jor'), [])
+        self.ben.save(update_fields=['last_login'])
+        self.assertEqual(autocomplete.suggest_users('jor'), [])
+        self.ben.last_name = 'Jordan'
+        self.ben.save()
+        self.assertEqual([user['username'] for user in autocomplete.suggest_users('jor')], ['ben'])
+
+    # Tests the JSON endpoint
+    def test_autocomplete_view(self):
+        self.client.force_login(self.teacher)
+        response = self.client.get(reverse('user_autocomplete'), {'q': 'anna'})
+        self.assertEqual([user['id'] for user in response.json()['users']], [self.anna.id, self.ben.id])
+
+# Tests the notification inbox, its unread counts and the pruning of old notifications
+class NotificationInboxTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = StudySphereUser.objects.create(username='teacher', email='teacher@example.com', auth_level='teacher')
+        self.student = StudySphereUser.objects.create(username='student', email='student@example.com')
+        self.course = Course.objects.create(name='Maths', description='Numbers', teacher=self.teacher)
+        self.content = CourseContent.objects.create(course=self.course, title='Algebra')
+        self.notifications = [NotificationContent.objects.create(student=self.student, course_content=self.content) for _ in range(5)]
+
+    # Tests that the inbox is paged newest first and renders in the same amount of queries however long it is
+    def test_inbox_pages(self):
+        first, cursor = notifications.get_inbox_page(self.student, page_size=3)
+        second, last_cursor = notifications.get_inbox_page(self.student, cursor, page_size=3)
+        self.assertEqual([n.id for n in first + second], [n.id for n in reversed(self.notifications)])
+        self.assertIsNone(last_cursor)
+        with self.assertRaises(ValueError):
+            notifications.get_inbox_page(self.student, 'invalid')
+
+        self.client.force_login(self.student)
+        self.client.get(reverse('notifications'))
+        with self.assertNumQueries(3):
+            # The session, the user and the page with its content and course
+            response = self.client.get(reverse('notifications'))
+        self.assertContains(response, '(unread)</h2>', count=5)
+
+    # Tests that the unread count is cached until a notification is created or read
+    def test_unread_count(self):
+        self.assertEqual(notifications.get_unread_count(self.student), 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(notifications.get_unread_count(self.student), 5)
+        NotificationContent.objects.create(student=self.student, course_content=self.content)
+        self.assertEqual(notifications.get_unread_count(self.student), 6)
+        self.assertEqual(notifications.mark_read(self.student, [self.notifications[0].id]), 1)
+        self.assertEqual(notifications.get_unread_count(self.student), 5)
+
+    # Tests the JSON inbox and marking every notification read
+    def test_inbox_api(self):
+        self.client.force_login(self.student)
+        data = self.client.get(reverse('notifications_api')).json()
+        self.assertEqual((len(data['notifications']), data['unread_count']), (5, 5))
+        self.assertEqual(data['notifications'][0]['course'], 'Maths')
+        self.assertEqual(self.client.get(reverse('notifications_api'), {'cursor': 'invalid'}).status_code, 400)
+        response = self.client.post(reverse('mark_notifications_read'), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {'marked': 5, 'unread_count': 0})
+
+    # Tests that read notifications are pruned sooner than unread ones
+    def test_prune(self):
+        now = timezone.now()
+        NotificationContent.objects.filter(id=self.notifications[0].id).update(read_at=now - datetime.timedelta(days=31))
+        NotificationContent.objects.filter(id=self.notifications[1].id).update(read_at=now - datetime.timedelta(days=1))
+        NotificationContent.objects.filter(id=self.notifications[2].id).update(created_at=now - datetime.timedelta(days=181))
+        NotificationEnroll.objects.create(student=self.student, teacher=self.teacher, course=self.course, read_at=now - datetime.timedelta(days=60))
+        self.assertEqual(notifications.get_unread_count(self.student), 3)
+        self.assertEqual(prune_notifications(), {'teacher': 1, 'student': 2})
+        self.assertEqual(sorted(NotificationContent.objects.values_list('id', flat=True)), [n.id for n in self.notifications[1:2] + self.notifications[3:]])
+        self.assertEqual(notifications.get_unread_count(self.student), 2)
+
+    # Tests that pruning in batches walks up the ids, deleting every expired notification exactly once
+    def test_prune_batches(self):
+        old = timezone.now() - datetime.timedelta(days=200)
+        NotificationContent.objects.filter(id__in=[n.id for n in self.notifications[:3]]).update(read_at=old)
+        NotificationContent.objects.filter(id__in=[n.id for n in self.notifications[2:4]]).update(created_at=old)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(notifications.prune(batch_size=2)['student'], 4)
+        selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT') and '"id" >' in query['sql']]
+        self.assertTrue(selects)
+        self.assertEqual(list(NotificationContent.objects.values_list('id', flat=True)), [n.id for n in self.notifications[4:]])
+
+# Tests that new notifications are pushed to their recipients' websockets
+class NotificationPushTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = StudySphereUser.objects.create(username='teacher', email='teacher@example.com', auth_level='teacher')
+        self.student = StudySphereUser.objects.create(username='student', email='student@example.com')
+        self.course = Course.objects.create(name='Maths', description='Numbers', teacher=self.teacher)
+        self.course.students.add(self.student)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/notifications/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def enroll(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationEnroll.objects.create(student=self.student, teacher=self.teacher, course=self.course)
+
+    # Tests that a teacher gets their unread count on connecting and enrollments as they happen
+    async def test_enrollment_pushed(self):
+        teacher = await self.connect(self.teacher)
+        self.assertEqual(await teacher.receive_json_from(), {'type': 'unread', 'unread_count': 0})
+        await sync_to_async(self.enroll)()
+        message = await teacher.receive_json_from()
+        self.assertEqual((message['type'], message['notification']['student'], message['notification']['course']), ('notification', 'student', 'Maths'))
+        await teacher.disconnect()
+
+    # Tests that new content notifications created in bulk are pushed to each enrolled student only
+    @patch('courses.tasks.send_emails.delay')
+    async def test_content_pushed(self, mock_delay):
+        content = await CourseContent.objects.acreate(course=self.course, title='Algebra')
+        student = await self.connect(self.student)
+        teacher = await self.connect(self.teacher)
+        await student.receive_json_from()
+        await teacher.receive_json_from()
+        await sync_to_async(notify_new_content)(content.id)
+        message = await student.receive_json_from()
+        self.assertEqual((message['notification']['type'], message['notification']['content']), ('content', 'Algebra'))
+        self.assertTrue(await teacher.receive_nothing())
+        await student.disconnect()
+        await teacher.disconnect()
+
+    # Tests that anonymous users can't connect
+    async def test_anonymous_rejected(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/notifications/')
+        communicator.scope['user'] = AnonymousUser()
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+# Tests the bulk import of students from a CSV roster
+class RosterImportTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = StudySphereUser.objects.create(username='teacher', email='teacher@example.com', auth_level='teacher')
+        self.course = Course.objects.create(name='Maths', description='Numbers', teacher=self.teacher)
+        self.students = StudySphereUser.objects.bulk_create([StudySphereUser(username=f'student{i}', email=f'student{i}@example.com') for i in range(6)])
+        self.course.students.add(self.students[0])
+
+    def roster(self, text):
+        return read_roster(BytesIO(text.encode()))
+
+    # Tests that students are matched by username or email and problem rows are reported
+    @patch('courses.roster.send_emails.delay')
+    def test_import(self, mock_delay):
+        text = 'username,email\nstudent0,\nstudent1,\n,STUDENT2@example.com\nstudent3,\nstudent3,\nmissing,\nteacher,\n,\n'
+        with self.captureOnCommitCallbacks(execute=True):
+            report = import_roster(self.course, self.roster(text), batch_size=3)
+        self.assertEqual(
+            {key: value for key, value in report.items() if key != 'problems'},
+            {'rows': 8, 'enrolled': 3, 'already_enrolled': 1, 'not_found': 1, 'not_students': 1, 'invalid': 1, 'error': None},
+        )
+        self.assertEqual([(problem['line'], problem['reason']) for problem in report['problems']], [(7, 'not_found'), (8, 'not_students'), (9, 'invalid')])
+        self.assertEqual(set(self.course.students.values_list('username', flat=True)), {'student0', 'student1', 'student2', 'student3'})
+        self.assertEqual(NotificationEnroll.objects.filter(teacher=self.teacher).count(), 3)
+        # One email job per batch for its new students
+        self.assertEqual(
+            [sorted(call.args[2]) for call in mock_delay.call_args_list],
+            [['student1@example.com', 'student2@example.com'], ['student3@example.com']],
+        )
+
+    # Tests that a roster failing to be read part way keeps the batches before it and reports the error with them
+    @patch('courses.roster.send_emails.delay')
+    def test_import_read_error(self, mock_delay):
+        def rows():
+            for i in range(1, 4):
+                yield i + 1, {'username': f'student{i}'}
+            raise csv.Error('line 5: unexpected end of data')
+        with self.captureOnCommitCallbacks(execute=True):
+            report = import_roster(self.course, rows(), batch_size=2)
+        self.assertEqual((report['rows'], report['enrolled'], report['error']), (3, 3, 'line 5: unexpected end of data'))
+        self.assertEqual(self.course.students.count(), 4)
+        self.assertEqual(sorted(email for call in mock_delay.call_args_list for email in call.args[2]), ['student1@example.com', 'student2@example.com', 'student3@example.com'])
+
+    # Tests that the command reports the rows enrolled before the file failed to read and then fails
+    @patch('courses.roster.send_emails.delay')
+    def test_import_command_read_error(self, mock_delay):
+        with tempfile.NamedTemporaryFile(suffix='.csv') as file:
+            # The file is decoded in chunks, so the bad byte comes after the first of them
+            file.write(b'username\nstudent1\n' + b'missing\n' * 2000 + b'\xff\n')
+            file.flush()
+            out = StringIO()
+            with self.assertRaises(CommandError):
+                call_command('import_roster', self.course.id, file.name, stdout=out)
+        self.assertRegex(out.getvalue(), r'Done: \d+ rows, 1 enrolled')
+        self.assertTrue(self.course.students.filter(username='student1').exists())
+
+    # Tests that a batch takes the same amount of queries however many rows it has
+    @patch('courses.roster.send_emails.delay')
+    def test_batch_queries(self, mock_delay):
+        text = 'email\n' + ''.join(f'student{i}@example.com\n' for i in range(1, 6))
+        # Resolving the users, the savepoint and its release, finding existing enrollments before and after inserting them and the two inserts
+        with self.assertNumQueries(7):
+            report = import_roster(self.course, self.roster(text))
+        self.assertEqual(report['enrolled'], 5)
+
+    # Tests that the teacher's websockets are sent the new notifications once the import is committed, without a query per notification
+    @patch('courses.roster.send_emails.delay')
+    @patch('courses.roster.notifications.push')
+    def test_import_pushes_notifications(self, mock_push, mock_delay):
+        with self.captureOnCommitCallbacks() as callbacks:
+            import_roster(self.course, self.roster('username\nstudent0\nstudent1\nstudent2\n'))
+        mock_push.assert_not_called()
+        for callback in callbacks:
+            callback()
+        pushed = [notification for call in mock_push.call_args_list for notification in call.args[0]]
+        with self.assertNumQueries(0):
+            self.assertEqual(sorted(notifications.serialize_notification(notification)['student'] for notification in pushed), ['student1', 'student2'])
+
+    # Tests the upload page, which only the course's teacher can use
+    @patch('courses.roster.send_emails.delay')
+    def test_import_view(self, mock_delay):
+        url = reverse('import_roster', args=[self.course.id])
+        self.client.force_login(self.students[1])
+        self.assertRedirects(self.client.get(url), '/courses/not_authorized', fetch_redirect_response=False)
+        self.client.force_login(self.teacher)
+        response = self.client.post(url, {'roster': SimpleUploadedFile('roster.csv', b'username\nstudent4\n', content_type='text/csv')})
+        self.assertEqual(response.context['report']['enrolled'], 1)
+        response = self.client.post(url, {'roster': SimpleUploadedFile('roster.csv', b'name\nstudent4\n', content_type='text/csv')})
+        self.assertEqual(response.context['errors'], 'The roster needs a username or email column')
+        response = self.client.post(url, {'roster': SimpleUploadedFile('roster.csv', b'username\nstudent5\n\xff\n', content_type='text/csv')})
+        self.assertEqual(response.context['report']['rows'], 0)
+        self.assertIn('utf-8', response.context['errors'])
+
+class RosterRemovalTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = StudySphereUser.objects.create(username='teacher', email='teacher@example.com', auth_level='teacher')
+        self.course = Course.objects.create(name='Maths', description='Numbers', teacher=self.teacher)
+        self.students = StudySphereUser.objects.bulk_create([
+            StudySphereUser(username=f'student{i}', email=f'student{i}@example.com', first_name='Ada' if i % 2 else 'Alan') for i in range(6)
+        ])
+        self.course.students.add(*self.students)
+
+    # Tests that the roster is filtered and paged, out of range pages giving the last page
+    def test_roster_page(self):
+        page = get_roster_page(self.course, 'ada', page_size=2)
+        self.assertEqual([student.username for student in page['students']], ['student1', 'student3'])
+        self.assertEqual((page['count'], page['num_pages'], page['has_next']), (3, 2, True))
+        page = get_roster_page(self.course, page_number=9, page_size=4)
+        self.assertEqual([student.username for student in page['students']], ['student4', 'student5'])
+
+    # Tests that removals delete the enrollments and are audited, whatever amount of students are removed
+    def test_remove_students(self):
+        other = Course.objects.create(name='Physics', description='Forces', teacher=self.teacher)
+        other.students.add(self.students[1])
+        ids = [student.id for student in self.students[1:5]] + [self.teacher.id]
+        # The savepoint and its release, reading the enrollments, the delete and the insert
+        with self.assertNumQueries(5):
+            removed = remove_students(self.course, ids, self.teacher)
+        self.assertEqual(sorted(removed), ['student1', 'student2', 'student3', 'student4'])
+        self.assertEqual(set(self.course.students.values_list('username', flat=True)), {'student0', 'student5'})
+        self.assertTrue(other.students.filter(id=self.students[1].id).exists())
+        self.assertEqual(EnrollmentRemoval.objects.filter(course=self.course, removed_by=self.teacher).count(), 4)
+        self.assertEqual(remove_students(self.course, ids, self.teacher), [])
+
+    # Tests removing ticked students through the edit page, which lists the removals
+    def test_edit_course_removes_students(self):
+        self.client.force_login(self.teacher)
+        url = reverse('edit', args=[self.course.id])
+        response = self.client.post(url, {'name': 'Maths', 'description': 'Numbers', 'students_to_remove': [self.students[0].id, self.students[2].id, 'x']})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.course.students.count(), 4)
+        response = self.client.get(url, {'q': 'student'})
+        self.assertEqual(response.context['roster']['count'], 4)
+        self.assertContains(response, 'student2 removed by teacher')
+
+# Tests the cursor paginated comments of a post
+class CommentsTestCase(TestCase):
+    def setUp(self):
+        self.user = StudySphereUser.objects.create_user(username='testuser', password='testpassword', email='tester1@test.com')
+        self.post = Post.objects.create(user=self.user, text='Hello')
+        self.other_post = Post.objects.create(user=self.user, text='Again')
+        self.comments = [Comment.objects.create(user=self.user, post=self.post, text=f'Comment {i}') for i in range(5)]
+        # Two comments share the same timestamp to ensure the id breaks ties
+        Comment.objects.filter(pk__in=[self.comments[2].pk, self.comments[3].pk]).update(created_at=self.comments[2].created_at)
+        Comment.objects.create(user=self.user, post=self.other_post, text='Elsewhere')
+
+    # Ensures that walking every page returns each comment exactly once, oldest first, with its author in the same query
+    def test_pages_cover_all_comments_in_order(self):
+        seen = []
+        cursor = None
+        while True:
+            with self.assertNumQueries(1):
+                comments, cursor = get_comments_page(self.post.id, cursor, page_size=2)
+                seen.extend((comment.text, comment.user.username) for comment in comments)
+            if not cursor:
+                break
+        self.assertEqual(seen, [(f'Comment {i}', 'testuser') for i in range(5)])
+
+    # Ensures that the counts of many posts come from a single query
+    def test_comment_counts(self):
+        empty_post = Post.objects.create(user=self.user, text='Quiet')
+        with self.assertNumQueries(1):
+            counts = get_comment_counts([self.post.id, self.other_post.id, empty_post.id])
+        self.assertEqual(counts, {self.post.id: 5, self.other_post.id: 1})
+
+    # Tests the comments page and the JSON endpoint, including bad cursors and missing posts
+    def test_comment_views(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('view_comments', args=[self.post.id]))
+        self.assertEqual(response.context['comment_count'], 5)
+        self.assertEqual(len(response.context['comments']), 5)
+        response = self.client.get(reverse('comments_api', args=[self.post.id]), {'cursor': encode_cursor(self.comments[3].created_at, self.comments[3].id)})
+        self.assertEqual([comment['text'] for comment in response.json()['comments']], ['Comment 4'])
+        self.assertIsNone(response.json()['next_cursor'])
+        response = self.client.get(reverse('comments_api', args=[self.post.id]), {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('view_comments', args=[0])).status_code, 404)
+
+# Factories used to seed realistic amounts of data for the query budget tests
+def make_students(count, prefix):
+    return StudySphereUser.objects.bulk_create([StudySphereUser(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com') for i in range(count)])
+
+def make_contents(course, count, prefix):
+    contents = CourseContent.objects.bulk_create([CourseContent(course=course, title=f'{prefix} {i}') for i in range(count)])
+    now = timezone.now()
+    CourseDeadline.objects.bulk_create([CourseDeadline(content=content, deadline=now + datetime.timedelta(days=1 + i % 20)) for i, content in enumerate(contents)])
+    return contents
+
+def make_posts(users, count, prefix, comments_per_post=2):
+    posts = Post.objects.bulk_create([Post(user=users[i % len(users)], text=f'{prefix} {i}') for i in range(count)])
+    Comment.objects.bulk_create([Comment(user=users[i % len(users)], post=post, text=f'Reply {i}') for post in posts for i in range(comments_per_post)])
+    return posts
+
+# Tests that the hot views run a fixed amount of queries however much data they show, so that an N+1 fails here
+# Each view is requested with a cold cache, the data is grown, and the view is requested again
+class QueryBudgetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = StudySphereUser.objects.create(username='teacher', email='teacher@example.com', auth_level='teacher')
+        self.student = StudySphereUser.objects.create(username='student', email='student@example.com')
+        self.course = Course.objects.create(name='Maths', description='Numbers', teacher=self.teacher)
+        self.course.students.add(self.student)
+        self.content = CourseContent.objects.create(course=self.course, title='Algebra')
+        self.seeded = 0
+        self.seed(2)
+
+    # Adds size more of everything: courses the student is on, content with deadlines, students with submissions,
+    # feedback and notifications, and posts with comments
+    def seed(self, size):
+        prefix = f'seed{self.seeded}_'
+        self.seeded += 1
+        students = make_students(size, prefix)
+        self.course.students.add(*students)
+        for i in range(size):
+            course = Course.objects.create(name=f'{prefix}course {i}', description='More numbers', teacher=self.teacher)
+            course.students.add(self.student)
+            make_contents(course, 2, prefix)
+        contents = make_contents(self.course, size, prefix)
+        Submission.objects.bulk_create([Submission(student=student, content=self.content, submission_text='Answer') for student in students])
+        CourseFeedback.objects.bulk_create([CourseFeedback(user=student, course=self.course, text='Great') for student in students])
+        NotificationEnroll.objects.bulk_create([NotificationEnroll(course=self.course, student=student, teacher=self.teacher) for student in students])
+        NotificationContent.objects.bulk_create([NotificationContent(student=self.student, course_content=content) for content in contents])
+        make_posts(students + [self.teacher], size, prefix)
+
+    def count_queries(self, user, url):
+        cache.clear()
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    # Asserts that a view runs the same amount of queries before and after the data grows, and no more than budget
+    def assertQueryBudget(self, budget, user, url):
+        small = self.count_queries(user, url)
+        self.seed(25)
+        large = self.count_queries(user, url)
+        self.assertEqual(large, small, f'{url} ran {small} queries before the data grew and {large} after')
+        self.assertLessEqual(large, budget, f'{url} ran {large} queries, its budget is {budget}')
+
+    # The session, the user, the feed, its comment counts, the unread count, the enrolled courses and the deadlines
+    def test_homepage_student(self):
+        self.assertQueryBudget(7, self.student, reverse('homepage'))
+
+    # The session, the user, the feed, its comment counts, the unread count, the active students and the created courses
+    def test_homepage_teacher(self):
+        self.assertQueryBudget(7, self.teacher, reverse('homepage'))
+
+    # The session, the user, the course, its content and its feedback along with who left it
+    def test_view_course_details(self):
+        self.assertQueryBudget(5, self.teacher, reverse('view', args=[self.course.id]))
+
+    # The session, the user, a page of the inbox along with what it links to and the unread count
+    def test_show_notifications_teacher(self):
+        self.assertQueryBudget(4, self.teacher, reverse('notifications'))
+
+    def test_show_notifications_student(self):
+        self.assertQueryBudget(4, self.student, reverse('notifications'))
+
+    # The session, the user and the submissions along with their students
+    def test_view_submissions(self):
+        self.assertQueryBudget(3, self.teacher, reverse('view_submissions', args=[self.content.id]))
+
+    # With every section cached the homepage only loads the session and the user
+    def test_homepage_warm_cache(self):
+        self.client.force_login(self.student)
+        self.client.get(reverse('homepage'))
+        with self.assertNumQueries(2):
+            self.client.get(reverse('homepage'))
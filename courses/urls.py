@@ -9,10 +9,13 @@ urlpatterns = [
     path('subscribed/', views.user_subscribed_courses, name='subscribed_courses'),
     path('homepage/', views.homepage, name='homepage'),
     path('post_status_update', views.post_status_update, name='post_status_update'),
+    path('posts/', views.show_status_updates, name='status_updates'),
     path('posts/<int:post_id>/delete/', views.delete_post, name='delete_post'),
     path('posts/<int:post_id>/comment/', views.post_comment, name='post_comment'),
     path('posts/<int:post_id>/view_comments/', views.show_comments, name='view_comments'),
+    path('posts/<int:post_id>/comments/', views.comments_api, name='comments_api'),
     path('edit/<int:course_id>/', views.edit_course, name='edit'),
+    path('edit/<int:course_id>/import_roster/', views.import_course_roster, name='import_roster'),
     path('delete_course/<int:course_id>/', views.delete_course, name='delete_course'),
     path('view/<int:course_id>', views.view_course_details, name='view'),
     path('unenroll_course/<int:course_id>/', views.course_unenroll, name='unenroll_course'),
@@ -25,6 +28,10 @@ urlpatterns = [
     path('download_pdf_submission/<int:submission_id>/', views.download_pdf_submission, name='download_pdf_submission'),
     path('delete_content/<int:content_id>/', views.delete_content, name='delete_content'),
     path('notifications/', views.show_notifications, name='notifications'),
-    path('notifications/', views.show_notifications, name='notifications'),
-    path('user_search/', views.user_search, name='user_search')
+    path('notifications/api/', views.notifications_api, name='notifications_api'),
+    path('notifications/read/', views.mark_notifications_read, name='mark_notifications_read'),
+    path('tasks/<str:task_id>/', views.task_status, name='task_status'),
+    path('user_search/', views.user_search, name='user_search'),
+    path('user_search/autocomplete/', views.user_autocomplete, name='user_autocomplete'),
+    path('search/', views.site_search, name='search')
 ]
\ No newline at end of file
@@ -1,10 +1,30 @@
-from django.http import FileResponse, HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, render, redirect
-from .forms import CourseContentForm, CourseContentSubmissionForm, CourseCreationForm, CourseDeadlineForm, CourseEditForm, StatusUpdateForm, CommentForm, CourseFeedbackForm, UserSearchForm
+from django.urls import reverse
+from .forms import CourseContentForm, CourseContentSubmissionForm, CourseCreationForm, CourseDeadlineForm, CourseEditForm, StatusUpdateForm, CommentForm, CourseFeedbackForm, UserSearchForm, SearchForm, RosterImportForm
 from .models import Course, NotificationContent, NotificationEnroll, Post, Comment, CourseContent, Submission, CourseDeadline, CourseFeedback, StudySphereUser
 from django.contrib import messages
-from .tasks import send_emails
+from .tasks import send_emails, notify_new_content
+from .catalog import get_catalog_page
+from .comments import get_comment_counts, get_comments_page, serialize_comment
+from .feed import get_feed_page
+from .files import serve_file
+from .roster import get_roster_page, import_roster, read_roster, remove_students
+from . import cache as homepage_cache
+from . import autocomplete, notifications, search
 from django.contrib.auth.decorators import login_required
+from django.utils import timezone
+from django.db import transaction
+from celery.result import AsyncResult
+from celery.utils import uuid
+import datetime
+
+# How far ahead (in days) and how many deadlines are shown on the student homepage
+DEADLINE_WINDOW_DAYS = 30
+DEADLINE_LIMIT = 20
+
+# How many of a course's latest student removals are shown when editing it
+RECENT_REMOVALS = 10
 
 # This view is to be called whenever an unauthorized request is made
 def not_authorized(request):
@@ -19,12 +39,12 @@ def view_all_courses(request, mode=""):
         courses = Course.objects.all()
         return courses
     else:
-        courses_enrolled = user_subscribed_courses(request)
-        courses = Course.objects.all()
+        if not request.user.is_authenticated:
+            return render(request, 'courses.html', {'courses': []})
 
-        # Excludes all courses currently already enrolled in
-        available_courses = courses.exclude(id__in=courses_enrolled.values_list('id', flat=True))
-        return render(request, 'courses.html', {'courses': available_courses})
+        # A page of all courses, excluding those currently already enrolled in
+        catalog = get_catalog_page(request.GET.get('page'), user=request.user)
+        return render(request, 'courses.html', {'courses': catalog['courses'], 'catalog': catalog})
 
 # This view allows for creation of courses
 @login_required
@@ -72,27 +92,58 @@ def edit_course(request, course_id):
                     if banner_image:
                         course.banner_image = banner_image
                         course.save()
-                    # Also displays students that are in the course that the teacher can then remove
-                    students_to_remove = request.POST.getlist('students_to_remove')
-                    for student_id in students_to_remove:
-                        # Removes student from the course
-                        course.students.remove(int(student_id))
+                    # Students ticked on the roster are removed from the course together
+                    students_to_remove = [int(student_id) for student_id in request.POST.getlist('students_to_remove') if student_id.isdigit()]
+                    if students_to_remove:
+                        removed = remove_students(course, students_to_remove, request.user)
+                        if removed:
+                            messages.success(request, f'Removed {len(removed)} student(s) from {course.name}')
                     return redirect('/courses/courses', course_id=course_id)
                 else:
                     # If invalid data is provided return the errors and the form again
                     errors = form.errors
                     form = CourseEditForm(instance=course)
-                    return render(request, 'edit_course.html', {'form': form, 'course': course, 'errors': errors})
+                    return render(request, 'edit_course.html', _edit_course_context(request, course, form, errors))
             else:
                 # This occurs when method is GET
                 form = CourseEditForm(instance=course)
-                return render(request, 'edit_course.html', {'form': form, 'course': course})
+                return render(request, 'edit_course.html', _edit_course_context(request, course, form))
     # These cases occur then the user lacks the necessary permisssions
         else:
             return redirect('/courses/not_authorized')
     else:
         return redirect('/courses/not_authorized')
 
+# Returns what the edit course page shows: the form, a page of the roster filtered by ?q= and the latest removals
+def _edit_course_context(request, course, form, errors=None):
+    return {
+        'form': form,
+        'course': course,
+        'errors': errors,
+        'roster': get_roster_page(course, request.GET.get('q', ''), request.GET.get('page')),
+        'removals': course.removals.select_related('removed_by').order_by('-removed_at', '-id')[:RECENT_REMOVALS],
+    }
+
+# Allows the teacher of a course to enroll students in bulk by uploading a CSV roster
+# The file is read and enrolled in batches and the page shows a report of the import
+@login_required
+def import_course_roster(request, course_id):
+    course = get_object_or_404(Course, id=course_id)
+    if request.user != course.teacher or request.user.auth_level != 'teacher':
+        return redirect('/courses/not_authorized')
+    report = None
+    errors = None
+    if request.method == 'POST':
+        form = RosterImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            # A file that fails part way through is reported up to where it failed, along with why
+            report = import_roster(course, read_roster(form.cleaned_data['roster'].file))
+            errors = report['error']
+        else:
+            errors = form.errors
+    form = RosterImportForm()
+    return render(request, 'import_roster.html', {'form': form, 'course': course, 'report': report, 'errors': errors})
+
 # This view allows for deletion of course
 @login_required
 def delete_course(request, course_id):
@@ -160,19 +211,19 @@ def view_course_details(request, course_id):
         if request.method == "POST":
            course = get_object_or_404(Course, id=course_id)
            # Retrieves all content of the course
-           course_content = CourseContent.objects.filter(course=course_id)
-           # Gets the feedback left by students
+           course_content = CourseContent.objects.filter(course=course_id).only('id', 'title').order_by('id')
+           # Gets the feedback left by students along with who left it
            leave_feedback(request, course) 
-           feedback = CourseFeedback.objects.filter(course_id=course_id)
+           feedback = CourseFeedback.objects.filter(course_id=course_id).select_related('user').order_by('created_at', 'id')
            # Sets the form
            form = CourseFeedbackForm
            return render(request, 'view_course.html', {'course': course, 'course_content': course_content, 'form': form, 'feedback': feedback})
         else:    
             # in the case of a get request being sent
             course = get_object_or_404(Course, id=course_id)
-            course_content = CourseContent.objects.filter(course=course_id)
+            course_content = CourseContent.objects.filter(course=course_id).only('id', 'title').order_by('id')
             form = CourseFeedbackForm
-            feedback = CourseFeedback.objects.filter(course_id=course_id)
+            feedback = CourseFeedback.objects.filter(course_id=course_id).select_related('user').order_by('created_at', 'id')
             return render(request, 'view_course.html', {'course': course, 'course_content': course_content, 'form': form, 'feedback': feedback})
     else:
         return redirect('/courses/not_authorized')
@@ -208,13 +259,12 @@ def add_course_content(request, course_id):
             deadline.content = content
             deadline.save()
 
-            # Gets all enrolled students and sends them emails via a Celery Service worker
-            enrolled_students = course.students.all()
-            recipients = []
-            for student in enrolled_students:
-                recipients.append(student.email)
-                NotificationContent.objects.create(student=student, course_content=content)
-            send_emails.delay('New course content added!' ,f'New content added on course {content.course.name} \nContent: {content.title},\nDescription: {content.content_text}\nDeadline:{deadline.deadline}', recipients)
+            # Notifies all enrolled students via a Celery Service worker once the content is committed
+            # The task id is generated upfront so that the teacher can poll its progress straight away
+            task_id = uuid()
+            transaction.on_commit(lambda: notify_new_content.apply_async(args=[content.id], task_id=task_id))
+            request.session['notification_task_id'] = task_id
+            remember_task(request, task_id)
             return redirect('/courses/homepage/') # Redirects to learning homepage
     else:
         # in the case of a get request
@@ -235,25 +285,28 @@ def delete_content(request, content_id):
         return redirect('/courses/not_authorized')
 
 # Home page function that displays all data to users
+# Each section of the page is cached and invalidated by the receivers in signals.py
 @login_required
 def homepage(request):
     if request.user.is_authenticated:
+        user_id = request.user.id
+        posts, next_cursor = homepage_cache.get_section(homepage_cache.FEED, None, get_feed_page)
+        form = StatusUpdateForm
+        # The amount of unread notifications shown on the nav badge, cached per user
+        unread_notifications = notifications.get_unread_count(request.user)
         if request.user.auth_level == 'student':
             # Gets courses that they have enrolled in, posts, deadlines and the forms
-            enrolled_courses = user_subscribed_courses(request)
-            posts = show_status_updates(request)
-            form = StatusUpdateForm
-            deadlines = get_course_content_with_deadline(request)
-            sorted_deadlines = sorted(deadlines, key=lambda x: x[0].deadline)
-            return render(request, 'homepage.html', {'enrolled_courses': enrolled_courses, 'posts': posts, 'form': form, 'deadlines': sorted_deadlines})
+            enrolled_courses = homepage_cache.get_section(homepage_cache.ENROLLED_COURSES, user_id, lambda: list(user_subscribed_courses(request)))
+            deadlines = homepage_cache.get_section(homepage_cache.DEADLINES, user_id, lambda: list(get_upcoming_deadlines(request)))
+            return render(request, 'homepage.html', {'enrolled_courses': enrolled_courses, 'posts': posts, 'next_cursor': next_cursor, 'form': form, 'deadlines': deadlines, 'unread_notifications': unread_notifications})
         else:
             # In the case that a teacher accesses their homepage get the relevant details
-            active_students = get_active_students(request)
-            created_courses = user_created_courses(request)
-            posts = show_status_updates(request)
-            form = StatusUpdateForm
+            active_students = homepage_cache.get_section(homepage_cache.ACTIVE_STUDENTS, None, lambda: list(get_active_students(request)))
+            created_courses = homepage_cache.get_section(homepage_cache.CREATED_COURSES, user_id, lambda: list(user_created_courses(request)))
             searchform = UserSearchForm
-            return render(request, 'homepage.html', {'created_courses': created_courses, 'posts': posts, 'form': form, 'searchform': searchform, 'active_students': active_students})
+            # The id of a notification fan-out started by add_course_content, polled by the page
+            notification_task_id = request.session.pop('notification_task_id', None)
+            return render(request, 'homepage.html', {'created_courses': created_courses, 'posts': posts, 'next_cursor': next_cursor, 'form': form, 'searchform': searchform, 'active_students': active_students, 'notification_task_id': notification_task_id, 'unread_notifications': unread_notifications})
     else:
         return redirect('/courses/not_authorized')
 
@@ -286,20 +339,47 @@ def delete_post(request, post_id):
             messages.error(request, 'You do not have permission to delete this post.')
     return redirect('homepage')
 
-# This function shows status updates and sorts them accordingly
+# This returns a page of status updates as JSON, newest first, used by the homepage to load more posts
 @login_required
 def show_status_updates(request):
-    if request.method == 'GET':
-        posts = Post.objects.all()
-        # Sorts by date created at
-        sorted_posts = sorted(posts, key=lambda x: x.created_at)
-        return sorted_posts
-
-# Used to display comments on a post
+    try:
+        posts, next_cursor = get_feed_page(request.GET.get('cursor'))
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    data = [{
+        'id': post.id,
+        'user': post.user.username,
+        'text': post.text,
+        'created_at': post.created_at.isoformat(),
+        'comment_count': post.comment_count,
+        'comments_url': reverse('view_comments', args=[post.id]),
+    } for post in posts]
+    return JsonResponse({'posts': data, 'next_cursor': next_cursor})
+
+# Used to display comments on a post, oldest first and a page at a time
 @login_required 
 def show_comments(request, post_id):
-    comments = Comment.objects.filter(post_id=post_id)
-    return render(request, 'comment_view.html', {'comments': comments})
+    post = get_object_or_404(Post.objects.select_related('user'), id=post_id)
+    try:
+        page, next_cursor = get_comments_page(post.id, request.GET.get('cursor'))
+    except ValueError:
+        page, next_cursor = get_comments_page(post.id)
+    comment_count = get_comment_counts([post.id]).get(post.id, 0)
+    return render(request, 'comment_view.html', {'post': post, 'comments': page, 'next_cursor': next_cursor, 'comment_count': comment_count})
+
+# Returns a page of a post's comments as JSON, oldest first, along with the post's amount of comments
+@login_required
+def comments_api(request, post_id):
+    post = get_object_or_404(Post.objects.only('id'), id=post_id)
+    try:
+        page, next_cursor = get_comments_page(post.id, request.GET.get('cursor'))
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({
+        'comments': [serialize_comment(comment) for comment in page],
+        'next_cursor': next_cursor,
+        'comment_count': get_comment_counts([post.id]).get(post.id, 0),
+    })
 
 # Facilitates posting of comments 
 @login_required
@@ -327,10 +407,8 @@ def download_pdf(request, content_id):
     content = get_object_or_404(CourseContent, id=content_id)
     pdf_file = content.pdf_files
     if pdf_file:
-        # Open the PDF file and serve it as a FileResponse
-        response = FileResponse(open(pdf_file.path, 'rb'), content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="{pdf_file.name}"'
-        return response
+        # Serves the PDF file with caching validators and range support
+        return serve_file(request, pdf_file)
     else:
         # Handle case where PDF file does not exist
         return HttpResponse("PDF file not found", status=404)
@@ -340,10 +418,8 @@ def download_pdf_submission(request, submission_id):
     submission = get_object_or_404(Submission, id=submission_id)
     pdf_file = submission.pdf_files
     if pdf_file:
-        # Open the PDF file and serve it as a FileResponse
-        response = FileResponse(open(pdf_file.path, 'rb'), content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="{pdf_file.name}"'
-        return response
+        # Serves the PDF file with caching validators and range support
+        return serve_file(request, pdf_file)
     else:
         # Handle case where PDF file does not exist
         return HttpResponse("PDF file not found", status=404)
@@ -361,35 +437,17 @@ def leave_feedback(request, course):
     else:
         return(form.errors)
     
-# Gets all deadlines of a user on courses that they are enrolled to
-def get_deadlines(request):
-    if request.user.is_authenticated:
-        deadlines = []
-        courses = user_subscribed_courses(request)
-        
-        if courses:
-            for course in courses:
-                content = CourseContent.objects.filter(course = course.id)
-                for content_item in content:
-                    deadline = get_course_content_deadline(content_id=content_item.id)
-                    for date in deadline:
-                        deadlines.append(date.deadline)           
-        return deadlines
-
-    else:
-        return redirect('homepage')
-
-# Gets a specified course content and its deadline
-@login_required
-def get_course_content_with_deadline(request):
-    courses = user_subscribed_courses(request)
-    deadlines = []
-    for course in courses:
-        course_contents = CourseContent.objects.filter(course=course.id)
-        for content in course_contents:
-            content_deadline = CourseDeadline.objects.filter(content = content.id)
-            deadlines.append(content_deadline)
-
+# Gets the upcoming deadlines on all courses that a user is enrolled to
+# This is a single joined query ordered by the database, windowed to deadlines due within the next
+# `days` days and capped at `limit` rows. The content and its course are fetched alongside each deadline.
+def get_upcoming_deadlines(request, days=DEADLINE_WINDOW_DAYS, limit=DEADLINE_LIMIT):
+    now = timezone.now()
+    deadlines = CourseDeadline.objects.filter(content__course__students=request.user, deadline__gte=now)
+    if days is not None:
+        deadlines = deadlines.filter(deadline__lte=now + datetime.timedelta(days=days))
+    deadlines = deadlines.select_related('content__course').order_by('deadline', 'id')
+    if limit is not None:
+        deadlines = deadlines[:limit]
     return deadlines
 
 # Gets all active students through a simple query
@@ -404,22 +462,66 @@ def get_active_students(request):
     else: 
         return "Not authorized!"
     
+# The ids of the latest tasks started by a session are kept in it, only those tasks' states can be polled
+STARTED_TASKS_KEPT = 20
+
+def remember_task(request, task_id):
+    request.session['started_task_ids'] = [*request.session.get('started_task_ids', []), task_id][-STARTED_TASKS_KEPT:]
+
+# Returns the state of a background task such as a notification fan-out so that the UI can poll it
+# Tasks started by other sessions are answered with a 404, as their results aren't theirs to read
+@login_required
+def task_status(request, task_id):
+    if task_id not in request.session.get('started_task_ids', []):
+        return JsonResponse({'error': 'Unknown task'}, status=404)
+    result = AsyncResult(task_id)
+    data = {'task_id': task_id, 'state': result.state, 'ready': result.ready()}
+    if result.successful():
+        data['result'] = result.result
+    return JsonResponse(data)
+
 # Retrieves notifications based on auth_level
 @login_required
 def show_notifications(request):
     if request.user.is_authenticated:
-
-        if request.user.auth_level == 'teacher':
-            # Get enrollment notifications
-            notifications = NotificationEnroll.objects.filter(teacher_id = request.user)
-            return render(request, 'notifications.html', {'notifications': notifications})
-        else:
-            # Get new content notifications
-            notifications = NotificationContent.objects.filter(student_id=request.user)    
-            return render(request, 'notifications.html', {'notifications': notifications})
+        # Teachers get enrollment notifications and students new content notifications, a page at a time
+        try:
+            page, next_cursor = notifications.get_inbox_page(request.user, request.GET.get('cursor'))
+        except ValueError:
+            page, next_cursor = notifications.get_inbox_page(request.user)
+        unread_count = notifications.get_unread_count(request.user)
+        return render(request, 'notifications.html', {'notifications': page, 'next_cursor': next_cursor, 'unread_count': unread_count})
     else:
         return redirect('/courses/not_authorized')
 
+# Returns a page of the user's notifications as JSON along with their unread count
+@login_required
+def notifications_api(request):
+    try:
+        page, next_cursor = notifications.get_inbox_page(request.user, request.GET.get('cursor'))
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({
+        'notifications': [notifications.serialize_notification(notification) for notification in page],
+        'next_cursor': next_cursor,
+        'unread_count': notifications.get_unread_count(request.user),
+    })
+
+# Marks the user's notifications as read, only those posted as ids when any are posted
+# Answers with the new unread count as JSON, or redirects back to the inbox for form submissions
+@login_required
+def mark_notifications_read(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    try:
+        ids = [int(notification_id) for notification_id in request.POST.getlist('ids')] or None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid notification id'}, status=400)
+    marked = notifications.mark_read(request.user, ids)
+    if request.headers.get('Accept') == 'application/json':
+        return JsonResponse({'marked': marked, 'unread_count': notifications.get_unread_count(request.user)})
+    return redirect('notifications')
+
 # Facilitates searching of a user
 @login_required
 def user_search(request):
@@ -428,12 +530,29 @@ def user_search(request):
         # Verifies that form is valid before querying
         if form.is_valid():
             query = form.cleaned_data['query']
-            users = StudySphereUser.objects.filter(username__icontains=query)
+            # Users are looked up in the search index by their username and names, best matches first
+            page = search.search(query, kinds=[search.USER])
+            users = [result['object'] for result in page['results']]
             return render(request, 'user_search_results.html', {'form': form, 'users': users})
     else:
         form = UserSearchForm()
     return redirect('homepage')
 
+# Suggests users as a teacher types in the user search box, returned as JSON
+@login_required
+def user_autocomplete(request):
+    return JsonResponse({'users': autocomplete.suggest_users(request.GET.get('q', ''))})
+
+# Searches courses, course content and users, returning a page of ranked results
+@login_required
+def site_search(request):
+    form = SearchForm(request.GET)
+    page = None
+    if form.is_valid():
+        kind = form.cleaned_data['kind']
+        page = search.search(form.cleaned_data['query'], kinds=[kind] if kind else None, page_number=request.GET.get('page'))
+    return render(request, 'search_results.html', {'form': form, 'page': page})
+
 # Facilitates creation of a submission on a course content
 @login_required
 def create_submission(request, content_id):
@@ -460,7 +579,8 @@ def create_submission(request, content_id):
 def view_submissions(request, content_id):
     if request.user.is_authenticated:
         if request.user.auth_level == 'teacher':
-            submissions = Submission.objects.filter(content=content_id)
+            # The students are fetched alongside their submissions as the page lists their usernames
+            submissions = Submission.objects.filter(content=content_id).select_related('student').order_by('submitted_at', 'id')
             if request.method == 'GET':
                 return render(request, 'view_submissions.html', {'submissions': submissions})
         else:
@@ -0,0 +1,30 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+# Case-insensitive prefix lookups (istartswith) on PostgreSQL compare UPPER(column) with LIKE,
+# which a trigram GIN index over the same expressions can answer. Other databases are left as they are.
+def create_name_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX users_studysphereuser_names_trgm ON users_studysphereuser '
+            'USING GIN (UPPER(username) gin_trgm_ops, UPPER(first_name) gin_trgm_ops, UPPER(last_name) gin_trgm_ops)'
+        )
+
+
+def drop_name_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS users_studysphereuser_names_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        # Only runs on PostgreSQL
+        TrigramExtension(),
+        migrations.RunPython(create_name_trigram_index, drop_name_trigram_index),
+    ]